@@ -0,0 +1,104 @@
+"""
+compares FastAPI's default response path (validating the returned model,
+jsonable_encoder and json.dumps) with returning a FastJSONResponse, for a
+1000-row /spend/logs page and a 4k-token completion.
+
+Both are served in-process through httpx's ASGI transport, from objects
+built up front, so only the response encoding differs.
+
+    poetry run python benchmarks/json_responses.py --requests 200
+"""
+
+import argparse
+import asyncio
+import time
+from uuid import uuid4
+
+from fastapi import FastAPI
+from httpx import ASGITransport, AsyncClient
+from litellm import acompletion
+
+from llm_freeway.api import EventLogResponse
+from llm_freeway.database import EventLog
+from llm_freeway.responses import FastJSONResponse
+
+
+def make_page(rows: int) -> EventLogResponse:
+    user_id = uuid4()
+    items = [
+        EventLog(
+            user_id=user_id,
+            model="gpt-4o",
+            response_id=f"chatcmpl-{i}",
+            prompt_tokens=200,
+            completion_tokens=100,
+            cost_usd=0.1,
+        )
+        for i in range(rows)
+    ]
+    return EventLogResponse(items=items, page=1, size=rows)
+
+
+async def make_completion(tokens: int):
+    return await acompletion(
+        model="gpt-4o",
+        messages=[{"role": "user", "content": "tell me a long story"}],
+        mock_response=" word" * tokens,
+    )
+
+
+def make_app(page: EventLogResponse, completion) -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/before/logs")
+    async def logs_before() -> EventLogResponse:
+        return page
+
+    @app.get("/after/logs", response_model=EventLogResponse)
+    async def logs_after() -> FastJSONResponse:
+        return FastJSONResponse(page)
+
+    @app.get("/before/completion")
+    async def completion_before():
+        return completion
+
+    @app.get("/after/completion")
+    async def completion_after() -> FastJSONResponse:
+        return FastJSONResponse(completion)
+
+    return app
+
+
+async def run(client: AsyncClient, path: str, requests: int) -> float:
+    await client.get(path)
+    start = time.perf_counter()
+    for _ in range(requests):
+        response = await client.get(path)
+        response.raise_for_status()
+    return (time.perf_counter() - start) / requests * 1000
+
+
+async def main(requests: int, rows: int, tokens: int):
+    app = make_app(make_page(rows), await make_completion(tokens))
+    async with AsyncClient(
+        transport=ASGITransport(app=app), base_url="http://test"
+    ) as client:
+        for name, path in (
+            (f"{rows}-row logs page", "logs"),
+            (f"{tokens}-token completion", "completion"),
+        ):
+            before = await run(client, f"/before/{path}", requests)
+            after = await run(client, f"/after/{path}", requests)
+            print(
+                f"{name:>22}: {before:7.2f}ms before, {after:7.2f}ms after, "
+                f"{before / after:4.1f}x"
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--rows", type=int, default=1000)
+    parser.add_argument("--tokens", type=int, default=4000)
+    args = parser.parse_args()
+    asyncio.run(main(args.requests, args.rows, args.tokens))
@@ -0,0 +1,91 @@
+"""
+measures how many streamed chunks per second one core can push through
+/chat/completions' StreamingResponse, encoding chunks the old way
+(model_dump_json in an f-string), with encode_event, and with encode_event
+plus coalescing.
+
+Chunks come from a mock litellm stream and are sent to an ASGI `send` that
+discards them, so only the proxy's own per-chunk work is measured.
+
+    poetry run python benchmarks/sse_throughput.py --chunks 20000
+"""
+
+import argparse
+import asyncio
+import random
+import string
+import time
+
+from litellm import acompletion
+from starlette.responses import StreamingResponse
+
+from llm_freeway.sse import DONE, SSE_HEADERS, coalesce, encode_event
+
+
+async def get_chunks(chunks: int) -> list:
+    stream = await acompletion(
+        model="gpt-4o",
+        messages=[{"role": "user", "content": "tell me a joke"}],
+        # litellm's mock stream sends three characters per chunk
+        mock_response="".join(
+            random.Random(0).choices(string.ascii_letters, k=3 * chunks)
+        ),
+        stream=True,
+    )
+    return [part async for part in stream][:chunks]
+
+
+async def old_events(parts: list):
+    for part in parts:
+        yield f"data: {part.model_dump_json()}\n\n"
+    yield "data: [DONE]\n\n"
+
+
+async def fast_events(parts: list):
+    for part in parts:
+        yield encode_event(part)
+    yield DONE
+
+
+async def send_response(response: StreamingResponse) -> int:
+    sends = 0
+
+    async def receive():
+        await asyncio.Event().wait()
+
+    async def send(message):
+        nonlocal sends
+        sends += 1
+
+    scope = {"type": "http", "asgi": {"spec_version": "2.4"}}
+    await response(scope, receive, send)
+    return sends
+
+
+async def run(name: str, events, chunks: int):
+    start = time.process_time()
+    sends = await send_response(
+        StreamingResponse(events, media_type="text/event-stream", headers=SSE_HEADERS)
+    )
+    elapsed = time.process_time() - start
+    print(f"{name:>28}: {chunks / elapsed:10.0f} chunks/s/core, {sends:6d} writes")
+
+
+async def main(chunks: int, interval: float):
+    parts = await get_chunks(chunks)
+    print(f"{len(parts)} chunks")
+    await run("model_dump_json", old_events(parts), len(parts))
+    await run("encode_event", fast_events(parts), len(parts))
+    await run(
+        f"encode_event+coalesce({interval}s)",
+        coalesce(fast_events(parts), interval, 16 * 1024),
+        len(parts),
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chunks", type=int, default=20_000)
+    parser.add_argument("--interval", type=float, default=0.005)
+    args = parser.parse_args()
+    asyncio.run(main(args.chunks, args.interval))
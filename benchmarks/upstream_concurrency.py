@@ -0,0 +1,85 @@
+"""
+compares how many upstream calls one event loop can keep in flight when
+litellm is called synchronously (the old behaviour of /chat/completions)
+versus via acompletion.
+
+mock_delay simulates a slow provider, mock_response keeps it offline.
+
+    poetry run python benchmarks/upstream_concurrency.py --requests 100
+"""
+
+import argparse
+import asyncio
+import time
+
+from litellm import acompletion, completion
+
+MESSAGES = [{"role": "user", "content": "tell me a joke"}]
+
+
+async def sync_call(delay: float):
+    return completion(
+        model="gpt-4o",
+        messages=MESSAGES,
+        mock_response="why did the chicken cross the road?",
+        mock_delay=delay,
+    )
+
+
+async def async_call(delay: float):
+    return await acompletion(
+        model="gpt-4o",
+        messages=MESSAGES,
+        mock_response="why did the chicken cross the road?",
+        mock_delay=delay,
+    )
+
+
+async def sync_stream(delay: float):
+    stream = completion(
+        model="gpt-4o",
+        messages=MESSAGES,
+        mock_response="why did the chicken cross the road?",
+        mock_delay=delay,
+        stream=True,
+    )
+    for _ in stream:
+        pass
+
+
+async def async_stream(delay: float):
+    stream = await acompletion(
+        model="gpt-4o",
+        messages=MESSAGES,
+        mock_response="why did the chicken cross the road?",
+        mock_delay=delay,
+        stream=True,
+    )
+    async for _ in stream:
+        pass
+
+
+async def run(func, requests: int, delay: float) -> float:
+    start = time.perf_counter()
+    await asyncio.gather(*(func(delay) for _ in range(requests)))
+    return time.perf_counter() - start
+
+
+async def main(requests: int, delay: float):
+    print(f"{requests} concurrent requests, {delay}s simulated upstream latency")
+    for name, func in (
+        ("completion", sync_call),
+        ("acompletion", async_call),
+        ("completion(stream)", sync_stream),
+        ("acompletion(stream)", async_stream),
+    ):
+        elapsed = await run(func, requests, delay)
+        print(f"{name:>20}: {elapsed:6.2f}s wall, {requests / elapsed:8.1f} requests/s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--delay", type=float, default=0.1)
+    args = parser.parse_args()
+    asyncio.run(main(args.requests, args.delay))
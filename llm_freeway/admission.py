@@ -0,0 +1,233 @@
+import asyncio
+import math
+import time
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+
+from llm_freeway.metrics import metrics
+from llm_freeway.settings import env
+
+metrics.register(
+    "admission_in_flight", "gauge", "upstream calls in flight for each model"
+)
+metrics.register(
+    "admission_queue_depth", "gauge", "requests waiting for an upstream slot"
+)
+metrics.register(
+    "admission_wait_seconds_total",
+    "counter",
+    "seconds admitted requests spent waiting for an upstream slot",
+)
+metrics.register(
+    "admission_admitted_total", "counter", "requests given an upstream slot"
+)
+metrics.register(
+    "admission_rejected_total",
+    "counter",
+    "requests turned away because the queue was full or they waited too long",
+)
+
+
+class AdmissionError(Exception):
+    """the request can't be given an upstream slot, retry after `retry_after`"""
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+@dataclass(eq=False)
+class Waiter:
+    model: str
+    limit: int | None
+    user: str
+    weight: float
+    start: float
+    finish: float
+    future: asyncio.Future
+
+
+class AdmissionControl:
+    """caps the upstream calls in flight, in total and per model
+
+    A request over either limit waits in a queue of at most `queue_size`
+    requests for up to `queue_timeout` seconds. A request that finds the
+    queue full, or runs out of time, is turned away with an `AdmissionError`
+    rather than piling up behind a slow provider. Queue depth, wait time,
+    calls in flight and rejections are exported to /metrics, labelled by
+    model, to size the limits from.
+
+    The queue is shared between users by weighted fair queuing: each request
+    is tagged with a virtual finish time, which advances by `1 / weight` per
+    request a user has queued, and free slots go to the smallest tag. A user
+    queueing a batch of requests only delays their own requests, and when
+    the queue is full their newest request makes way for a user with fewer
+    queued requests (relative to their weight).
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int | None = None,
+        model_max_concurrency: int | None = None,
+        queue_size: int = 100,
+        queue_timeout: float = 10,
+    ):
+        self.max_concurrency = max_concurrency
+        self.model_max_concurrency = model_max_concurrency
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.total = 0
+        self.in_flight: dict[str, int] = {}
+        self.waiters: list[Waiter] = []
+        self.virtual_time = 0.0
+        self.finish_tags: dict[str, float] = {}
+
+    @property
+    def retry_after(self) -> int:
+        return max(1, math.ceil(self.queue_timeout))
+
+    def _has_capacity(self, model: str, limit: int | None) -> bool:
+        if self.max_concurrency is not None and self.total >= self.max_concurrency:
+            return False
+        return limit is None or self.in_flight.get(model, 0) < limit
+
+    def _admit(self, model: str):
+        self.total += 1
+        self.in_flight[model] = self.in_flight.get(model, 0) + 1
+        metrics.set("admission_in_flight", self.in_flight[model], model=model)
+        metrics.inc("admission_admitted_total", model=model)
+
+    def _set_queue_depth(self, model: str):
+        depth = sum(1 for waiter in self.waiters if waiter.model == model)
+        metrics.set("admission_queue_depth", depth, model=model)
+
+    def _rejection(self, model: str, reason: str) -> AdmissionError:
+        metrics.inc("admission_rejected_total", model=model, reason=reason)
+        return AdmissionError(
+            f"model={model} is at capacity ({reason}), try again later",
+            self.retry_after,
+        )
+
+    def _backlog(self, user: str, weight: float) -> float:
+        return sum(1 for waiter in self.waiters if waiter.user == user) / weight
+
+    def _make_room(self, user: str, weight: float) -> bool:
+        """drop the newest request of the user with the longest backlog, if
+        that is longer than `user`'s would be"""
+        heaviest = max(
+            self.waiters,
+            key=lambda waiter: (
+                self._backlog(waiter.user, waiter.weight),
+                waiter.finish,
+            ),
+            default=None,
+        )
+        if (
+            heaviest is None
+            or self._backlog(heaviest.user, heaviest.weight)
+            <= self._backlog(user, weight) + 1 / weight
+        ):
+            return False
+        self.waiters.remove(heaviest)
+        self._set_queue_depth(heaviest.model)
+        heaviest.future.set_exception(self._rejection(heaviest.model, "queue full"))
+        return True
+
+    def _dispatch(self):
+        """admit every waiter that now fits, smallest finish tag first"""
+        for waiter in sorted(self.waiters, key=lambda waiter: waiter.finish):
+            if waiter.future.done():
+                self.waiters.remove(waiter)
+            elif self._has_capacity(waiter.model, waiter.limit):
+                self.waiters.remove(waiter)
+                self.virtual_time = max(self.virtual_time, waiter.start)
+                self._admit(waiter.model)
+                self._set_queue_depth(waiter.model)
+                waiter.future.set_result(None)
+        # tags behind the virtual time no longer hold a user back
+        self.finish_tags = {
+            user: finish
+            for user, finish in self.finish_tags.items()
+            if finish > self.virtual_time
+        }
+
+    async def acquire(
+        self,
+        model: str,
+        limit: int | None = None,
+        user: str = "",
+        weight: float = 1,
+    ):
+        limit = self.model_max_concurrency if limit is None else limit
+        if self._has_capacity(model, limit):
+            self._admit(model)
+            return
+        if len(self.waiters) >= self.queue_size and not self._make_room(user, weight):
+            raise self._rejection(model, "queue full")
+
+        start = max(self.virtual_time, self.finish_tags.get(user, 0))
+        self.finish_tags[user] = start + 1 / weight
+        waiter = Waiter(
+            model=model,
+            limit=limit,
+            user=user,
+            weight=weight,
+            start=start,
+            finish=self.finish_tags[user],
+            future=asyncio.get_running_loop().create_future(),
+        )
+        self.waiters.append(waiter)
+        self._set_queue_depth(model)
+        started_at = time.monotonic()
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter.future), self.queue_timeout)
+        except TimeoutError:
+            if not waiter.future.done():
+                raise self._rejection(model, "queue timeout")
+            waiter.future.result()
+        except asyncio.CancelledError:
+            # give back a slot that was handed over meanwhile
+            future = waiter.future
+            if future.done() and not future.cancelled() and not future.exception():
+                self.release(model)
+            raise
+        finally:
+            if waiter in self.waiters:
+                self.waiters.remove(waiter)
+                self._set_queue_depth(model)
+        metrics.inc(
+            "admission_wait_seconds_total", time.monotonic() - started_at, model=model
+        )
+
+    def release(self, model: str):
+        self.total -= 1
+        self.in_flight[model] -= 1
+        metrics.set("admission_in_flight", self.in_flight[model], model=model)
+        self._dispatch()
+
+    @asynccontextmanager
+    async def slot(
+        self, model: str, limit: int | None = None, user: str = "", weight: float = 1
+    ):
+        await self.acquire(model, limit, user, weight)
+        try:
+            yield
+        finally:
+            self.release(model)
+
+    def clear(self):
+        for waiter in self.waiters:
+            waiter.future.cancel()
+        self.waiters.clear()
+        self.in_flight.clear()
+        self.total = 0
+        self.virtual_time = 0.0
+        self.finish_tags.clear()
+
+
+admission_control = AdmissionControl(
+    env.max_concurrency,
+    env.model_max_concurrency,
+    env.admission_queue_size,
+    env.admission_queue_timeout,
+)
@@ -1,42 +1,115 @@
+import asyncio
+import base64
+import csv
+import io
+import json
 import os
-from contextlib import asynccontextmanager
+import time
+from contextlib import aclosing, asynccontextmanager
 from datetime import datetime
 from typing import Annotated, Literal
 from uuid import UUID
 
+import anyio
 import httpx
 from dotenv import load_dotenv
-from fastapi import Depends, FastAPI, HTTPException, Query
+from fastapi import Depends, FastAPI, HTTPException, Query, Request
 from fastapi.security import OAuth2PasswordRequestForm
-from litellm import completion
-from pydantic import BaseModel, Field
-from sqlmodel import Session, SQLModel, select
+from litellm import acompletion
+from pydantic import BaseModel, Field, ValidationError
+from sqlalchemy import Select, tuple_
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
 from starlette import status
-from starlette.responses import StreamingResponse
-
-from llm_freeway.auth import get_admin_user, get_current_user, get_token
+from starlette.responses import PlainTextResponse, StreamingResponse
+
+from llm_freeway.admission import AdmissionError, admission_control
+from llm_freeway.auth import (
+    INCORRECT_PASSWORD_ERROR,
+    get_admin_user,
+    get_current_user,
+    get_token,
+    keycloak_token_client,
+    token_cache,
+)
+from llm_freeway.batch import (
+    LineRanges,
+    encode_error,
+    encode_result,
+    retry_after,
+    run_batch,
+    spool,
+)
+from llm_freeway.cache import response_cache
+from llm_freeway.coalesce import coalescer
 from llm_freeway.database import (
     LLM,
+    BatchJob,
     EventLog,
     SQLUser,
     Token,
     User,
+    async_engine,
     authenticate_user,
-    engine,
     get_session,
-    pwd_context,
 )
+from llm_freeway.log_writer import log_writer, write_log
+from llm_freeway.metrics import metrics
+from llm_freeway.partitions import (
+    create_tables,
+    is_partitioned,
+    maintain_partitions_periodically,
+)
+from llm_freeway.passwords import password_hasher
+from llm_freeway.quota import quota
+from llm_freeway.registry import model_registry
+from llm_freeway.responses import FastJSONResponse, ReleasingStreamingResponse
+from llm_freeway.router import NoCapacityError, router
+from llm_freeway.settings import env
+from llm_freeway.sse import DONE, SSE_HEADERS, coalesce, encode_event
+from llm_freeway.summary import (
+    Bucket,
+    SpendSummary,
+    local_time,
+    summary_cache,
+    summary_query,
+)
+from llm_freeway.tokens import token_estimator
+from llm_freeway.upstream import upstream_clients
 
 load_dotenv()
 
+# seconds a client should wait after exceeding a per-minute limit
+QUOTA_RETRY_AFTER = 1
+
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    SQLModel.metadata.create_all(engine)
+    async with async_engine.begin() as connection:
+        await connection.run_sync(create_tables)
+    if is_partitioned(async_engine):
+        maintenance = asyncio.create_task(
+            maintain_partitions_periodically(async_engine)
+        )
+    async with AsyncSession(async_engine, expire_on_commit=False) as session:
+        await quota.seed(session)
+        await model_registry.reload(session)
+    if env.log_write_behind:
+        await log_writer.start()
+    if keycloak_token_client:
+        await keycloak_token_client.start()
+    await upstream_clients.start()
     yield
+    await log_writer.stop()
+    await upstream_clients.stop()
+    if keycloak_token_client:
+        await keycloak_token_client.stop()
+    if is_partitioned(async_engine):
+        maintenance.cancel()
+    await async_engine.dispose()
 
 
-app = FastAPI(lifespan=lifespan)
+app = FastAPI(lifespan=lifespan, default_response_class=FastJSONResponse)
 
 
 class ChatMessage(BaseModel):
@@ -49,26 +122,35 @@ class ChatRequest(BaseModel):
     messages: list[ChatMessage]
     stream: bool = False
     mock_response: str | None = Field(default=None)
+    max_tokens: int | None = Field(default=None, gt=0)
+
+
+async def admit(model: LLM, user: User):
+    """wait for an upstream slot for the model, or fail fast with a 503"""
+    try:
+        await admission_control.acquire(
+            model.name, model.max_concurrency, str(user.id), user.weight
+        )
+    except AdmissionError as e:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=str(e),
+            headers={"Retry-After": str(e.retry_after)},
+        )
 
 
 @app.post(path="/chat/completions")
 async def stream_response(
     body: ChatRequest,
     current_user: Annotated[User, Depends(get_current_user)],
-    session: Annotated[Session, Depends(get_session)],
+    session: Annotated[AsyncSession, Depends(get_session)],
 ) -> StreamingResponse:
-    spend = current_user.get_spend(session)
+    spend = await quota.get_spend(current_user, session)
     if spend.requests > current_user.requests_per_minute:
         raise HTTPException(
             status_code=status.HTTP_429_TOO_MANY_REQUESTS,
             detail=f"requests_per_minute={spend.requests} exceeded limit={current_user.requests_per_minute}",
-        )
-
-    total_tokens = spend.prompt_tokens + spend.completion_tokens
-    if total_tokens > current_user.tokens_per_minute:
-        raise HTTPException(
-            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
-            detail=f"tokens_per_minute={total_tokens} exceeded limit={current_user.tokens_per_minute}",
+            headers={"Retry-After": str(QUOTA_RETRY_AFTER)},
         )
 
     if spend.cost_usd and spend.cost_usd > current_user.cost_usd_per_month:
@@ -77,84 +159,319 @@ async def stream_response(
             detail=f"cost_usd_per_month exceeded={spend.cost_usd} exceeded limit={current_user.cost_usd_per_month}",
         )
 
-    model = session.get(LLM, body.model)
+    model = await model_registry.get(body.model, session)
     if model is None:
         raise HTTPException(
             status_code=httpx.codes.NOT_FOUND,
             detail=f"model={body.model} not registered",
         )
 
+    no_capacity_error = HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail=f"model={model.name} has no deployment available",
+    )
+    deployments = model_registry.deployments(model.name)
+    # checked up front, as a stream can't change its status once started
+    if deployments and not router.rank(deployments):
+        raise no_capacity_error
+
     vertex_credentials = os.getenv("VERTEX_CREDENTIALS", None)
+    request_key = response_cache.key(body)
+
+    # reserve the request's tokens up front, so concurrent requests can't
+    # all pass the check, and swap them for the real usage once it is logged
+    tokens = await token_estimator.estimate(
+        model.name,
+        [message.model_dump() for message in body.messages],
+        body.max_tokens,
+    )
+    reservation = await quota.reserve(current_user, tokens, session)
+    if not reservation.granted:
+        limit = current_user.tokens_per_minute
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail=f"tokens_per_minute={reservation.in_use} exceeded limit={limit}"
+            if reservation.in_use > limit
+            else f"tokens_per_minute={reservation.in_use} plus an estimated "
+            f"{tokens} for this request exceeds limit={limit}",
+            # waiting only helps if the request could ever fit
+            headers={"Retry-After": str(QUOTA_RETRY_AFTER)}
+            if tokens <= limit
+            else None,
+        )
 
     if not body.stream:
-        model_response = completion(
-            vertex_credentials=vertex_credentials, **body.model_dump()
-        )
-        log = EventLog(
-            user_id=current_user.id,
-            model=model.name,
-            response_id=model_response.id,
-            prompt_tokens=model_response.usage["prompt_tokens"],
-            completion_tokens=model_response.usage["completion_tokens"],
-            cost_usd=model_response.usage["prompt_tokens"] * model.input_cost_per_token
-            + model_response.usage["completion_tokens"] * model.output_cost_per_token,
-        )
-        session.add(log)
-        session.commit()
-        return model_response
+        try:
+            if model.cache_responses:
+                if cached_response := response_cache.get(request_key):
+                    log = EventLog(
+                        user_id=current_user.id,
+                        model=model.name,
+                        response_id=cached_response.id,
+                        prompt_tokens=cached_response.usage["prompt_tokens"],
+                        completion_tokens=cached_response.usage["completion_tokens"],
+                        cost_usd=0,
+                        cache_hit=True,
+                    )
+                    await write_log(log, session)
+                    return FastJSONResponse(cached_response)
+
+            await admit(model, current_user)
+            try:
+                model_response = await coalescer.complete(
+                    request_key,
+                    lambda: router.complete(
+                        model,
+                        deployments,
+                        lambda kwargs: acompletion(
+                            vertex_credentials=vertex_credentials,
+                            **upstream_clients.completion_kwargs(kwargs["model"]),
+                            **{**body.model_dump(), **kwargs},
+                        ),
+                    ),
+                )
+            except NoCapacityError:
+                raise no_capacity_error
+            finally:
+                admission_control.release(model.name)
+            if model.cache_responses:
+                response_cache.set(request_key, model_response)
+            log = EventLog(
+                user_id=current_user.id,
+                model=model.name,
+                response_id=model_response.id,
+                prompt_tokens=model_response.usage["prompt_tokens"],
+                completion_tokens=model_response.usage["completion_tokens"],
+                cost_usd=model.get_cost_usd(
+                    model_response.usage["prompt_tokens"],
+                    model_response.usage["completion_tokens"],
+                ),
+                deployment=model_response._hidden_params.get("deployment"),
+            )
+            await write_log(log, session)
+            return FastJSONResponse(model_response)
+        finally:
+            await quota.reconcile(reservation)
+
+    try:
+        await admit(model, current_user)
+    except HTTPException:
+        await quota.reconcile(reservation)
+        raise
 
     async def event_generator():
-        stream_wrapper = completion(
-            vertex_credentials=vertex_credentials,
-            stream_options={"include_usage": True},
-            **body.model_dump(),
+        broadcast = coalescer.stream(
+            request_key,
+            lambda: router.stream(
+                model,
+                deployments,
+                lambda kwargs: acompletion(
+                    vertex_credentials=vertex_credentials,
+                    stream_options={"include_usage": True},
+                    **upstream_clients.completion_kwargs(kwargs["model"]),
+                    **{**body.model_dump(), **kwargs},
+                ),
+            ),
         )
         prompt_tokens = 0
         completion_tokens = 0
-        for part in stream_wrapper:
-            if hasattr(part, "usage"):
-                prompt_tokens += part.usage["prompt_tokens"]
-                completion_tokens += part.usage["completion_tokens"]
-            yield f"data: {part.model_dump_json()}\n\n"
-        yield "data: [DONE]\n\n"
-
-        cost_usd = (
-            prompt_tokens * model.input_cost_per_token
-            + completion_tokens * model.output_cost_per_token
-        )
+        async with aclosing(broadcast.subscribe()) as parts:
+            async for part in parts:
+                if hasattr(part, "usage"):
+                    prompt_tokens += part.usage["prompt_tokens"]
+                    completion_tokens += part.usage["completion_tokens"]
+                yield encode_event(part)
+        yield DONE
 
         _log = EventLog(
             user_id=current_user.id,
             model=model.name,
-            response_id=stream_wrapper.response_id,
+            response_id=broadcast.response_id,
             prompt_tokens=prompt_tokens,
             completion_tokens=completion_tokens,
-            cost_usd=cost_usd,
+            cost_usd=model.get_cost_usd(prompt_tokens, completion_tokens),
+            deployment=broadcast.deployment,
         )
-        session.add(_log)
-        session.commit()
+        await write_log(_log, session)
+
+    async def release():
+        admission_control.release(model.name)
+        await quota.reconcile(reservation)
+
+    events = event_generator()
+    if env.sse_coalesce_interval:
+        events = coalesce(events, env.sse_coalesce_interval, env.sse_coalesce_bytes)
+    # the slot and reservation are released by the response, as the
+    # generator may never start
+    return ReleasingStreamingResponse(
+        events, release, media_type="text/event-stream", headers=SSE_HEADERS
+    )
+
 
-    return StreamingResponse(event_generator(), media_type="application/x-ndjson")
+@app.post(
+    path="/batch",
+    openapi_extra={
+        "requestBody": {
+            "required": True,
+            "content": {
+                "application/x-ndjson": {"schema": ChatRequest.model_json_schema()}
+            },
+        }
+    },
+)
+async def batch(
+    request: Request,
+    current_user: Annotated[User, Depends(get_current_user)],
+    session: Annotated[AsyncSession, Depends(get_session)],
+    job_id: UUID | None = None,
+    concurrency: int = Query(env.batch_concurrency, gt=0, le=env.batch_max_concurrency),
+    order: Literal["input", "completion"] = "input",
+) -> StreamingResponse:
+    """complete a JSONL file of ChatRequests, `concurrency` lines at a time
+
+    Each line is answered as `/chat/completions` would, within the user's
+    limits, and streamed back as a JSON line of its `line` number (from 1),
+    `status_code` and `response` or `error`, in input or completion `order`.
+    Lines turned away by a per-minute limit or a full upstream queue are
+    retried for up to `BATCH_RETRY_TIMEOUT` seconds.
+
+    The lines that succeed are checkpointed against the job, whose id is
+    sent in the `X-Batch-Job-Id` header, post the same file again with that
+    `job_id` to run only the rest. Another file is refused with a 409.
+    """
+    # spooled rather than read into memory, and before the response
+    # starts, as a streaming response also listens on the connection
+    file, content_hash = await spool(request.stream(), env.batch_spool_bytes)
+    try:
+        if job_id is None:
+            job = BatchJob(user_id=current_user.id, content_hash=content_hash)
+            session.add(job)
+            await session.commit()
+        else:
+            job = await session.get(BatchJob, job_id)
+            if job is None or job.user_id != current_user.id:
+                raise HTTPException(
+                    status_code=httpx.codes.NOT_FOUND,
+                    detail=f"batch job={job_id} not found",
+                )
+            if job.content_hash != content_hash:
+                raise HTTPException(
+                    status_code=httpx.codes.CONFLICT,
+                    detail=f"batch job={job_id} was started with a different file",
+                )
+    except BaseException:
+        file.close()
+        raise
+    completed = LineRanges(job.completed_lines)
+
+    async def run_line(item: tuple[int, bytes]) -> tuple[int, int, bytes]:
+        number, line = item
+        try:
+            body = ChatRequest.model_validate_json(line).model_copy(
+                update={"stream": False}
+            )
+        except ValidationError as e:
+            error = e.errors(
+                include_url=False, include_context=False, include_input=False
+            )
+            return number, 422, encode_error(number, 422, error)
+
+        deadline = time.monotonic() + env.batch_retry_timeout
+        while True:
+            try:
+                # lines run concurrently, so each needs its own session
+                async with AsyncSession(
+                    session.bind, expire_on_commit=False
+                ) as line_session:
+                    response = await stream_response(body, current_user, line_session)
+                return number, 200, encode_result(number, 200, response.body)
+            except Exception as e:
+                wait = retry_after(e)
+                if wait is None or time.monotonic() + wait > deadline:
+                    status_code = getattr(e, "status_code", 500)
+                    error = e.detail if isinstance(e, HTTPException) else str(e)
+                    return number, status_code, encode_error(number, status_code, error)
+                await asyncio.sleep(wait)
+
+    async def checkpoint():
+        job.completed_lines = completed.to_list()
+        job.updated_at = datetime.now()
+        session.add(job)
+        await session.commit()
+
+    async def results():
+        since_checkpoint = 0
+        try:
+            async for number, status_code, data in run_batch(
+                (
+                    (number, line)
+                    for number, line in enumerate(file, 1)
+                    if line.strip() and number not in completed
+                ),
+                run_line,
+                concurrency,
+                ordered=order == "input",
+            ):
+                if status_code == 200:
+                    completed.add(number)
+                    since_checkpoint += 1
+                yield data
+                if since_checkpoint >= env.batch_checkpoint_lines:
+                    await checkpoint()
+                    since_checkpoint = 0
+        finally:
+            # also on a disconnect, so the job resumes from where it got to
+            with anyio.CancelScope(shield=True):
+                await checkpoint()
+
+    async def release():
+        file.close()
+
+    return ReleasingStreamingResponse(
+        results(),
+        release,
+        media_type="application/x-ndjson",
+        headers={"X-Batch-Job-Id": str(job.id)},
+    )
 
 
 class EventLogResponse(BaseModel):
     items: list[EventLog]
     page: int
     size: int
+    next_cursor: str | None = Field(
+        default=None, description="pass as `cursor` to fetch the next page"
+    )
 
 
-@app.get(path="/spend/logs")
-def spend_logs(
-    current_user: Annotated[User, Depends(get_current_user)],
-    session: Annotated[Session, Depends(get_session)],
-    user_id: str | None = None,
+def encode_cursor(*values) -> str:
+    return base64.urlsafe_b64encode(json.dumps(values, default=str).encode()).decode()
+
+
+def decode_cursor(cursor: str, *types: type) -> list:
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor))
+        return [
+            datetime.fromisoformat(value) if type_ is datetime else type_(value)
+            for type_, value in zip(types, values, strict=True)
+        ]
+    except (ValueError, TypeError, AttributeError):
+        # AttributeError from UUID when the value isn't a string
+        raise HTTPException(
+            status_code=httpx.codes.BAD_REQUEST,
+            detail="invalid cursor",
+        )
+
+
+def filter_event_logs(
+    query: Select,
+    current_user: User,
+    user_id: UUID | None = None,
     response_id: str | None = None,
     start_date: datetime | None = None,
     end_date: datetime | None = None,
-    page: int = Query(1, ge=0),
-    size: int = Query(10, gt=0),
-) -> EventLogResponse:
-    query = select(EventLog)
+) -> Select:
+    """restrict `query` to the logs the user asked for, and is allowed to see"""
     if not current_user.is_admin:
         query = query.where(EventLog.user_id == current_user.id)
     if user_id:
@@ -165,26 +482,181 @@ def spend_logs(
         query = query.where(EventLog.timestamp >= start_date)
     if end_date:
         query = query.where(EventLog.timestamp < end_date)
+    return query
+
+
+@app.get(path="/spend/logs", response_model=EventLogResponse)
+async def spend_logs(
+    current_user: Annotated[User, Depends(get_current_user)],
+    session: Annotated[AsyncSession, Depends(get_session)],
+    user_id: UUID | None = None,
+    response_id: str | None = None,
+    start_date: datetime | None = None,
+    end_date: datetime | None = None,
+    page: int = Query(1, ge=0),
+    size: int = Query(10, gt=0),
+    cursor: str | None = None,
+) -> FastJSONResponse:
+    query = filter_event_logs(
+        select(EventLog), current_user, user_id, response_id, start_date, end_date
+    )
+    if cursor:
+        timestamp, id = decode_cursor(cursor, datetime, UUID)
+        query = query.where(tuple_(EventLog.timestamp, EventLog.id) > (timestamp, id))
+    else:
+        query = query.offset(size * (page - 1))
+
+    result = await session.exec(
+        query.order_by(EventLog.timestamp, EventLog.id).limit(size)
+    )
+    items = result.all()
+    next_cursor = (
+        encode_cursor(items[-1].timestamp, items[-1].id) if len(items) == size else None
+    )
+    return FastJSONResponse(
+        EventLogResponse(items=items, page=page, size=size, next_cursor=next_cursor)
+    )
+
+
+EXPORT_MEDIA_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
+
+def export_value(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, UUID):
+        return str(value)
+    return value
+
+
+@app.get(path="/spend/logs/export")
+async def export_spend_logs(
+    current_user: Annotated[User, Depends(get_current_user)],
+    session: Annotated[AsyncSession, Depends(get_session)],
+    user_id: UUID | None = None,
+    response_id: str | None = None,
+    start_date: datetime | None = None,
+    end_date: datetime | None = None,
+    format: Literal["ndjson", "csv"] = "ndjson",
+) -> StreamingResponse:
+    """every matching log, streamed
+
+    Rows are read as plain tuples through a server-side cursor, `yield_per`
+    at a time, so memory use doesn't grow with the size of the export.
+    """
+    columns = list(EventLog.__table__.columns)
+    names = [column.name for column in columns]
+    query = filter_event_logs(
+        select(*columns), current_user, user_id, response_id, start_date, end_date
+    ).order_by(EventLog.timestamp, EventLog.id)
+
+    async def rows():
+        if format == "csv":
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            writer.writerow(names)
+        async with session.bind.connect() as connection:
+            result = await connection.stream(
+                query.execution_options(yield_per=env.export_batch_size)
+            )
+            async for partition in result.partitions():
+                if format == "csv":
+                    writer.writerows(map(export_value, row) for row in partition)
+                    yield buffer.getvalue()
+                    buffer.seek(0)
+                    buffer.truncate()
+                else:
+                    yield "".join(
+                        json.dumps(dict(zip(names, map(export_value, row)))) + "\n"
+                        for row in partition
+                    )
+        if format == "csv" and buffer.tell():
+            yield buffer.getvalue()
+
+    return StreamingResponse(
+        rows(),
+        media_type=EXPORT_MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="spend-logs.{format}"'},
+    )
+
+
+class SpendSummaryResponse(BaseModel):
+    bucket: Bucket
+    items: list[SpendSummary]
+
 
-    skip = size * (page - 1)
-    items = session.exec(
-        query.order_by(EventLog.timestamp).offset(skip).limit(size)
-    ).all()
-    return EventLogResponse(items=items, page=page, size=size)
+@app.get(path="/spend/summary")
+async def spend_summary(
+    current_user: Annotated[User, Depends(get_current_user)],
+    session: Annotated[AsyncSession, Depends(get_session)],
+    user_id: UUID | None = None,
+    response_id: str | None = None,
+    start_date: datetime | None = None,
+    end_date: datetime | None = None,
+    bucket: Bucket = "day",
+) -> SpendSummaryResponse:
+    """requests, tokens and cost per user, model and hour, day or month
+
+    Buckets that have closed are cached, so only logs in the still-open
+    bucket(s) are aggregated on a repeated request.
+    """
+    start_date, end_date = local_time(start_date), local_time(end_date)
+    scope = None if current_user.is_admin else current_user.id
+    key = scope, user_id, response_id, start_date, end_date, bucket
+    cached_until, items = summary_cache.get(key)
+    closed_until = summary_cache.closed_until(bucket)
+
+    query = filter_event_logs(
+        summary_query(session.bind.dialect.name, bucket),
+        current_user,
+        user_id,
+        response_id,
+        start_date,
+        end_date,
+    )
+    if cached_until:
+        query = query.where(EventLog.timestamp >= cached_until)
+    if not (cached_until and end_date and end_date <= cached_until):
+        result = await session.exec(query)
+        items = items + [
+            SpendSummary.model_validate(row, from_attributes=True)
+            for row in result.all()
+        ]
+
+    if cached_until is None or closed_until > cached_until:
+        summary_cache.set(
+            key, closed_until, [item for item in items if item.bucket < closed_until]
+        )
+    return SpendSummaryResponse(bucket=bucket, items=items)
+
+
+@app.get(path="/metrics", response_class=PlainTextResponse)
+async def get_metrics() -> str:
+    return metrics.render()
+
+
+@app.post(path="/models/reload", tags=["models"])
+async def reload_models(
+    admin_user: Annotated[User, Depends(get_admin_user)],
+    session: Annotated[AsyncSession, Depends(get_session)],
+) -> list[LLM]:
+    return await model_registry.reload(session)
 
 
 @app.post("/token")
-def login_for_access_token(
+async def login_for_access_token(
     form_data: Annotated[OAuth2PasswordRequestForm, Depends()],
-    session: Annotated[Session, Depends(get_session)],
+    session: Annotated[AsyncSession, Depends(get_session)],
 ) -> Token:
-    user = authenticate_user(form_data.username, form_data.password, session)
-    if not user:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Incorrect username or password",
-            headers={"WWW-Authenticate": "Bearer"},
+    if keycloak_token_client:
+        access_token = await keycloak_token_client.get_token(
+            form_data.username, form_data.password
         )
+        return Token(access_token=access_token, token_type="bearer")
+
+    user = await authenticate_user(form_data.username, form_data.password, session)
+    if not user:
+        raise INCORRECT_PASSWORD_ERROR
 
     return Token(access_token=get_token(user), token_type="bearer")
 
@@ -193,57 +665,96 @@ class UserResponse(BaseModel):
     page: int
     size: int
     items: list[User]
+    next_cursor: str | None = Field(
+        default=None, description="pass as `cursor` to fetch the next page"
+    )
 
 
 @app.get(path="/users", tags=["users"])
-def get_users(
+async def get_users(
     current_user: Annotated[User, Depends(get_current_user)],
-    session: Annotated[Session, Depends(get_session)],
+    session: Annotated[AsyncSession, Depends(get_session)],
     page: int = Query(1, ge=0),
     size: int = Query(10, gt=0),
+    cursor: str | None = None,
 ) -> UserResponse:
     if not current_user.is_admin:
-        data = [current_user]
+        return UserResponse(page=page, size=size, items=[current_user])
+
+    query = select(SQLUser)
+    if cursor:
+        (id,) = decode_cursor(cursor, UUID)
+        query = query.where(SQLUser.id > id)
     else:
-        skip = (page - 1) * size
-        data = session.exec(select(SQLUser).offset(skip).limit(size)).all()
+        query = query.offset((page - 1) * size)
 
-    return UserResponse(page=page, size=size, items=data)
+    result = await session.exec(query.order_by(SQLUser.id).limit(size))
+    data = result.all()
+    next_cursor = encode_cursor(data[-1].id) if len(data) == size else None
+    return UserResponse(page=page, size=size, items=data, next_cursor=next_cursor)
 
 
 class UserRequest(BaseModel):
     username: str
     password: str
     is_admin: bool = False
+    weight: float = Field(default=1, gt=0)
 
 
 @app.post(path="/users", tags=["users"])
-def create_user(
+async def create_user(
     admin_user: Annotated[User, Depends(get_admin_user)],
-    session: Annotated[Session, Depends(get_session)],
+    session: Annotated[AsyncSession, Depends(get_session)],
     user: UserRequest,
 ) -> User:
     user_to_create = SQLUser(
         username=user.username,
         is_admin=user.is_admin,
-        hashed_password=pwd_context.hash(user.password),
+        weight=user.weight,
+        hashed_password=await password_hasher.hash(user.password),
     )
 
     session.add(user_to_create)
-    session.commit()
-    session.refresh(user_to_create)
+    await session.commit()
+    await session.refresh(user_to_create)
 
     return user_to_create
 
 
+@app.post(path="/users/bulk", tags=["users"])
+async def create_users(
+    admin_user: Annotated[User, Depends(get_admin_user)],
+    session: Annotated[AsyncSession, Depends(get_session)],
+    users: list[UserRequest],
+) -> list[User]:
+    """create many users at once, in a single transaction"""
+    hashed_passwords = await password_hasher.hash_many(
+        [user.password for user in users]
+    )
+    users_to_create = [
+        SQLUser(
+            username=user.username,
+            is_admin=user.is_admin,
+            weight=user.weight,
+            hashed_password=hashed_password,
+        )
+        for user, hashed_password in zip(users, hashed_passwords)
+    ]
+
+    session.add_all(users_to_create)
+    await session.commit()
+
+    return users_to_create
+
+
 @app.put(path="/users/{user_id}", tags=["users"])
-def update_user(
+async def update_user(
     admin_user: Annotated[User, Depends(get_admin_user)],
-    session: Annotated[Session, Depends(get_session)],
+    session: Annotated[AsyncSession, Depends(get_session)],
     user_id: UUID,
     user: UserRequest,
 ) -> User:
-    user_to_update: SQLUser = session.get(SQLUser, user_id)
+    user_to_update: SQLUser = await session.get(SQLUser, user_id)
     if user_to_update is None:
         raise HTTPException(
             status_code=404,
@@ -251,24 +762,26 @@ def update_user(
         )
 
     user_to_update.username = user.username
-    user_to_update.hashed_password = pwd_context.hash(user.password)
+    user_to_update.hashed_password = await password_hasher.hash(user.password)
     user_to_update.is_admin = user.is_admin
+    user_to_update.weight = user.weight
 
     session.add(user_to_update)
-    session.commit()
-    session.refresh(user_to_update)
+    await session.commit()
+    await session.refresh(user_to_update)
+    token_cache.invalidate(user_id)
 
     return user_to_update
 
 
 @app.delete(path="/users/{user_id}", tags=["users"])
-def delete_user(
+async def delete_user(
     admin_user: Annotated[User, Depends(get_admin_user)],
-    session: Annotated[Session, Depends(get_session)],
+    session: Annotated[AsyncSession, Depends(get_session)],
     user_id: UUID,
 ) -> None:
-    user_to_delete: SQLUser = session.exec(
-        select(SQLUser).where(SQLUser.id == user_id)
-    ).one()
-    session.delete(user_to_delete)
-    session.commit()
+    result = await session.exec(select(SQLUser).where(SQLUser.id == user_id))
+    user_to_delete: SQLUser = result.one()
+    await session.delete(user_to_delete)
+    await session.commit()
+    token_cache.invalidate(user_id)
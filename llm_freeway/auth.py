@@ -1,20 +1,28 @@
+import asyncio
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict, defaultdict
 from datetime import datetime, timedelta, timezone
 from typing import Annotated
 from uuid import UUID
 
 import httpx
 import jwt
-import requests
 from fastapi import Depends, HTTPException
 from fastapi.security import OAuth2PasswordBearer
-from jwt import InvalidTokenError, PyJWKClient
+from jwt import InvalidTokenError, PyJWK, PyJWKSet
+from jwt.exceptions import PyJWKSetError
 from sqlalchemy.exc import NoResultFound
-from sqlmodel import Session
+from sqlmodel.ext.asyncio.session import AsyncSession
 from starlette import status
 
 from llm_freeway.database import SQLUser, User, env, get_session
 from llm_freeway.settings import KeycloakSettings, LocalAuthSettings
 
+logger = logging.getLogger(__name__)
+
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
 
@@ -24,13 +32,257 @@ NOT_AUTHORIZED_ERROR = HTTPException(
     headers={"WWW-Authenticate": "Bearer"},
 )
 
+INCORRECT_PASSWORD_ERROR = HTTPException(
+    status_code=status.HTTP_401_UNAUTHORIZED,
+    detail="Incorrect username or password",
+    headers={"WWW-Authenticate": "Bearer"},
+)
+
+KEYCLOAK_UNAVAILABLE_ERROR = HTTPException(
+    status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+    detail="the identity provider is unavailable",
+)
+
+
+class JWKSCache:
+    """signing keys from a JWKS endpoint, cached by kid
+
+    Once `ttl` seconds have passed the keys are refetched in the background
+    while the stale keys carry on being used, so a slow or unavailable
+    Keycloak doesn't hold up requests. A token signed with an unknown kid
+    triggers an immediate refetch to pick up rotated keys, at most once
+    every `min_refresh_interval` seconds. Fetches run in a thread, one at a
+    time, and callers that need the keys wait for the one in progress.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        ttl: float = 300,
+        min_refresh_interval: float = 10,
+        timeout: float = 2,
+    ):
+        self.url = url
+        self.ttl = ttl
+        self.min_refresh_interval = min_refresh_interval
+        self.timeout = timeout
+        self.keys: dict[str, PyJWK] = {}
+        self.fetched_at = float("-inf")
+        self.attempted_at = float("-inf")
+        # guards swapping in new keys, never held while fetching them
+        self.lock = threading.Lock()
+        self.refreshing: asyncio.Task | None = None
+
+    def refresh(self) -> bool:
+        self.attempted_at = time.monotonic()
+        try:
+            response = httpx.get(self.url, timeout=self.timeout)
+            response.raise_for_status()
+            jwk_set = PyJWKSet.from_dict(response.json())
+        except (httpx.HTTPError, PyJWKSetError, ValueError):
+            logger.warning("failed to fetch JWKS from %s", self.url, exc_info=True)
+            return False
+        with self.lock:
+            self.keys = {key.key_id: key for key in jwk_set.keys}
+            self.fetched_at = time.monotonic()
+        return True
+
+    def _refresh_in_background(self) -> asyncio.Task:
+        """the refresh in progress, or a newly started one"""
+        if self.refreshing is None or self.refreshing.done():
+            self.refreshing = asyncio.create_task(asyncio.to_thread(self.refresh))
+        return self.refreshing
+
+    async def _wait_for_refresh(self):
+        # shielded, as the refresh is shared with other requests
+        await asyncio.shield(self._refresh_in_background())
+
+    async def get_signing_key(self, kid: str | None) -> PyJWK:
+        now = time.monotonic()
+        if not self.keys:
+            await self._wait_for_refresh()
+        elif now - self.fetched_at > self.ttl:
+            self._refresh_in_background()
+
+        if kid not in self.keys:
+            in_progress = self.refreshing is not None and not self.refreshing.done()
+            if in_progress or now - self.attempted_at >= self.min_refresh_interval:
+                await self._wait_for_refresh()
+            if kid not in self.keys:
+                raise InvalidTokenError(f"unable to find a signing key for kid={kid}")
+        return self.keys[kid]
+
+    async def get_signing_key_from_jwt(self, token: str) -> PyJWK:
+        return await self.get_signing_key(jwt.get_unverified_header(token).get("kid"))
+
+
+jwks_cache = (
+    JWKSCache(
+        f"{env.auth.server_url}/realms/{env.auth.realm_name}/protocol/openid-connect/certs",
+        ttl=env.auth.jwks_ttl,
+        min_refresh_interval=env.auth.jwks_min_refresh_interval,
+        timeout=env.auth.jwks_timeout,
+    )
+    if isinstance(env.auth, KeycloakSettings)
+    else None
+)
+
+
+class KeycloakTokenClient:
+    """exchanges usernames and passwords for Keycloak access tokens
+
+    Requests share one pooled async client, created in the app's lifespan
+    (or on first use), so a login reuses a kept-alive connection and never
+    blocks the event loop. Connection failures, timeouts and 5xx responses
+    are retried up to `retries` times.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        client_id: str,
+        client_secret: str,
+        timeout: float = 5,
+        retries: int = 2,
+        max_connections: int = 20,
+        transport: httpx.AsyncBaseTransport | None = None,
+    ):
+        self.url = url
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.timeout = timeout
+        self.retries = retries
+        self.max_connections = max_connections
+        self.transport = transport
+        self.client: httpx.AsyncClient | None = None
+
+    async def start(self):
+        if self.client is None:
+            self.client = httpx.AsyncClient(
+                timeout=self.timeout,
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_connections,
+                ),
+                transport=self.transport,
+            )
+
+    async def stop(self):
+        if self.client is not None:
+            await self.client.aclose()
+        self.client = None
+
+    async def _post(self, data: dict) -> httpx.Response:
+        await self.start()
+        for attempt in range(self.retries + 1):
+            last_attempt = attempt == self.retries
+            try:
+                response = await self.client.post(self.url, data=data)
+            except httpx.TransportError:
+                if last_attempt:
+                    raise
+            else:
+                if response.status_code < 500 or last_attempt:
+                    return response
+            await asyncio.sleep(0.1 * 2**attempt)
+
+    async def get_token(self, username: str, password: str) -> str:
+        data = {
+            "client_id": self.client_id,
+            "client_secret": self.client_secret,
+            "username": username,
+            "password": password,
+            "grant_type": "password",
+        }
+        try:
+            response = await self._post(data)
+        except httpx.TransportError:
+            logger.warning("failed to reach keycloak at %s", self.url, exc_info=True)
+            raise KEYCLOAK_UNAVAILABLE_ERROR
+        if response.status_code >= 500:
+            raise KEYCLOAK_UNAVAILABLE_ERROR
+        if response.status_code != 200:
+            raise INCORRECT_PASSWORD_ERROR
+        return response.json()["access_token"]
+
+
+keycloak_token_client = (
+    KeycloakTokenClient(
+        f"{env.auth.server_url}/realms/{env.auth.realm_name}/protocol/openid-connect/token",
+        client_id=env.auth.client_id,
+        client_secret=env.auth.client_secret_key,
+        timeout=env.auth.token_timeout,
+        retries=env.auth.token_retries,
+        max_connections=env.auth.token_max_connections,
+    )
+    if isinstance(env.auth, KeycloakSettings)
+    else None
+)
+
+
+class TokenCache:
+    """Users for recently verified tokens, keyed by a hash of the token
+
+    Entries expire with their token and the least recently used entry is
+    evicted once `max_size` tokens are cached. `invalidate` forgets every
+    token belonging to a user.
+    """
+
+    def __init__(self, max_size: int = 10_000):
+        self.max_size = max_size
+        self.tokens: OrderedDict[str, tuple[float, User]] = OrderedDict()
+        self.users: defaultdict[UUID, set[str]] = defaultdict(set)
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def _key(token: str) -> str:
+        return hashlib.sha256(token.encode()).hexdigest()
+
+    def _remove(self, key: str):
+        _, user = self.tokens.pop(key)
+        self.users[user.id].discard(key)
+        if not self.users[user.id]:
+            del self.users[user.id]
+
+    def get(self, token: str) -> User | None:
+        key = self._key(token)
+        with self.lock:
+            if key not in self.tokens:
+                return None
+            expires_at, user = self.tokens[key]
+            if expires_at <= time.time():
+                self._remove(key)
+                return None
+            self.tokens.move_to_end(key)
+            return user
+
+    def set(self, token: str, user: User, expires_at: float):
+        key = self._key(token)
+        with self.lock:
+            if key in self.tokens:
+                self._remove(key)
+            self.tokens[key] = expires_at, user
+            self.users[user.id].add(key)
+            while len(self.tokens) > self.max_size:
+                self._remove(next(iter(self.tokens)))
+
+    def invalidate(self, user_id: UUID):
+        with self.lock:
+            for key in list(self.users.get(user_id, ())):
+                self._remove(key)
+
+    def clear(self):
+        with self.lock:
+            self.tokens.clear()
+            self.users.clear()
 
-def _get_current_user(token: str, session: Session) -> dict:
+
+token_cache = TokenCache(env.token_cache_size)
+
+
+async def _get_current_user(token: str, session: AsyncSession) -> dict:
     if isinstance(env.auth, KeycloakSettings):
-        jwks_client = PyJWKClient(
-            f"{env.auth.server_url}/realms/{env.auth.realm_name}/protocol/openid-connect/certs"
-        )
-        signing_key = jwks_client.get_signing_key_from_jwt(token)
+        signing_key = await jwks_cache.get_signing_key_from_jwt(token)
         payload = jwt.decode(token, signing_key.key, algorithms=["RS256"])
         payload["username"] = payload.pop("preferred_username")
         return payload
@@ -39,7 +291,7 @@ def _get_current_user(token: str, session: Session) -> dict:
         payload = jwt.decode(
             token, env.auth.secret_key, algorithms=[env.auth.algorithm]
         )
-        session.get_one(SQLUser, UUID(payload["sub"]))
+        await session.get_one(SQLUser, UUID(payload["sub"]))
         return payload
 
     raise NOT_AUTHORIZED_ERROR
@@ -47,22 +299,30 @@ def _get_current_user(token: str, session: Session) -> dict:
 
 async def get_current_user(
     token: Annotated[str, Depends(oauth2_scheme)],
-    session: Annotated[Session, Depends(get_session)],
+    session: Annotated[AsyncSession, Depends(get_session)],
 ) -> User:
+    if user := token_cache.get(token):
+        return user
+
     try:
-        payload = _get_current_user(token, session)
-        return User(
+        payload = await _get_current_user(token, session)
+        user = User(
             id=payload["sub"],
             username=payload["username"],
             requests_per_minute=payload["requests_per_minute"],
             is_admin=payload["is_admin"],
             tokens_per_minute=payload["tokens_per_minute"],
             cost_usd_per_month=payload["cost_usd_per_month"],
+            weight=payload.get("weight", 1),
         )
 
     except (InvalidTokenError, KeyError, NoResultFound):
         raise NOT_AUTHORIZED_ERROR
 
+    if "exp" in payload:
+        token_cache.set(token, user, payload["exp"])
+    return user
+
 
 def get_admin_user(current_user: Annotated[User, Depends(get_current_user)]):
     if current_user and not current_user.is_admin:
@@ -74,21 +334,7 @@ def get_admin_user(current_user: Annotated[User, Depends(get_current_user)]):
 
 
 def get_token(user: User) -> str:
-    if isinstance(env.auth, KeycloakSettings):
-        data = {
-            "client_id": env.auth.client_id,
-            "client_secret": env.auth.client_secret_key,
-            "username": user.username,
-            "password": user.password,
-            "grant_type": "password",
-        }
-
-        keycloak_url = f"{env.auth.server_url}/realms/{env.auth.realm_name}/protocol/openid-connect/token"
-        response = requests.post(keycloak_url, data=data)
-        if response.status_code != 200:
-            raise NOT_AUTHORIZED_ERROR
-        return response.json()["access_token"]
-
+    """a locally signed access token, see KeycloakTokenClient for keycloak"""
     if isinstance(env.auth, LocalAuthSettings):
         access_token_expires = timedelta(minutes=env.auth.access_token_expire_minutes)
         data = {
@@ -98,6 +344,7 @@ def get_token(user: User) -> str:
             "is_admin": user.is_admin,
             "tokens_per_minute": user.tokens_per_minute,
             "cost_usd_per_month": user.cost_usd_per_month,
+            "weight": user.weight,
             "exp": datetime.now(timezone.utc) + access_token_expires,
         }
         encoded_jwt = jwt.encode(
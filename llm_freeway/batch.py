@@ -0,0 +1,157 @@
+import asyncio
+import bisect
+import hashlib
+import tempfile
+from collections import deque
+from collections.abc import AsyncIterable, AsyncIterator, Awaitable, Callable, Iterable
+from typing import IO, TypeVar
+
+import orjson
+from fastapi import HTTPException
+
+from llm_freeway.router import is_retryable
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+# seconds to wait before retrying an upstream 429/5xx
+UPSTREAM_RETRY_AFTER = 1
+
+
+class LineRanges:
+    """a set of line numbers, held as sorted, disjoint [first, last] ranges
+
+    A job's completed lines are mostly contiguous, so this stays a handful of
+    ranges however many lines have been checkpointed.
+    """
+
+    def __init__(self, ranges: Iterable[Iterable[int]] = ()):
+        self.ranges = [list(r) for r in ranges]
+
+    def __contains__(self, line: int) -> bool:
+        i = bisect.bisect_right(self.ranges, [line, float("inf")]) - 1
+        return i >= 0 and self.ranges[i][1] >= line
+
+    def __len__(self) -> int:
+        return sum(last - first + 1 for first, last in self.ranges)
+
+    def add(self, line: int):
+        if line in self:
+            return
+        i = bisect.bisect_right(self.ranges, [line, line])
+        joins_left = i > 0 and self.ranges[i - 1][1] == line - 1
+        joins_right = i < len(self.ranges) and self.ranges[i][0] == line + 1
+        if joins_left and joins_right:
+            self.ranges[i - 1][1] = self.ranges.pop(i)[1]
+        elif joins_left:
+            self.ranges[i - 1][1] = line
+        elif joins_right:
+            self.ranges[i][0] = line
+        else:
+            self.ranges.insert(i, [line, line])
+
+    def to_list(self) -> list[list[int]]:
+        return [list(r) for r in self.ranges]
+
+
+async def spool(chunks: AsyncIterable[bytes], max_size: int) -> tuple[IO[bytes], str]:
+    """write an upload to a temporary file, held in memory up to `max_size`
+    bytes and on disk beyond, returning it rewound along with its sha256
+
+    The file's lines can then be read one at a time, so a large batch never
+    has to be held in memory whole.
+    """
+    file = tempfile.SpooledTemporaryFile(max_size=max_size)
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        async for chunk in chunks:
+            digest.update(chunk)
+            size += len(chunk)
+            if size > max_size:
+                # on disk by now
+                await asyncio.to_thread(file.write, chunk)
+            else:
+                file.write(chunk)
+    except BaseException:
+        file.close()
+        raise
+    file.seek(0)
+    return file, digest.hexdigest()
+
+
+def retry_after(error: Exception) -> float | None:
+    """seconds to wait before retrying a line that failed with `error`, or
+    None if retrying won't help"""
+    if isinstance(error, HTTPException):
+        value = (error.headers or {}).get("Retry-After")
+        return float(value) if value is not None else None
+    if is_retryable(error):
+        return UPSTREAM_RETRY_AFTER
+    return None
+
+
+def encode_result(line: int, status_code: int, response: bytes) -> bytes:
+    """one JSONL result, `response` is already JSON so is spliced in as is"""
+    return b'{"line":%d,"status_code":%d,"response":%b}\n' % (
+        line,
+        status_code,
+        response,
+    )
+
+
+def encode_error(line: int, status_code: int, error) -> bytes:
+    return orjson.dumps(
+        {"line": line, "status_code": status_code, "error": error},
+        option=orjson.OPT_APPEND_NEWLINE,
+    )
+
+
+async def run_batch(
+    items: Iterable[T],
+    call: Callable[[T], Awaitable[R]],
+    concurrency: int,
+    ordered: bool = True,
+) -> AsyncIterator[R]:
+    """`call` each item, at most `concurrency` at once, yielding the results
+    in the items' order or, if not `ordered`, as they complete
+
+    Items are read lazily. In order, up to `concurrency` finished results
+    are held back behind a slow one before no more items are started, so a
+    single slow call doesn't stall the rest of the batch.
+    """
+    items = iter(items)
+    window = 2 * concurrency if ordered else concurrency
+    semaphore = asyncio.Semaphore(concurrency)
+    pending: deque[asyncio.Task] = deque()
+
+    async def limited(item: T) -> R:
+        async with semaphore:
+            return await call(item)
+
+    def fill():
+        while len(pending) < window:
+            try:
+                item = next(items)
+            except StopIteration:
+                return
+            pending.append(asyncio.create_task(limited(item)))
+
+    try:
+        fill()
+        while pending:
+            if ordered:
+                yield await pending[0]
+                pending.popleft()
+            else:
+                done, _ = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    pending.remove(task)
+                    yield task.result()
+            fill()
+    finally:
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
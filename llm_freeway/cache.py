@@ -0,0 +1,66 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from litellm import ModelResponse
+from pydantic import BaseModel
+
+from llm_freeway.settings import env
+
+
+class ResponseCache:
+    """completions for byte-identical requests
+
+    Entries expire `ttl` seconds after they are cached and the least
+    recently used are evicted to keep the serialised responses within
+    `max_bytes`, a `max_bytes` of 0 disables the cache.
+    """
+
+    def __init__(self, max_bytes: int, ttl: float):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.entries: OrderedDict[str, tuple[float, int, ModelResponse]] = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def key(request: BaseModel) -> str:
+        """a hash of everything but `stream` in the request"""
+        canonical = request.model_dump_json(exclude={"stream"})
+        return hashlib.sha256(canonical.encode()).hexdigest()
+
+    def _remove(self, key: str):
+        _, size, _ = self.entries.pop(key)
+        self.size -= size
+
+    def get(self, key: str) -> ModelResponse | None:
+        with self.lock:
+            if key not in self.entries:
+                return None
+            expires_at, _, response = self.entries[key]
+            if expires_at <= time.monotonic():
+                self._remove(key)
+                return None
+            self.entries.move_to_end(key)
+            return response
+
+    def set(self, key: str, response: ModelResponse):
+        size = len(response.model_dump_json())
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+            self.entries[key] = time.monotonic() + self.ttl, size, response
+            self.size += size
+            while self.size > self.max_bytes:
+                self._remove(next(iter(self.entries)))
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+
+response_cache = ResponseCache(env.response_cache_max_bytes, env.response_cache_ttl)
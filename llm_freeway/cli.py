@@ -0,0 +1,106 @@
+import argparse
+import os
+from pathlib import Path
+
+import httpx
+from sqlmodel import Session
+
+from llm_freeway.database import backfill_daily_spend, engine
+from llm_freeway.partitions import (
+    NOT_PARTITIONED,
+    create_tables,
+    event_log_is_partitioned,
+    is_partitioned,
+    maintain_partitions,
+)
+
+
+def backfill_rollup(args: argparse.Namespace):
+    with engine.begin() as connection:
+        create_tables(connection)
+    with Session(engine) as session:
+        backfill_daily_spend(session)
+
+
+def partitions(args: argparse.Namespace):
+    if not is_partitioned(engine):
+        raise SystemExit("EVENT_LOG_PARTITIONED is only supported on postgres")
+    with engine.begin() as connection:
+        create_tables(connection)
+        if not event_log_is_partitioned(connection):
+            raise SystemExit(NOT_PARTITIONED)
+        maintain_partitions(connection)
+
+
+def batch(args: argparse.Namespace):
+    """post a JSONL file to /batch and append the results to `args.output`
+
+    The job id is kept alongside the output, so running the same command
+    again after an interruption resumes the job rather than restarting it.
+    """
+    if not args.token:
+        raise SystemExit("pass --token or set LLM_FREEWAY_TOKEN")
+    job_file = Path(f"{args.output}.job")
+    params = {"order": args.order}
+    if args.concurrency:
+        params["concurrency"] = args.concurrency
+    if job_file.exists():
+        params["job_id"] = job_file.read_text().strip()
+
+    with (
+        open(args.input, "rb") as input,
+        open(args.output, "ab") as output,
+        httpx.stream(
+            "POST",
+            f"{args.url.rstrip('/')}/batch",
+            params=params,
+            content=input,
+            headers={
+                "Authorization": f"Bearer {args.token}",
+                "Content-Type": "application/x-ndjson",
+            },
+            timeout=None,
+        ) as response,
+    ):
+        if response.is_error:
+            response.read()
+            raise SystemExit(f"{response.status_code}: {response.text}")
+        job_file.write_text(response.headers["X-Batch-Job-Id"])
+        for line in response.iter_lines():
+            output.write(line.encode() + b"\n")
+            output.flush()
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(prog="llm-freeway")
+    commands = parser.add_subparsers(required=True)
+
+    backfill = commands.add_parser(
+        "backfill-rollup", help="rebuild the daily spend rollup from the EventLog"
+    )
+    backfill.set_defaults(func=backfill_rollup)
+
+    maintain = commands.add_parser(
+        "maintain-partitions",
+        help="create upcoming EventLog partitions and remove expired ones",
+    )
+    maintain.set_defaults(func=partitions)
+
+    run_batch = commands.add_parser(
+        "batch",
+        help="complete a JSONL file of chat requests, resuming an earlier run",
+    )
+    run_batch.add_argument("input", help="a JSONL file, one ChatRequest per line")
+    run_batch.add_argument("output", help="results are appended to this file")
+    run_batch.add_argument("--url", default="http://localhost:8000")
+    run_batch.add_argument("--token", default=os.getenv("LLM_FREEWAY_TOKEN"))
+    run_batch.add_argument("--concurrency", type=int)
+    run_batch.add_argument("--order", choices=["input", "completion"], default="input")
+    run_batch.set_defaults(func=batch)
+
+    args = parser.parse_args(argv)
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+import asyncio
+from collections.abc import AsyncIterator, Awaitable, Callable
+
+from litellm import CustomStreamWrapper, ModelResponse
+
+from llm_freeway.settings import env
+from llm_freeway.upstream import close_stream
+
+
+class Broadcast:
+    """one upstream stream, replayed to every subscriber
+
+    Parts are buffered as they arrive, so a subscriber that joins late first
+    receives everything sent so far and then follows the live stream. Once
+    the last subscriber leaves early the upstream stream is closed, rather
+    than read to the end for nobody.
+    """
+
+    def __init__(self):
+        self.parts: list = []
+        self.response_id: str | None = None
+        self.deployment: str | None = None
+        self.done = False
+        self.closed = False
+        self.error: BaseException | None = None
+        self.changed = asyncio.Event()
+        self.subscribers = 0
+        self.task: asyncio.Task | None = None
+
+    def _notify(self):
+        self.changed.set()
+        self.changed = asyncio.Event()
+
+    async def pump(self, open_stream: Callable[[], Awaitable[CustomStreamWrapper]]):
+        parts = None
+        try:
+            stream = await open_stream()
+            parts = aiter(stream)
+            async for part in parts:
+                self.parts.append(part)
+                self._notify()
+            self.response_id = stream.response_id
+            self.deployment = getattr(stream, "deployment", None)
+        except Exception as e:
+            self.error = e
+        finally:
+            self.done = True
+            self._notify()
+            if parts is not None:
+                await close_stream(parts)
+
+    def close(self):
+        """stop the upstream stream, once nobody is left to read it"""
+        self.closed = True
+        if self.task is not None:
+            self.task.cancel()
+
+    async def subscribe(self) -> AsyncIterator:
+        self.subscribers += 1
+        try:
+            index = 0
+            while True:
+                while index < len(self.parts):
+                    yield self.parts[index]
+                    index += 1
+                if self.done:
+                    if self.error:
+                        raise self.error
+                    return
+                await self.changed.wait()
+        finally:
+            self.subscribers -= 1
+            if not self.subscribers and not self.done:
+                self.close()
+
+
+class Passthrough:
+    """one upstream stream, read directly by its only subscriber"""
+
+    def __init__(self, open_stream: Callable[[], Awaitable[CustomStreamWrapper]]):
+        self.open_stream = open_stream
+        self.response_id: str | None = None
+        self.deployment: str | None = None
+
+    async def subscribe(self) -> AsyncIterator:
+        stream = await self.open_stream()
+        parts = aiter(stream)
+        try:
+            async for part in parts:
+                yield part
+            self.response_id = stream.response_id
+            self.deployment = getattr(stream, "deployment", None)
+        finally:
+            await close_stream(parts)
+
+
+class Coalescer:
+    """shares one upstream call between concurrent identical requests
+
+    Callers pass a key identifying the request; while a call for that key
+    is in flight, further callers wait for its response, or subscribe to its
+    stream, instead of making their own. When disabled every caller gets its
+    own call.
+    """
+
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self.completions: dict[str, asyncio.Future[ModelResponse]] = {}
+        self.streams: dict[str, Broadcast] = {}
+        self.tasks: set[asyncio.Task] = set()
+
+    async def complete(
+        self, key: str, call: Callable[[], Awaitable[ModelResponse]]
+    ) -> ModelResponse:
+        if not self.enabled:
+            return await call()
+        if key not in self.completions:
+            future = asyncio.ensure_future(call())
+            self.completions[key] = future
+            future.add_done_callback(lambda _: self.completions.pop(key, None))
+        # shield the shared call from any one caller being cancelled
+        return await asyncio.shield(self.completions[key])
+
+    def stream(
+        self, key: str, open_stream: Callable[[], Awaitable[CustomStreamWrapper]]
+    ) -> Broadcast | Passthrough:
+        if not self.enabled:
+            return Passthrough(open_stream)
+        if key in self.streams and not self.streams[key].closed:
+            return self.streams[key]
+
+        broadcast = Broadcast()
+        task = asyncio.create_task(broadcast.pump(open_stream))
+        broadcast.task = task
+        self.tasks.add(task)
+        self.streams[key] = broadcast
+
+        def done(_):
+            self.tasks.discard(task)
+            if self.streams.get(key) is broadcast:
+                del self.streams[key]
+
+        task.add_done_callback(done)
+        return broadcast
+
+
+coalescer = Coalescer(env.coalesce_requests)
@@ -1,22 +1,58 @@
-from datetime import UTC, datetime, timedelta
-from typing import Annotated
+from datetime import UTC, date, datetime, timedelta
 from uuid import UUID, uuid4
 
-from fastapi import Depends
-from passlib.context import CryptContext
 from pydantic import BaseModel
-from sqlalchemy import create_engine, func
+from sqlalchemy import (
+    JSON,
+    URL,
+    Column,
+    Connection,
+    Index,
+    StaticPool,
+    create_engine,
+    delete,
+    event,
+    func,
+    make_url,
+)
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import create_async_engine
 from sqlmodel import Field, Session, SQLModel, select
+from sqlmodel.ext.asyncio.session import AsyncSession
 
+from llm_freeway.passwords import password_hasher
 from llm_freeway.settings import env
 
-if env.database_url.startswith("sqlite://"):
-    connect_args = {"check_same_thread": False}
-    engine = create_engine(env.database_url, connect_args=connect_args)
-else:
-    engine = create_engine(env.database_url)
+ASYNC_DRIVERS = {"postgresql": "asyncpg", "sqlite": "aiosqlite"}
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+def async_database_url(url: str) -> URL:
+    """`url` through an asyncio driver"""
+    url = make_url(url)
+    backend = url.get_backend_name()
+    return url.set(drivername=f"{backend}+{ASYNC_DRIVERS[backend]}")
+
+
+def engine_kwargs(url: str) -> dict:
+    if url in ("sqlite://", "sqlite:///:memory:"):
+        # an in-memory database only exists on one connection, share it
+        return dict(connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    kwargs = dict(
+        pool_size=env.database_pool_size,
+        max_overflow=env.database_max_overflow,
+        pool_pre_ping=env.database_pool_pre_ping,
+        pool_recycle=env.database_pool_recycle,
+    )
+    if url.startswith("sqlite://"):
+        kwargs["connect_args"] = {"check_same_thread": False}
+    return kwargs
+
+
+# the app runs on the async engine, the sync one is for the cli
+engine = create_engine(env.database_url, **engine_kwargs(env.database_url))
+async_engine = create_async_engine(
+    async_database_url(env.database_url), **engine_kwargs(env.database_url)
+)
 
 
 class Token(BaseModel):
@@ -24,8 +60,8 @@ class Token(BaseModel):
     token_type: str
 
 
-def get_session():
-    with Session(engine) as session:
+async def get_session():
+    async with AsyncSession(async_engine, expire_on_commit=False) as session:
         yield session
 
 
@@ -43,12 +79,16 @@ class User(SQLModel):
     requests_per_minute: int = 60
     tokens_per_minute: int = 100_000
     cost_usd_per_month: int = 10
+    weight: float = Field(
+        default=1,
+        gt=0,
+        description="share of upstream capacity when requests are queued",
+    )
 
-    def get_spend(self, session) -> Spend:
+    async def get_spend(self, session: AsyncSession) -> Spend:
         one_minute_ago = datetime.now(tz=UTC) - timedelta(minutes=1)
-        one_month_ago = datetime.now(tz=UTC) - timedelta(days=30)
 
-        completion_tokens, prompt_tokens, requests = session.exec(
+        result = await session.exec(
             select(
                 func.sum(EventLog.completion_tokens),
                 func.sum(EventLog.prompt_tokens),
@@ -57,23 +97,28 @@ class User(SQLModel):
                 EventLog.user_id == self.id,
                 EventLog.timestamp > one_minute_ago,
             )
-        ).one()
-
-        cost_usd = session.exec(
-            select(
-                func.sum(EventLog.cost_usd),
-            ).where(
-                EventLog.user_id == self.id,
-                EventLog.timestamp > one_month_ago,
-            )
-        ).one()
+        )
+        completion_tokens, prompt_tokens, requests = result.one()
 
         return Spend(
             completion_tokens=completion_tokens or 0,
             prompt_tokens=prompt_tokens or 0,
             requests=requests or 0,
-            cost_usd=cost_usd,
+            cost_usd=await self.get_cost_usd(session),
+        )
+
+    async def get_cost_usd(self, session: AsyncSession) -> float | None:
+        one_month_ago = date.today() - timedelta(days=30)
+
+        result = await session.exec(
+            select(
+                func.sum(DailySpend.cost_usd),
+            ).where(
+                DailySpend.user_id == self.id,
+                DailySpend.day >= one_month_ago,
+            )
         )
+        return result.one()
 
 
 class SQLUser(User, table=True):
@@ -87,13 +132,53 @@ class KeycloakUser(User):
 class LLMBase(SQLModel):
     input_cost_per_token: float
     output_cost_per_token: float
+    cache_responses: bool = Field(
+        default=False,
+        description="serve repeated non-streaming requests from the response cache",
+    )
+    max_concurrency: int | None = Field(
+        default=None,
+        description="upstream calls in flight at once, MODEL_MAX_CONCURRENCY if unset",
+    )
+
+    def get_cost_usd(self, prompt_tokens: int, completion_tokens: int) -> float:
+        return (
+            prompt_tokens * self.input_cost_per_token
+            + completion_tokens * self.output_cost_per_token
+        )
 
 
 class LLM(LLMBase, table=True):
     name: str = Field(primary_key=True, description="the litellm-model name")
 
 
+class Deployment(SQLModel, table=True):
+    """one of the upstream deployments serving an LLM
+
+    An LLM without deployments is called by its own name, otherwise each
+    request is routed to one of its deployments, see `router.Router`.
+    """
+
+    name: str = Field(primary_key=True)
+    llm: str = Field(foreign_key="llm.name", index=True)
+    model: str = Field(description="the litellm-model name")
+    litellm_params: dict = Field(
+        default_factory=dict,
+        sa_column=Column(JSON),
+        description="extra litellm arguments, i.e. api_base or api_key, values "
+        "like os.environ/NAME are read from the environment",
+    )
+    max_concurrency: int | None = Field(
+        default=None, description="requests in flight at once, unlimited if unset"
+    )
+
+
 class EventLog(SQLModel, table=True):
+    __table_args__ = (
+        Index("ix_eventlog_user_id_timestamp", "user_id", "timestamp"),
+        Index("ix_eventlog_timestamp_id", "timestamp", "id"),
+    )
+
     id: UUID = Field(default_factory=uuid4, primary_key=True)
     timestamp: datetime = Field(default_factory=datetime.now)
     response_id: str = Field(index=True)
@@ -102,14 +187,147 @@ class EventLog(SQLModel, table=True):
     prompt_tokens: int = Field()
     completion_tokens: int = Field()
     cost_usd: float | None = None
+    cache_hit: bool = False
+    deployment: str | None = None
+
+
+class DailySpend(SQLModel, table=True):
+    """EventLogs summed per user, model and day
+
+    Kept up to date as EventLogs are written, see `update_daily_spend`, so
+    that monthly budgets can be checked without scanning the EventLog.
+    """
+
+    user_id: UUID = Field(primary_key=True)
+    model: str = Field(primary_key=True, foreign_key="llm.name")
+    day: date = Field(primary_key=True)
+    requests: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    cost_usd: float = 0
+
+
+class BatchJob(SQLModel, table=True):
+    """a `/batch` run, checkpointed so it can be resumed"""
+
+    id: UUID = Field(default_factory=uuid4, primary_key=True)
+    user_id: UUID = Field(index=True)
+    content_hash: str = Field(description="sha256 of the posted file")
+    created_at: datetime = Field(default_factory=datetime.now)
+    updated_at: datetime = Field(default_factory=datetime.now)
+    completed_lines: list = Field(
+        default_factory=list,
+        sa_column=Column(JSON),
+        description="[first, last] ranges of the line numbers that succeeded",
+    )
+
+
+def update_daily_spend(connection: Connection, logs: list[EventLog], sign: int = 1):
+    """add (or with sign=-1 remove) logs to the DailySpend rollup"""
+    totals = {}
+    for log in logs:
+        key = log.user_id, log.model, log.timestamp.date()
+        requests, prompt_tokens, completion_tokens, cost_usd = totals.get(
+            key, (0, 0, 0, 0)
+        )
+        totals[key] = (
+            requests + sign,
+            prompt_tokens + sign * log.prompt_tokens,
+            completion_tokens + sign * log.completion_tokens,
+            cost_usd + sign * (log.cost_usd or 0),
+        )
+    if not totals:
+        return
+
+    dialect = postgresql if connection.dialect.name == "postgresql" else sqlite
+    statement = dialect.insert(DailySpend).values(
+        [
+            dict(
+                user_id=user_id,
+                model=model,
+                day=day,
+                requests=requests,
+                prompt_tokens=prompt_tokens,
+                completion_tokens=completion_tokens,
+                cost_usd=cost_usd,
+            )
+            for (user_id, model, day), (
+                requests,
+                prompt_tokens,
+                completion_tokens,
+                cost_usd,
+            ) in totals.items()
+        ]
+    )
+    table = DailySpend.__table__
+    connection.execute(
+        statement.on_conflict_do_update(
+            index_elements=[table.c.user_id, table.c.model, table.c.day],
+            set_={
+                column: table.c[column] + statement.excluded[column]
+                for column in (
+                    "requests",
+                    "prompt_tokens",
+                    "completion_tokens",
+                    "cost_usd",
+                )
+            },
+        )
+    )
+
+
+@event.listens_for(Session, "after_flush")
+def _update_daily_spend(session: Session, flush_context):
+    new = [log for log in session.new if isinstance(log, EventLog)]
+    deleted = [log for log in session.deleted if isinstance(log, EventLog)]
+    if new or deleted:
+        update_daily_spend(session.connection(), new)
+        update_daily_spend(session.connection(), deleted, sign=-1)
+
+
+def backfill_daily_spend(session: Session):
+    """rebuild the DailySpend rollup from the EventLog"""
+    day = func.date(EventLog.timestamp)
+    session.exec(delete(DailySpend))
+    session.exec(
+        DailySpend.__table__.insert().from_select(
+            [
+                "user_id",
+                "model",
+                "day",
+                "requests",
+                "prompt_tokens",
+                "completion_tokens",
+                "cost_usd",
+            ],
+            select(
+                EventLog.user_id,
+                EventLog.model,
+                day,
+                func.count(EventLog.id),
+                func.sum(EventLog.prompt_tokens),
+                func.sum(EventLog.completion_tokens),
+                func.coalesce(func.sum(EventLog.cost_usd), 0),
+            ).group_by(EventLog.user_id, EventLog.model, day),
+        )
+    )
+    session.commit()
 
 
-def authenticate_user(
-    username: str, password: str, session: Annotated[Session, Depends(get_session)]
+async def authenticate_user(
+    username: str, password: str, session: AsyncSession
 ) -> User | None:
-    user = session.exec(select(SQLUser).where(SQLUser.username == username)).one()
+    result = await session.exec(select(SQLUser).where(SQLUser.username == username))
+    user = result.one_or_none()
     if not user:
         return None
-    if not pwd_context.verify(password, user.hashed_password):
+    verified, new_hash = await password_hasher.verify_and_update(
+        password, user.hashed_password
+    )
+    if not verified:
         return None
+    if new_hash:
+        user.hashed_password = new_hash
+        session.add(user)
+        await session.commit()
     return user
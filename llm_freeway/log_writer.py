@@ -0,0 +1,170 @@
+import asyncio
+import json
+import logging
+from typing import Literal
+
+from sqlalchemy import insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from llm_freeway.database import EventLog, async_engine, update_daily_spend
+from llm_freeway.quota import quota
+from llm_freeway.settings import env
+
+logger = logging.getLogger(__name__)
+
+
+class LogWriter:
+    """queues EventLogs and writes them to the database in batches
+
+    A batch is written, in a single transaction, once `batch_size` logs are
+    waiting or `flush_interval` seconds after the first of them arrived. When
+    `max_queue_size` logs are waiting `queue_full` decides whether callers
+    wait for room ("block") or the log is discarded ("drop"). Everything
+    queued before `stop` is called is written before it returns.
+
+    A batch that fails to write is retried, backing off from `retry_delay`
+    up to `max_retry_delay` seconds, while new logs wait in the queue. Once
+    stopping a batch is tried `stop_attempts` times, after which its rows
+    are logged, as JSON, rather than lost without trace. A batch holding a
+    row that can't be written, i.e. for a model that has been removed, is
+    split until only that row is given up.
+    """
+
+    def __init__(
+        self,
+        engine: AsyncEngine,
+        batch_size: int = 500,
+        flush_interval: float = 1.0,
+        max_queue_size: int = 10_000,
+        queue_full: Literal["block", "drop"] = "block",
+        retry_delay: float = 0.5,
+        max_retry_delay: float = 30,
+        stop_attempts: int = 3,
+    ):
+        self.engine = engine
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_queue_size = max_queue_size
+        self.queue_full = queue_full
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.stop_attempts = stop_attempts
+        self.stopping = False
+        self.queue: asyncio.Queue[EventLog | None] | None = None
+        self.task: asyncio.Task | None = None
+
+    @property
+    def running(self) -> bool:
+        return self.task is not None and not self.task.done()
+
+    async def start(self):
+        self.stopping = False
+        self.queue = asyncio.Queue(maxsize=self.max_queue_size)
+        self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        self.stopping = True
+        if self.running:
+            await self.queue.put(None)
+            await self.task
+        self.task = None
+
+    async def put(self, log: EventLog):
+        if self.queue_full == "drop":
+            try:
+                self.queue.put_nowait(log)
+            except asyncio.QueueFull:
+                logger.warning("log queue full, dropping %s", log.response_id)
+        else:
+            await self.queue.put(log)
+
+    async def _write(self, batch: list[EventLog]):
+        async with self.engine.begin() as connection:
+            await connection.execute(
+                insert(EventLog), [log.model_dump() for log in batch]
+            )
+            await connection.run_sync(update_daily_spend, batch)
+
+    def _give_up(self, batch: list[EventLog]):
+        logger.error(
+            "gave up writing %d event logs: %s",
+            len(batch),
+            json.dumps([log.model_dump(mode="json") for log in batch]),
+        )
+
+    async def flush(self, batch: list[EventLog]):
+        delay = self.retry_delay
+        attempts = 0
+        while True:
+            attempts += 1
+            try:
+                await self._write(batch)
+                return
+            except IntegrityError:
+                # retrying can't help, but only some of the rows conflict with
+                # what's there, so write each half on its own to find them
+                if len(batch) > 1:
+                    half = len(batch) // 2
+                    await self.flush(batch[:half])
+                    await self.flush(batch[half:])
+                    return
+                logger.exception("failed to write event log")
+                self._give_up(batch)
+                return
+            except Exception:
+                logger.exception("failed to write %d event logs", len(batch))
+                if self.stopping and attempts >= self.stop_attempts:
+                    self._give_up(batch)
+                    return
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, self.max_retry_delay)
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            log = await self.queue.get()
+            if log is None:
+                break
+            batch = [log]
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                try:
+                    log = await asyncio.wait_for(
+                        self.queue.get(), max(deadline - loop.time(), 0)
+                    )
+                except TimeoutError:
+                    break
+                if log is None:
+                    stopping = True
+                    break
+                batch.append(log)
+            await self.flush(batch)
+
+
+log_writer = LogWriter(
+    async_engine,
+    batch_size=env.log_batch_size,
+    flush_interval=env.log_flush_interval,
+    max_queue_size=env.log_queue_size,
+    queue_full=env.log_queue_full,
+    retry_delay=env.log_retry_delay,
+    max_retry_delay=env.log_retry_max_delay,
+    stop_attempts=env.log_stop_attempts,
+)
+
+
+async def write_log(log: EventLog, session: AsyncSession):
+    """count the log against the user's quota then save it
+
+    Logs are handed to the background writer when it's running (it is
+    started in the app's lifespan) and otherwise written straight away.
+    """
+    await quota.record(log)
+    if log_writer.running:
+        await log_writer.put(log)
+    else:
+        session.add(log)
+        await session.commit()
@@ -0,0 +1,66 @@
+import threading
+from typing import Literal
+
+Labels = tuple[tuple[str, str], ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Metrics:
+    """counters and gauges, served from /metrics in the prometheus text format
+
+    Metrics are registered once, with a type and help text, and each set of
+    labels they are updated with becomes its own series.
+    """
+
+    def __init__(self):
+        self.descriptions: dict[str, tuple[str, str]] = {}
+        self.series: dict[str, dict[Labels, float]] = {}
+        self.lock = threading.Lock()
+
+    def register(self, name: str, type_: Literal["counter", "gauge"], help: str):
+        self.descriptions[name] = type_, help
+        self.series.setdefault(name, {})
+
+    @staticmethod
+    def _labels(labels: dict[str, str]) -> Labels:
+        return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+    def inc(self, name: str, value: float = 1, **labels: str):
+        key = self._labels(labels)
+        with self.lock:
+            series = self.series[name]
+            series[key] = series.get(key, 0) + value
+
+    def set(self, name: str, value: float, **labels: str):
+        with self.lock:
+            self.series[name][self._labels(labels)] = value
+
+    def get(self, name: str, **labels: str) -> float:
+        return self.series[name].get(self._labels(labels), 0)
+
+    def render(self) -> str:
+        lines = []
+        with self.lock:
+            for name, series in self.series.items():
+                type_, help = self.descriptions[name]
+                lines += [f"# HELP {name} {help}", f"# TYPE {name} {type_}"]
+                for labels, value in series.items():
+                    if labels:
+                        label_text = ",".join(
+                            f'{key}="{_escape(value)}"' for key, value in labels
+                        )
+                        lines.append(f"{name}{{{label_text}}} {value}")
+                    else:
+                        lines.append(f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+    def clear(self):
+        with self.lock:
+            for series in self.series.values():
+                series.clear()
+
+
+metrics = Metrics()
@@ -0,0 +1,160 @@
+import asyncio
+import logging
+import re
+from datetime import date, timedelta
+
+from sqlalchemy import Connection, Engine, MetaData, PrimaryKeyConstraint, Table, text
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlmodel import SQLModel
+
+from llm_freeway.database import LLM, EventLog
+from llm_freeway.settings import env
+
+logger = logging.getLogger(__name__)
+
+PARTITION_NAME = re.compile(r"^eventlog_y(\d{4})m(\d{2})$")
+
+NOT_PARTITIONED = (
+    "EVENT_LOG_PARTITIONED is set but the eventlog table is not partitioned, "
+    "migrate the table first"
+)
+
+
+def add_months(month: date, months: int) -> date:
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month: date) -> str:
+    return f"eventlog_y{month.year:04d}m{month.month:02d}"
+
+
+def partitioned_event_log() -> Table:
+    """a copy of the EventLog table, range-partitioned by timestamp
+
+    postgres requires the partition key to be part of the primary key, the
+    indexes are created on every partition.
+    """
+    metadata = MetaData()
+    LLM.__table__.to_metadata(metadata)
+    table = EventLog.__table__.to_metadata(metadata)
+    table.c.timestamp.primary_key = True
+    table.append_constraint(PrimaryKeyConstraint(table.c.id, table.c.timestamp))
+    table.dialect_options["postgresql"]["partition_by"] = "RANGE (timestamp)"
+    return table
+
+
+def months_to_create(
+    today: date, ahead: int, retention_months: int | None
+) -> list[date]:
+    this_month = today.replace(day=1)
+    first = (
+        add_months(this_month, -retention_months) if retention_months else this_month
+    )
+    months = [first]
+    while months[-1] < add_months(this_month, ahead):
+        months.append(add_months(months[-1], 1))
+    return months
+
+
+def expired_partitions(
+    names: list[str], today: date, retention_months: int | None
+) -> list[str]:
+    """partitions holding only logs older than `retention_months` full months"""
+    if not retention_months:
+        return []
+    oldest = add_months(today.replace(day=1), -retention_months)
+    expired = []
+    for name in names:
+        if match := PARTITION_NAME.match(name):
+            year, month = map(int, match.groups())
+            if date(year, month, 1) < oldest:
+                expired.append(name)
+    return sorted(expired)
+
+
+def list_partitions(connection: Connection) -> list[str]:
+    return list(
+        connection.execute(
+            text(
+                "SELECT child.relname FROM pg_inherits "
+                "JOIN pg_class parent ON pg_inherits.inhparent = parent.oid "
+                "JOIN pg_class child ON pg_inherits.inhrelid = child.oid "
+                "WHERE parent.relname = :table"
+            ),
+            {"table": EventLog.__tablename__},
+        ).scalars()
+    )
+
+
+def event_log_is_partitioned(connection: Connection) -> bool:
+    """whether the eventlog table exists and is partitioned"""
+    relkind = connection.execute(
+        text("SELECT relkind FROM pg_class WHERE oid = to_regclass(:table)"),
+        {"table": EventLog.__tablename__},
+    ).scalar()
+    return relkind == "p"
+
+
+def maintain_partitions(connection: Connection, today: date | None = None):
+    """create upcoming monthly partitions and remove those past retention
+
+    An eventlog table created before EVENT_LOG_PARTITIONED was set isn't
+    partitioned, and is left alone until it has been migrated.
+    """
+    if not event_log_is_partitioned(connection):
+        logger.warning("%s, skipping partition maintenance", NOT_PARTITIONED)
+        return
+    today = today or date.today()
+    for month in months_to_create(
+        today, env.event_log_partitions_ahead, env.event_log_retention_months
+    ):
+        connection.execute(
+            text(
+                f"CREATE TABLE IF NOT EXISTS {partition_name(month)} "
+                f"PARTITION OF {EventLog.__tablename__} "
+                f"FOR VALUES FROM ('{month}') TO ('{add_months(month, 1)}')"
+            )
+        )
+
+    for name in expired_partitions(
+        list_partitions(connection), today, env.event_log_retention_months
+    ):
+        logger.info("removing expired partition %s", name)
+        connection.execute(
+            text(f"ALTER TABLE {EventLog.__tablename__} DETACH PARTITION {name}")
+        )
+        if env.event_log_retention == "drop":
+            connection.execute(text(f"DROP TABLE {name}"))
+
+
+async def maintain_partitions_periodically(
+    engine: AsyncEngine, interval: timedelta = timedelta(days=1)
+):
+    while True:
+        await asyncio.sleep(interval.total_seconds())
+        try:
+            async with engine.begin() as connection:
+                await connection.run_sync(maintain_partitions)
+        except Exception:
+            logger.exception("failed to maintain EventLog partitions")
+
+
+def is_partitioned(bind: Engine | AsyncEngine | Connection) -> bool:
+    return env.event_log_partitioned and bind.dialect.name == "postgresql"
+
+
+def create_tables(connection: Connection):
+    """create any missing tables, partitioning the EventLog if configured"""
+    if is_partitioned(connection):
+        SQLModel.metadata.create_all(
+            connection,
+            tables=[
+                table
+                for table in SQLModel.metadata.sorted_tables
+                if table.name != EventLog.__tablename__
+            ],
+        )
+        partitioned_event_log().create(connection, checkfirst=True)
+        maintain_partitions(connection)
+    SQLModel.metadata.create_all(connection)
@@ -0,0 +1,47 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from passlib.context import CryptContext
+
+from llm_freeway.settings import env
+
+
+class PasswordHasher:
+    """bcrypt, run in a bounded thread pool so it never blocks the event loop
+
+    bcrypt releases the GIL, so up to `max_workers` passwords are hashed in
+    parallel. Hashes made with a cost other than `rounds` are reported by
+    `verify_and_update` so they can be replaced when the user next logs in.
+    """
+
+    def __init__(self, rounds: int = 12, max_workers: int | None = None):
+        self.context = CryptContext(
+            schemes=["bcrypt"],
+            deprecated="auto",
+            bcrypt__default_rounds=rounds,
+            bcrypt__min_rounds=rounds,
+            bcrypt__max_rounds=rounds,
+        )
+        self.executor = ThreadPoolExecutor(max_workers, thread_name_prefix="bcrypt")
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(
+            self.executor, func, *args
+        )
+
+    async def hash(self, password: str) -> str:
+        return await self._run(self.context.hash, password)
+
+    async def hash_many(self, passwords: list[str]) -> list[str]:
+        return await asyncio.gather(*(self.hash(password) for password in passwords))
+
+    async def verify_and_update(
+        self, password: str, hashed_password: str
+    ) -> tuple[bool, str | None]:
+        """whether the password matches, and a new hash if the old is outdated"""
+        return await self._run(
+            self.context.verify_and_update, password, hashed_password
+        )
+
+
+password_hasher = PasswordHasher(env.bcrypt_rounds, env.password_hash_workers)
@@ -0,0 +1,415 @@
+import bisect
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from datetime import date, datetime, timedelta
+from uuid import UUID, uuid4
+
+from redis.asyncio import Redis
+from redis.exceptions import WatchError
+from sqlalchemy import func
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from llm_freeway.database import DailySpend, EventLog, Spend, User
+from llm_freeway.settings import env
+
+
+class SlidingWindow:
+    """requests and tokens a user has spent within the last `window` seconds"""
+
+    def __init__(self, window: float):
+        self.window = window
+        self.events: deque[tuple[float, int, int]] = deque()
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+
+    def add(self, timestamp: float, prompt_tokens: int, completion_tokens: int):
+        event = (timestamp, prompt_tokens, completion_tokens)
+        if self.events and timestamp < self.events[-1][0]:
+            bisect.insort(self.events, event)
+        else:
+            self.events.append(event)
+        self.prompt_tokens += prompt_tokens
+        self.completion_tokens += completion_tokens
+
+    def expire(self, now: float):
+        cutoff = now - self.window
+        while self.events and self.events[0][0] <= cutoff:
+            _, prompt_tokens, completion_tokens = self.events.popleft()
+            self.prompt_tokens -= prompt_tokens
+            self.completion_tokens -= completion_tokens
+
+    def __len__(self) -> int:
+        return len(self.events)
+
+
+@dataclass
+class Reservation:
+    """tokens set aside for a request until its real usage is recorded"""
+
+    user_id: UUID
+    tokens: int
+    # tokens the user had already spent or reserved within the window
+    in_use: int = 0
+    granted: bool = False
+    id: str = field(default_factory=lambda: uuid4().hex)
+
+
+class BaseQuota:
+    """tracks each user's recent spend for the checks in /chat/completions
+
+    A request's estimated tokens are reserved before it is sent upstream, so
+    concurrent requests can't all pass the tokens-per-minute check at once.
+    Once its real usage has been `record`ed the reservation is reconciled,
+    i.e. dropped in favour of the actual tokens.
+    """
+
+    async def seed(self, session: AsyncSession):
+        raise NotImplementedError
+
+    def clear(self):
+        """forget any state held by this process"""
+        raise NotImplementedError
+
+    async def record(self, log: EventLog):
+        raise NotImplementedError
+
+    async def get_spend(self, user: User, session: AsyncSession) -> Spend:
+        raise NotImplementedError
+
+    async def reserve(
+        self, user: User, tokens: int, session: AsyncSession
+    ) -> Reservation:
+        """reserve `tokens` if they fit within the user's tokens_per_minute,
+        alongside the tokens spent and reserved in the last minute"""
+        raise NotImplementedError
+
+    async def reconcile(self, reservation: Reservation):
+        """drop a reservation, once the request's usage has been recorded"""
+        raise NotImplementedError
+
+
+class MemoryQuota(BaseQuota):
+    """sliding-window rate limiter held in process memory
+
+    Windows are seeded from the EventLog, either for all users at startup
+    via `seed` or lazily the first time a user is seen, and are then kept
+    up to date by `record` as logs are written, so checking a user's
+    requests/tokens per minute does not touch the database.
+
+    Reservations expire after `reservation_ttl` seconds, as in `RedisQuota`,
+    so one that is never reconciled can't hold the user's tokens for good.
+    """
+
+    def __init__(
+        self, window: timedelta = timedelta(minutes=1), reservation_ttl: float = 600
+    ):
+        self.window = window
+        self.reservation_ttl = reservation_ttl
+        self.windows: dict[UUID, SlidingWindow] = {}
+        # reservation id: (tokens, when it expires), per user
+        self.reservations: dict[UUID, dict[str, tuple[int, float]]] = {}
+        self.seeded = False
+
+    async def _load(self, session: AsyncSession, user_id: UUID | None = None):
+        query = select(
+            EventLog.user_id,
+            EventLog.timestamp,
+            EventLog.prompt_tokens,
+            EventLog.completion_tokens,
+        ).where(EventLog.timestamp > datetime.now() - self.window)
+        if user_id:
+            query = query.where(EventLog.user_id == user_id)
+
+        result = await session.exec(query.order_by(EventLog.timestamp))
+        for _user_id, timestamp, prompt_tokens, completion_tokens in result:
+            self._get_window(_user_id).add(
+                timestamp.timestamp(), prompt_tokens, completion_tokens
+            )
+
+    def _get_window(self, user_id: UUID) -> SlidingWindow:
+        if user_id not in self.windows:
+            self.windows[user_id] = SlidingWindow(self.window.total_seconds())
+        return self.windows[user_id]
+
+    async def seed(self, session: AsyncSession):
+        self.clear()
+        await self._load(session)
+        self.seeded = True
+
+    def clear(self):
+        self.windows.clear()
+        self.reservations.clear()
+        self.seeded = False
+
+    async def record(self, log: EventLog):
+        self._get_window(log.user_id).add(
+            log.timestamp.timestamp(), log.prompt_tokens, log.completion_tokens
+        )
+
+    async def get_spend(self, user: User, session: AsyncSession) -> Spend:
+        if user.id not in self.windows and not self.seeded:
+            await self._load(session, user.id)
+
+        window = self._get_window(user.id)
+        window.expire(time.time())
+        return Spend(
+            requests=len(window),
+            prompt_tokens=window.prompt_tokens,
+            completion_tokens=window.completion_tokens,
+            cost_usd=await user.get_cost_usd(session),
+        )
+
+    async def reserve(
+        self, user: User, tokens: int, session: AsyncSession
+    ) -> Reservation:
+        if user.id not in self.windows and not self.seeded:
+            await self._load(session, user.id)
+
+        # no awaits from here on, so checking and reserving is atomic
+        now = time.time()
+        window = self._get_window(user.id)
+        window.expire(now)
+        reservations = self.reservations.setdefault(user.id, {})
+        for id, (_, expires_at) in list(reservations.items()):
+            if expires_at <= now:
+                del reservations[id]
+        reservation = Reservation(
+            user_id=user.id,
+            tokens=tokens,
+            in_use=window.prompt_tokens
+            + window.completion_tokens
+            + sum(reserved for reserved, _ in reservations.values()),
+        )
+        if reservation.in_use + tokens <= user.tokens_per_minute:
+            reservations[reservation.id] = tokens, now + self.reservation_ttl
+            reservation.granted = True
+        return reservation
+
+    async def reconcile(self, reservation: Reservation):
+        reservations = self.reservations.get(reservation.user_id, {})
+        reservations.pop(reservation.id, None)
+        if not reservations:
+            self.reservations.pop(reservation.user_id, None)
+
+
+class RedisQuota(BaseQuota):
+    """quota counters shared by every worker and replica through redis
+
+    Per-minute usage is kept in one hash per user per window and read as a
+    sliding-window counter: the current window plus the share of the
+    previous window that still overlaps the last `window` seconds. Spend is
+    kept in one counter per user per day. Counters are seeded from the
+    EventLog the first time any process sees a user, after which checking
+    a user's quota is a single round trip to redis.
+
+    Reservations are kept in a sorted set per user, scored by when they
+    expire (after `reservation_ttl` seconds, should a worker die before
+    reconciling them), and are checked and added in a WATCH/MULTI
+    transaction that is retried if another worker got there first.
+    """
+
+    fields = ("requests", "prompt_tokens", "completion_tokens")
+
+    def __init__(
+        self,
+        client: Redis,
+        prefix: str = "quota",
+        window: timedelta = timedelta(minutes=1),
+        days: int = 30,
+        reservation_ttl: float = 600,
+    ):
+        self.client = client
+        self.prefix = prefix
+        self.window = window.total_seconds()
+        self.days = days
+        self.reservation_ttl = reservation_ttl
+        self.seeded: set[UUID] = set()
+
+    def _window_key(self, user_id: UUID, window: int) -> str:
+        return f"{self.prefix}:{user_id}:window:{window}"
+
+    def _reservations_key(self, user_id: UUID) -> str:
+        return f"{self.prefix}:{user_id}:reservations"
+
+    def _day_key(self, user_id: UUID, day: date) -> str:
+        return f"{self.prefix}:{user_id}:day:{day.isoformat()}"
+
+    def _day_keys(self, user_id: UUID) -> list[str]:
+        today = date.today()
+        return [
+            self._day_key(user_id, today - timedelta(days=days))
+            for days in range(self.days + 1)
+        ]
+
+    def _add_usage(self, pipe, user_id, timestamp: float, *usage: int):
+        key = self._window_key(user_id, int(timestamp // self.window))
+        for name, value in zip(self.fields, usage):
+            pipe.hincrby(key, name, value)
+        pipe.expire(key, int(self.window * 2))
+
+    def _add_cost(self, pipe, user_id, day: date, cost_usd: float):
+        key = self._day_key(user_id, day)
+        pipe.incrbyfloat(key, cost_usd)
+        pipe.expire(key, (self.days + 1) * 24 * 60 * 60)
+
+    async def _seed_user(self, user_id: UUID, session: AsyncSession):
+        if user_id in self.seeded:
+            return
+        seeded_key = f"{self.prefix}:{user_id}:seeded"
+        if await self.client.set(seeded_key, 1, nx=True):
+            events = await session.exec(
+                select(
+                    EventLog.timestamp,
+                    EventLog.prompt_tokens,
+                    EventLog.completion_tokens,
+                ).where(
+                    EventLog.user_id == user_id,
+                    EventLog.timestamp
+                    > datetime.now() - timedelta(seconds=self.window * 2),
+                )
+            )
+            events = events.all()
+            costs = await session.exec(
+                select(DailySpend.day, func.sum(DailySpend.cost_usd))
+                .where(
+                    DailySpend.user_id == user_id,
+                    DailySpend.day >= date.today() - timedelta(days=self.days),
+                )
+                .group_by(DailySpend.day)
+            )
+            costs = costs.all()
+
+            async with self.client.pipeline(transaction=True) as pipe:
+                for timestamp, prompt_tokens, completion_tokens in events:
+                    self._add_usage(
+                        pipe,
+                        user_id,
+                        timestamp.timestamp(),
+                        1,
+                        prompt_tokens,
+                        completion_tokens,
+                    )
+                for day, cost_usd in costs:
+                    if cost_usd:
+                        self._add_cost(pipe, user_id, day, cost_usd)
+                await pipe.execute()
+        self.seeded.add(user_id)
+
+    async def seed(self, session: AsyncSession):
+        """users are seeded lazily, once across all processes"""
+
+    def clear(self):
+        self.seeded.clear()
+
+    async def record(self, log: EventLog):
+        async with self.client.pipeline(transaction=True) as pipe:
+            self._add_usage(
+                pipe,
+                log.user_id,
+                log.timestamp.timestamp(),
+                1,
+                log.prompt_tokens,
+                log.completion_tokens,
+            )
+            if log.cost_usd:
+                self._add_cost(pipe, log.user_id, log.timestamp.date(), log.cost_usd)
+            await pipe.execute()
+
+    def _window_keys(self, user_id: UUID) -> tuple[str, str, float]:
+        """the current and previous window's keys, and the share of the
+        previous window still within the last `window` seconds"""
+        window, elapsed = divmod(time.time(), self.window)
+        return (
+            self._window_key(user_id, int(window)),
+            self._window_key(user_id, int(window) - 1),
+            1 - elapsed / self.window,
+        )
+
+    @staticmethod
+    def _usage(current: list, previous: list, overlap: float) -> list[int]:
+        return [
+            int(int(now or 0) + int(before or 0) * overlap)
+            for now, before in zip(current, previous)
+        ]
+
+    async def get_spend(self, user: User, session: AsyncSession) -> Spend:
+        await self._seed_user(user.id, session)
+
+        current_key, previous_key, overlap = self._window_keys(user.id)
+        async with self.client.pipeline(transaction=False) as pipe:
+            pipe.hmget(current_key, self.fields)
+            pipe.hmget(previous_key, self.fields)
+            pipe.mget(self._day_keys(user.id))
+            current, previous, costs = await pipe.execute()
+
+        requests, prompt_tokens, completion_tokens = self._usage(
+            current, previous, overlap
+        )
+        costs = [float(cost) for cost in costs if cost is not None]
+        return Spend(
+            requests=requests,
+            prompt_tokens=prompt_tokens,
+            completion_tokens=completion_tokens,
+            cost_usd=sum(costs) if costs else None,
+        )
+
+    async def reserve(
+        self, user: User, tokens: int, session: AsyncSession
+    ) -> Reservation:
+        await self._seed_user(user.id, session)
+
+        reservations_key = self._reservations_key(user.id)
+        reservation = Reservation(user_id=user.id, tokens=tokens)
+        async with self.client.pipeline(transaction=True) as pipe:
+            while True:
+                current_key, previous_key, overlap = self._window_keys(user.id)
+                now = time.time()
+                try:
+                    await pipe.watch(current_key, previous_key, reservations_key)
+                    current = await pipe.hmget(current_key, self.fields)
+                    previous = await pipe.hmget(previous_key, self.fields)
+                    reserved = await pipe.zrangebyscore(reservations_key, now, "+inf")
+                    _, prompt_tokens, completion_tokens = self._usage(
+                        current, previous, overlap
+                    )
+                    reservation.in_use = (
+                        prompt_tokens
+                        + completion_tokens
+                        + sum(int(member.rsplit(b":", 1)[1]) for member in reserved)
+                    )
+                    if reservation.in_use + tokens > user.tokens_per_minute:
+                        await pipe.unwatch()
+                        return reservation
+
+                    pipe.multi()
+                    pipe.zremrangebyscore(reservations_key, "-inf", now)
+                    pipe.zadd(
+                        reservations_key,
+                        {f"{reservation.id}:{tokens}": now + self.reservation_ttl},
+                    )
+                    pipe.expire(reservations_key, int(self.reservation_ttl) + 1)
+                    await pipe.execute()
+                    reservation.granted = True
+                    return reservation
+                except WatchError:
+                    continue
+
+    async def reconcile(self, reservation: Reservation):
+        if reservation.granted:
+            await self.client.zrem(
+                self._reservations_key(reservation.user_id),
+                f"{reservation.id}:{reservation.tokens}",
+            )
+
+
+def get_quota() -> BaseQuota:
+    if env.quota_backend == "redis":
+        return RedisQuota(
+            Redis.from_url(env.redis_url), reservation_ttl=env.upstream_timeout
+        )
+    return MemoryQuota(reservation_ttl=env.upstream_timeout)
+
+
+quota = get_quota()
@@ -0,0 +1,141 @@
+import logging
+import os
+import time
+from pathlib import Path
+
+from pydantic import TypeAdapter
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from llm_freeway.database import LLM, Deployment
+from llm_freeway.settings import env
+
+logger = logging.getLogger(__name__)
+
+
+class ModelRegistry:
+    """the registered LLMs, held in memory
+
+    Models are loaded from the LLM table and, when `path` is set, from a
+    JSON file whose models, and their `deployments`, are also saved to the
+    LLM and Deployment tables. The file is
+    checked for changes at most every `check_interval` seconds and the
+    models are swapped for a freshly loaded set in one assignment, so
+    looking a model up never waits on a reload or touches the database,
+    unless the model has been added to the LLM table since the last load.
+    A name found in neither is remembered as missing for `missing_ttl`
+    seconds, so repeated requests for a misspelled model don't each query
+    the database.
+    """
+
+    def __init__(
+        self,
+        path: Path | None = None,
+        check_interval: float = 5,
+        missing_ttl: float = 5,
+    ):
+        self.path = path
+        self.check_interval = check_interval
+        self.missing_ttl = missing_ttl
+        self.models: dict[str, LLM] = {}
+        # names not found in the LLM table, and when they were looked up
+        self.missing: dict[str, float] = {}
+        self._deployments: dict[str, list[Deployment]] = {}
+        self.loaded = False
+        self.mtime: float | None = None
+        self.checked_at = float("-inf")
+
+    def _read_file(self) -> list[LLM | Deployment]:
+        rows = []
+        for model in TypeAdapter(list[dict]).validate_json(self.path.read_bytes()):
+            deployments = model.pop("deployments", [])
+            llm = LLM.model_validate(model)
+            rows.append(llm)
+            rows += [
+                Deployment.model_validate(dict(deployment, llm=llm.name))
+                for deployment in deployments
+            ]
+        return rows
+
+    @staticmethod
+    async def _load_deployments(
+        session: AsyncSession, *names: str
+    ) -> dict[str, list[Deployment]]:
+        query = select(Deployment).order_by(Deployment.name)
+        if names:
+            query = query.where(Deployment.llm.in_(names))
+        deployments = {}
+        for deployment in (await session.exec(query)).all():
+            deployment = Deployment.model_validate(deployment.model_dump())
+            deployments.setdefault(deployment.llm, []).append(deployment)
+        return deployments
+
+    async def reload(self, session: AsyncSession) -> list[LLM]:
+        if self.path:
+            self.mtime = os.stat(self.path).st_mtime
+            for row in self._read_file():
+                await session.merge(row)
+            await session.commit()
+
+        result = await session.exec(select(LLM))
+        models = {
+            model.name: LLM.model_validate(model.model_dump()) for model in result.all()
+        }
+        self._deployments = await self._load_deployments(session)
+        self.models = models
+        self.missing = {}
+        self.loaded = True
+        return list(self.models.values())
+
+    async def _check_file(self, session: AsyncSession):
+        now = time.monotonic()
+        if not self.path or now - self.checked_at < self.check_interval:
+            return
+        self.checked_at = now
+        try:
+            if os.stat(self.path).st_mtime != self.mtime:
+                logger.info("reloading models from %s", self.path)
+                await self.reload(session)
+        except (OSError, ValueError):
+            logger.exception("failed to reload models from %s", self.path)
+
+    async def get(self, name: str, session: AsyncSession) -> LLM | None:
+        if not self.loaded:
+            await self.reload(session)
+        await self._check_file(session)
+
+        if model := self.models.get(name):
+            return model
+
+        now = time.monotonic()
+        if now - self.missing.get(name, float("-inf")) < self.missing_ttl:
+            return None
+
+        if model := await session.get(LLM, name):
+            model = LLM.model_validate(model.model_dump())
+            self._deployments = {
+                **self._deployments,
+                **await self._load_deployments(session, name),
+            }
+            self.models = {**self.models, name: model}
+            self.missing.pop(name, None)
+        else:
+            self.missing[name] = now
+        return model
+
+    def deployments(self, name: str) -> list[Deployment]:
+        """the deployments serving a model, none if it is called by name"""
+        return self._deployments.get(name, [])
+
+    def clear(self):
+        self.models = {}
+        self._deployments = {}
+        self.missing = {}
+        self.loaded = False
+        self.mtime = None
+        self.checked_at = float("-inf")
+
+
+model_registry = ModelRegistry(
+    env.models_path, env.models_check_interval, env.models_missing_ttl
+)
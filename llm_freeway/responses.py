@@ -0,0 +1,53 @@
+from collections.abc import Awaitable, Callable
+from typing import Any
+
+import anyio
+import orjson
+from pydantic import BaseModel
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.types import Receive, Scope, Send
+
+
+def _default(value):
+    if isinstance(value, BaseModel):
+        return value.model_dump(warnings=False)
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+class FastJSONResponse(JSONResponse):
+    """JSON rendered by pydantic-core, for models, or orjson, for the rest
+
+    Endpoints that return one of these directly skip FastAPI's validation
+    of the response and its `jsonable_encoder`, which dominate the cost of
+    large responses such as a page of logs or a long completion.
+    """
+
+    def render(self, content: Any) -> bytes:
+        if isinstance(content, BaseModel):
+            # litellm's responses warn about their own union-typed fields
+            return content.__pydantic_serializer__.to_json(content, warnings=False)
+        return orjson.dumps(content, default=_default, option=orjson.OPT_NON_STR_KEYS)
+
+
+class ReleasingStreamingResponse(StreamingResponse):
+    """a stream that awaits `release` once it is over, however it ended
+
+    A generator's own `finally` doesn't run if the client disconnects before
+    its body is started, so anything held for the stream, such as an
+    upstream slot, is released here instead, after the body is closed.
+    """
+
+    def __init__(self, content, release: Callable[[], Awaitable[None]], **kwargs):
+        super().__init__(content, **kwargs)
+        self.release = release
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            with anyio.CancelScope(shield=True):
+                try:
+                    if hasattr(self.body_iterator, "aclose"):
+                        await self.body_iterator.aclose()
+                finally:
+                    await self.release()
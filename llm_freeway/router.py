@@ -0,0 +1,201 @@
+import logging
+import os
+import time
+from collections.abc import Awaitable, Callable
+from dataclasses import dataclass
+from typing import TypeVar
+
+import litellm
+from litellm import CustomStreamWrapper, ModelResponse
+
+from llm_freeway.database import LLM, Deployment
+from llm_freeway.settings import env
+from llm_freeway.upstream import close_stream
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+RETRYABLE_ERRORS = (litellm.APIConnectionError, litellm.Timeout)
+
+
+class NoCapacityError(Exception):
+    """every deployment of the model is busy or cooling down"""
+
+
+def is_retryable(error: Exception) -> bool:
+    status_code = getattr(error, "status_code", None)
+    return (
+        isinstance(error, RETRYABLE_ERRORS)
+        or status_code == 429
+        or (isinstance(status_code, int) and status_code >= 500)
+    )
+
+
+def litellm_kwargs(deployment: Deployment) -> dict:
+    """the deployment's model and parameters, `os.environ/NAME` values are
+    read from the environment"""
+    params = {
+        key: os.environ.get(value.removeprefix("os.environ/"))
+        if isinstance(value, str) and value.startswith("os.environ/")
+        else value
+        for key, value in deployment.litellm_params.items()
+    }
+    return dict(params, model=deployment.model)
+
+
+@dataclass
+class DeploymentStats:
+    latency: float | None = None
+    in_flight: int = 0
+    cooldown_until: float = float("-inf")
+
+
+class Router:
+    """spreads a model's requests across its deployments
+
+    Each request goes to the deployment with the lowest exponentially
+    weighted moving average latency (weighted by `alpha`) that is under its
+    `max_concurrency`, deployments that haven't served a request yet are
+    tried first. A deployment that fails with a 429, a 5xx or a connection
+    error is skipped for `cooldown` seconds and the request fails over to
+    the next best deployment.
+    """
+
+    def __init__(self, alpha: float = 0.3, cooldown: float = 30):
+        self.alpha = alpha
+        self.cooldown = cooldown
+        self.stats: dict[str, DeploymentStats] = {}
+
+    def _stats(self, name: str) -> DeploymentStats:
+        if name not in self.stats:
+            self.stats[name] = DeploymentStats()
+        return self.stats[name]
+
+    def rank(self, deployments: list[Deployment]) -> list[Deployment]:
+        """deployments with spare capacity, best first"""
+        now = time.monotonic()
+        available = []
+        for deployment in deployments:
+            stats = self._stats(deployment.name)
+            if stats.cooldown_until > now:
+                continue
+            if (
+                deployment.max_concurrency is not None
+                and stats.in_flight >= deployment.max_concurrency
+            ):
+                continue
+            available.append(deployment)
+
+        def key(deployment: Deployment):
+            stats = self._stats(deployment.name)
+            return stats.latency or 0, stats.in_flight
+
+        return sorted(available, key=key)
+
+    def _record_latency(self, name: str, latency: float):
+        stats = self._stats(name)
+        if stats.latency is None:
+            stats.latency = latency
+        else:
+            stats.latency = self.alpha * latency + (1 - self.alpha) * stats.latency
+
+    async def _call(
+        self,
+        llm: LLM,
+        deployments: list[Deployment],
+        call: Callable[[dict], Awaitable[T]],
+    ) -> tuple[T, Deployment | None]:
+        """`call` with the best deployment's litellm arguments, leaving the
+        deployment's slot held for the caller to `_release`"""
+        if not deployments:
+            return await call({"model": llm.name}), None
+
+        candidates = self.rank(deployments)
+        if not candidates:
+            raise NoCapacityError(llm.name)
+
+        error = None
+        for deployment in candidates:
+            stats = self._stats(deployment.name)
+            stats.in_flight += 1
+            started_at = time.monotonic()
+            succeeded = False
+            try:
+                result = await call(litellm_kwargs(deployment))
+                succeeded = True
+            except Exception as e:
+                if not is_retryable(e):
+                    raise
+                logger.warning("deployment %s failed, failing over", deployment.name)
+                stats.cooldown_until = time.monotonic() + self.cooldown
+                error = e
+                continue
+            finally:
+                # the slot is only kept, for the caller, on success
+                if not succeeded:
+                    stats.in_flight -= 1
+            self._record_latency(deployment.name, time.monotonic() - started_at)
+            return result, deployment
+        raise error
+
+    def _release(self, deployment: Deployment | None):
+        if deployment is not None:
+            self._stats(deployment.name).in_flight -= 1
+
+    async def complete(
+        self,
+        llm: LLM,
+        deployments: list[Deployment],
+        call: Callable[[dict], Awaitable[ModelResponse]],
+    ) -> ModelResponse:
+        """the response from the best deployment, its name is kept in the
+        response's `_hidden_params["deployment"]`"""
+        response, deployment = await self._call(llm, deployments, call)
+        self._release(deployment)
+        response._hidden_params["deployment"] = deployment and deployment.name
+        return response
+
+    async def stream(
+        self,
+        llm: LLM,
+        deployments: list[Deployment],
+        open_stream: Callable[[dict], Awaitable[CustomStreamWrapper]],
+    ) -> "RoutedStream":
+        """a stream from the best deployment, which counts against the
+        deployment's capacity until it has been read to the end"""
+        stream, deployment = await self._call(llm, deployments, open_stream)
+        return RoutedStream(stream, deployment, self._release)
+
+    def clear(self):
+        self.stats.clear()
+
+
+class RoutedStream:
+    """a stream that frees its deployment's slot once it has been read, or
+    closed early"""
+
+    def __init__(
+        self,
+        stream: CustomStreamWrapper,
+        deployment: Deployment | None,
+        release: Callable[[Deployment | None], None],
+    ):
+        self.stream = stream
+        self.deployment = deployment and deployment.name
+        self._deployment = deployment
+        self._release = release
+
+    async def __aiter__(self):
+        try:
+            async for part in self.stream:
+                yield part
+        finally:
+            self._release(self._deployment)
+            await close_stream(self.stream)
+
+    def __getattr__(self, name: str):
+        return getattr(self.stream, name)
+
+
+router = Router(env.routing_ewma_alpha, env.routing_cooldown)
@@ -1,4 +1,8 @@
+from pathlib import Path
+from typing import Literal
+
 from dotenv import load_dotenv
+from pydantic import Field
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 
@@ -7,6 +11,12 @@ class KeycloakSettings(BaseSettings):
     client_secret_key: str
     realm_name: str
     server_url: str
+    jwks_ttl: float = 300
+    jwks_min_refresh_interval: float = 10
+    jwks_timeout: float = 2
+    token_timeout: float = 5
+    token_retries: int = Field(default=2, ge=0)
+    token_max_connections: int = 20
 
 
 class LocalAuthSettings(BaseSettings):
@@ -17,6 +27,102 @@ class LocalAuthSettings(BaseSettings):
 
 class Settings(BaseSettings):
     database_url: str = "sqlite://"
+    database_pool_size: int = 10
+    database_max_overflow: int = 20
+    database_pool_pre_ping: bool = True
+    database_pool_recycle: int = Field(
+        default=1800, description="seconds before a connection is replaced, -1 never"
+    )
+
+    token_cache_size: int = 10_000
+
+    bcrypt_rounds: int = Field(default=12, ge=4, le=31)
+    password_hash_workers: int | None = Field(
+        default=None, gt=0, description="threads hashing passwords, default per cpu"
+    )
+
+    models_path: Path | None = None
+    models_check_interval: float = 5
+    models_missing_ttl: float = Field(
+        default=5, ge=0, description="seconds an unknown model name is remembered"
+    )
+
+    response_cache_max_bytes: int = 64 * 1024 * 1024
+    response_cache_ttl: float = 300
+
+    coalesce_requests: bool = True
+
+    sse_coalesce_interval: float = Field(
+        default=0, ge=0, description="seconds to gather stream chunks into one write"
+    )
+    sse_coalesce_bytes: int = Field(default=16 * 1024, gt=0)
+
+    max_concurrency: int | None = Field(
+        default=None, gt=0, description="upstream calls in flight at once, in total"
+    )
+    model_max_concurrency: int | None = Field(
+        default=None, gt=0, description="upstream calls in flight at once, per model"
+    )
+    admission_queue_size: int = Field(default=100, ge=0)
+    admission_queue_timeout: float = Field(default=10, ge=0)
+
+    routing_ewma_alpha: float = Field(default=0.3, gt=0, le=1)
+    routing_cooldown: float = 30
+
+    upstream_max_connections: int = 100
+    upstream_max_keepalive_connections: int = 20
+    upstream_keepalive_expiry: float = 60
+    upstream_http2: bool = True
+    upstream_timeout: float = 600
+
+    quota_backend: Literal["memory", "redis"] = "memory"
+    estimated_completion_tokens: int = Field(
+        default=256,
+        ge=0,
+        description="tokens reserved for a completion, when max_tokens isn't set",
+    )
+    redis_url: str = "redis://localhost:6379/0"
+
+    log_write_behind: bool = True
+    log_batch_size: int = 500
+    log_flush_interval: float = 1.0
+    log_queue_size: int = 10_000
+    log_queue_full: Literal["block", "drop"] = "block"
+    log_retry_delay: float = Field(
+        default=0.5, gt=0, description="seconds before a failed batch is retried"
+    )
+    log_retry_max_delay: float = Field(default=30, gt=0)
+    log_stop_attempts: int = Field(
+        default=3, ge=1, description="tries at a failing batch when shutting down"
+    )
+
+    export_batch_size: int = Field(default=1_000, gt=0)
+
+    batch_concurrency: int = Field(
+        default=8, gt=0, description="/batch lines in flight at once, by default"
+    )
+    batch_max_concurrency: int = Field(default=64, gt=0)
+    batch_spool_bytes: int = Field(
+        default=1024 * 1024,
+        ge=0,
+        description="bytes of a /batch upload held in memory, the rest is on disk",
+    )
+    batch_checkpoint_lines: int = Field(
+        default=100, gt=0, description="completed /batch lines between checkpoints"
+    )
+    batch_retry_timeout: float = Field(
+        default=300,
+        ge=0,
+        description="seconds a /batch line is retried for, after a 429 or 503",
+    )
+
+    summary_cache_size: int = 1_000
+    summary_cache_grace: float = 60
+
+    event_log_partitioned: bool = False
+    event_log_partitions_ahead: int = Field(default=2, ge=1)
+    event_log_retention_months: int | None = Field(default=None, ge=1)
+    event_log_retention: Literal["drop", "detach"] = "drop"
 
     auth: KeycloakSettings | LocalAuthSettings
 
@@ -0,0 +1,75 @@
+import asyncio
+import contextlib
+from collections.abc import AsyncGenerator, AsyncIterator
+
+from pydantic import BaseModel
+
+# proxies (i.e. nginx) must pass each event on as soon as it arrives
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+DONE = b"data: [DONE]\n\n"
+
+
+def encode_event(part: BaseModel) -> bytes:
+    """a server-sent event carrying `part`
+
+    The part is serialised by pydantic-core straight to bytes, skipping the
+    str round trip of `model_dump_json` and the response re-encoding it.
+    """
+    return b"data: " + part.__pydantic_serializer__.to_json(part) + b"\n\n"
+
+
+async def coalesce(
+    events: AsyncGenerator[bytes], interval: float, max_bytes: int
+) -> AsyncIterator[bytes]:
+    """join events arriving within `interval` seconds of the first, up to
+    `max_bytes`, into one write
+
+    Events are read into a buffer by a background task, which waits for the
+    buffer to be written whenever it holds `max_bytes`.
+    """
+    buffer = bytearray()
+    has_data = asyncio.Event()
+    flush = asyncio.Event()
+    drained = asyncio.Event()
+    finished = False
+
+    async def pump():
+        nonlocal finished
+        try:
+            async for event in events:
+                buffer.extend(event)
+                has_data.set()
+                if len(buffer) >= max_bytes:
+                    drained.clear()
+                    flush.set()
+                    await drained.wait()
+        finally:
+            finished = True
+            has_data.set()
+            flush.set()
+
+    task = asyncio.create_task(pump())
+    try:
+        while True:
+            await has_data.wait()
+            if not flush.is_set():
+                with contextlib.suppress(TimeoutError):
+                    await asyncio.wait_for(flush.wait(), interval)
+            data = bytes(buffer)
+            buffer.clear()
+            has_data.clear()
+            flush.clear()
+            drained.set()
+            if data:
+                yield data
+            if finished and not buffer:
+                break
+        # raise anything the events raised
+        await task
+    finally:
+        if not task.done():
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+        # the pump may have stopped between events, or before the first
+        await events.aclose()
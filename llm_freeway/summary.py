@@ -0,0 +1,115 @@
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Literal
+from uuid import UUID
+
+from pydantic import BaseModel
+from sqlalchemy import Select, func
+from sqlmodel import select
+
+from llm_freeway.database import EventLog
+from llm_freeway.settings import env
+
+Bucket = Literal["hour", "day", "month"]
+
+SQLITE_FORMATS = {
+    "hour": "%Y-%m-%d %H:00:00",
+    "day": "%Y-%m-%d 00:00:00",
+    "month": "%Y-%m-01 00:00:00",
+}
+
+
+class SpendSummary(BaseModel):
+    user_id: UUID
+    model: str
+    bucket: datetime
+    requests: int
+    prompt_tokens: int
+    completion_tokens: int
+    cost_usd: float
+
+
+def truncate(timestamp: datetime, bucket: Bucket) -> datetime:
+    """the start of the bucket holding `timestamp`"""
+    timestamp = timestamp.replace(minute=0, second=0, microsecond=0)
+    if bucket in ("day", "month"):
+        timestamp = timestamp.replace(hour=0)
+    if bucket == "month":
+        timestamp = timestamp.replace(day=1)
+    return timestamp
+
+
+def local_time(timestamp: datetime | None) -> datetime | None:
+    """`timestamp` as the naive local time that EventLogs are stamped with"""
+    if timestamp is None or timestamp.tzinfo is None:
+        return timestamp
+    return timestamp.astimezone().replace(tzinfo=None)
+
+
+def summary_query(dialect: str, bucket: Bucket) -> Select:
+    """EventLogs summed per user, model and bucket"""
+    if dialect == "postgresql":
+        start = func.date_trunc(bucket, EventLog.timestamp)
+    else:
+        start = func.strftime(SQLITE_FORMATS[bucket], EventLog.timestamp)
+    start = start.label("bucket")
+    return (
+        select(
+            EventLog.user_id,
+            EventLog.model,
+            start,
+            func.count(EventLog.id).label("requests"),
+            func.sum(EventLog.prompt_tokens).label("prompt_tokens"),
+            func.sum(EventLog.completion_tokens).label("completion_tokens"),
+            func.coalesce(func.sum(EventLog.cost_usd), 0).label("cost_usd"),
+        )
+        .group_by(EventLog.user_id, EventLog.model, start)
+        .order_by(start, EventLog.user_id, EventLog.model)
+    )
+
+
+class SummaryCache:
+    """summaries of closed buckets, which no new logs can change
+
+    Each entry holds the summary rows of every bucket that ended before
+    `closed_until`, so a repeated query only has to aggregate the logs
+    written since. Buckets are considered closed `grace` seconds after
+    they end, to allow for logs still waiting to be written. The least
+    recently used entries are evicted beyond `max_size`.
+    """
+
+    def __init__(self, max_size: int, grace: float):
+        self.max_size = max_size
+        self.grace = grace
+        self.entries: OrderedDict[tuple, tuple[datetime, list[SpendSummary]]] = (
+            OrderedDict()
+        )
+        self.lock = threading.Lock()
+
+    def closed_until(self, bucket: Bucket, now: datetime | None = None) -> datetime:
+        now = now or datetime.now()
+        return truncate(now - timedelta(seconds=self.grace), bucket)
+
+    def get(self, key: tuple) -> tuple[datetime | None, list[SpendSummary]]:
+        with self.lock:
+            if key not in self.entries:
+                return None, []
+            self.entries.move_to_end(key)
+            return self.entries[key]
+
+    def set(self, key: tuple, closed_until: datetime, items: list[SpendSummary]):
+        if self.max_size <= 0:
+            return
+        with self.lock:
+            self.entries[key] = closed_until, items
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+summary_cache = SummaryCache(env.summary_cache_size, env.summary_cache_grace)
@@ -0,0 +1,45 @@
+import asyncio
+from functools import partial
+
+from litellm import token_counter
+
+from llm_freeway.settings import env
+
+
+class TokenEstimator:
+    """estimates a request's tokens before it is sent upstream
+
+    Prompt tokens are counted with litellm's tokenizer for the model. The
+    first count for a model runs in a thread, as loading its tokenizer may
+    mean downloading it from huggingface, as do counts over `offload_chars`
+    characters of content, so long prompts don't hold up the event loop.
+    The completion is assumed to use the request's `max_tokens` or, failing
+    that, `completion_tokens`.
+    """
+
+    def __init__(self, completion_tokens: int = 256, offload_chars: int = 20_000):
+        self.completion_tokens = completion_tokens
+        self.offload_chars = offload_chars
+        # models whose tokenizer litellm has loaded, and cached
+        self.loaded: set[str] = set()
+
+    async def count(self, model: str, messages: list[dict]) -> int:
+        count = partial(token_counter, model=model, messages=messages)
+        chars = sum(len(message.get("content") or "") for message in messages)
+        if model not in self.loaded or chars > self.offload_chars:
+            tokens = await asyncio.to_thread(count)
+            self.loaded.add(model)
+            return tokens
+        return count()
+
+    async def estimate(
+        self, model: str, messages: list[dict], max_tokens: int | None = None
+    ) -> int:
+        prompt_tokens = await self.count(model, messages)
+        return prompt_tokens + (max_tokens or self.completion_tokens)
+
+    def clear(self):
+        self.loaded.clear()
+
+
+token_estimator = TokenEstimator(env.estimated_completion_tokens)
@@ -0,0 +1,123 @@
+import inspect
+
+import httpx
+import litellm
+from litellm.llms.custom_httpx.http_handler import AsyncHTTPHandler
+
+from llm_freeway.metrics import metrics
+from llm_freeway.settings import env
+
+# providers litellm calls through its own httpx handler, which accepts a client
+HTTPX_PROVIDERS = {"anthropic", "bedrock", "gemini", "vertex_ai", "vertex_ai_beta"}
+
+# providers litellm calls through the openai sdk, which share one client
+OPENAI_PROVIDER = "openai"
+
+metrics.register(
+    "upstream_requests_total", "counter", "requests sent to each upstream provider"
+)
+metrics.register(
+    "upstream_connections_total",
+    "counter",
+    "connections opened to each upstream provider, the remaining requests "
+    "reused a kept-alive connection",
+)
+
+
+class UpstreamClients:
+    """one long-lived, pooled http client per upstream provider
+
+    Clients keep connections alive between requests and negotiate HTTP/2
+    where the provider offers it, so steady-state requests skip the TCP and
+    TLS handshakes. Requests and newly opened connections are counted per
+    provider in the `upstream_requests_total` and
+    `upstream_connections_total` metrics.
+    """
+
+    def __init__(
+        self,
+        max_connections: int = 100,
+        max_keepalive_connections: int = 20,
+        keepalive_expiry: float = 60,
+        http2: bool = True,
+        timeout: float = 600,
+    ):
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self.http2 = http2
+        self.timeout = httpx.Timeout(timeout, connect=5)
+        self.clients: dict[str, httpx.AsyncClient] = {}
+        self.handlers: dict[str, AsyncHTTPHandler] = {}
+
+    def _create_client(self, provider: str) -> httpx.AsyncClient:
+        async def trace(event: str, info: dict):
+            if event == "connection.connect_tcp.complete":
+                metrics.inc("upstream_connections_total", provider=provider)
+
+        async def on_request(request: httpx.Request):
+            metrics.inc("upstream_requests_total", provider=provider)
+            request.extensions["trace"] = trace
+
+        return httpx.AsyncClient(
+            http2=self.http2,
+            limits=self.limits,
+            timeout=self.timeout,
+            event_hooks={"request": [on_request]},
+        )
+
+    def get(self, provider: str) -> httpx.AsyncClient:
+        if provider not in self.clients:
+            self.clients[provider] = self._create_client(provider)
+        return self.clients[provider]
+
+    def completion_kwargs(self, model: str) -> dict:
+        """arguments passing the provider's client on to litellm"""
+        try:
+            _, provider, _, _ = litellm.get_llm_provider(model)
+        except litellm.BadRequestError:
+            return {}
+        if provider not in HTTPX_PROVIDERS:
+            return {}
+        if provider not in self.handlers:
+            handler = AsyncHTTPHandler(timeout=self.timeout)
+            handler.client = self.get(provider)
+            self.handlers[provider] = handler
+        return {"client": self.handlers[provider]}
+
+    async def start(self):
+        litellm.aclient_session = self.get(OPENAI_PROVIDER)
+
+    async def stop(self):
+        if litellm.aclient_session is self.clients.get(OPENAI_PROVIDER):
+            litellm.aclient_session = None
+        for client in self.clients.values():
+            await client.aclose()
+        self.clients.clear()
+        self.handlers.clear()
+
+
+async def close_stream(stream):
+    """stop reading `stream`, closing its upstream response where it can be
+
+    litellm's stream wrapper has no close of its own, so the response it
+    wraps, its `completion_stream`, is closed instead.
+    """
+    for target in (stream, getattr(stream, "completion_stream", None)):
+        close = getattr(target, "aclose", None) or getattr(target, "close", None)
+        if callable(close):
+            result = close()
+            if inspect.isawaitable(result):
+                await result
+            return
+
+
+upstream_clients = UpstreamClients(
+    max_connections=env.upstream_max_connections,
+    max_keepalive_connections=env.upstream_max_keepalive_connections,
+    keepalive_expiry=env.upstream_keepalive_expiry,
+    http2=env.upstream_http2,
+    timeout=env.upstream_timeout,
+)
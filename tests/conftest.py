@@ -3,22 +3,32 @@ from uuid import UUID, uuid4
 
 import pytest
 from keycloak import KeycloakAdmin, KeycloakOpenID, KeycloakOpenIDConnection
-from sqlalchemy import StaticPool, create_engine
+from sqlalchemy import NullPool, create_engine
+from sqlalchemy.ext.asyncio import create_async_engine
 from sqlmodel import Session, SQLModel
+from sqlmodel.ext.asyncio.session import AsyncSession
 from starlette.testclient import TestClient
 
+from llm_freeway.admission import admission_control
 from llm_freeway.api import app
-from llm_freeway.auth import get_token
+from llm_freeway.auth import get_token, token_cache
+from llm_freeway.cache import response_cache
 from llm_freeway.database import (
     LLM,
     EventLog,
     KeycloakUser,
     SQLUser,
     User,
+    async_database_url,
     get_session,
-    pwd_context,
 )
+from llm_freeway.metrics import metrics
+from llm_freeway.passwords import password_hasher
+from llm_freeway.quota import quota
+from llm_freeway.registry import model_registry
+from llm_freeway.router import router
 from llm_freeway.settings import KeycloakSettings, env
+from llm_freeway.summary import summary_cache
 
 
 class BaseUserManager:
@@ -56,6 +66,7 @@ class KeyCloakUserManger(BaseUserManager):
                     "requests_per_minute": kwargs.get("requests_per_minute", 60),
                     "tokens_per_minute": kwargs.get("tokens_per_minute", 100_000),
                     "cost_usd_per_month": kwargs.get("cost_usd_per_month", 10),
+                    "weight": kwargs.get("weight", 1),
                 },
             },
             exist_ok=True,
@@ -68,6 +79,7 @@ class KeyCloakUserManger(BaseUserManager):
             requests_per_minute=kwargs.get("requests_per_minute", 60),
             tokens_per_minute=kwargs.get("tokens_per_minute", 100_000),
             cost_usd_per_month=kwargs.get("cost_usd_per_month", 10),
+            weight=kwargs.get("weight", 1),
         )
         return user
 
@@ -90,7 +102,8 @@ class SQLUserManger(BaseUserManager):
             requests_per_minute=kwargs.get("requests_per_minute", 60),
             tokens_per_minute=kwargs.get("tokens_per_minute", 100_000),
             cost_usd_per_month=kwargs.get("cost_usd_per_month", 10),
-            hashed_password=pwd_context.hash(kwargs["password"]),
+            weight=kwargs.get("weight", 1),
+            hashed_password=password_hasher.context.hash(kwargs["password"]),
         )
 
         self.session.add(user)
@@ -171,36 +184,76 @@ def user_manager(session) -> BaseUserManager:
     admin.teardown()
 
 
+@pytest.fixture(autouse=True)
+def reset_caches():
+    quota.clear()
+    token_cache.clear()
+    model_registry.clear()
+    response_cache.clear()
+    summary_cache.clear()
+    metrics.clear()
+    router.clear()
+    admission_control.clear()
+    yield
+    quota.clear()
+    token_cache.clear()
+    model_registry.clear()
+    response_cache.clear()
+    summary_cache.clear()
+    metrics.clear()
+    router.clear()
+    admission_control.clear()
+
+
+@pytest.fixture
+def anyio_backend():
+    # litellm's async client is built on asyncio, so trio can't drive it
+    return "asyncio"
+
+
 @pytest.fixture
 def real_name():
     return "my-test-realm"
 
 
+@pytest.fixture
+def database_url(tmp_path):
+    # a file, so that the sync and async engines see the same database
+    return f"sqlite:///{tmp_path / 'test.db'}"
+
+
 @pytest.fixture(name="session")
-def session():
-    engine = create_engine(
-        "sqlite://",
-        poolclass=StaticPool,
-        connect_args={"check_same_thread": False},
-    )
+def session(database_url):
+    engine = create_engine(database_url)
     SQLModel.metadata.create_all(engine)
     with Session(engine) as session:
         yield session
+    engine.dispose()
+
+
+@pytest.fixture
+def async_engine(database_url, session):
+    # TestClient runs each request on a new event loop, don't pool connections
+    return create_async_engine(async_database_url(database_url), poolclass=NullPool)
+
+
+@pytest.fixture
+async def async_session(async_engine):
+    async with AsyncSession(async_engine, expire_on_commit=False) as session:
+        yield session
 
 
 @pytest.fixture
-def get_session_override(session):
-    def f():
-        return session
+def get_session_override(async_engine):
+    async def f():
+        async with AsyncSession(async_engine, expire_on_commit=False) as session:
+            yield session
 
     return f
 
 
 @pytest.fixture()
-def client(session: Session):
-    def get_session_override():
-        return session
-
+def client(get_session_override):
     app.dependency_overrides[get_session] = get_session_override
 
     client = TestClient(app)
@@ -367,6 +420,18 @@ def gpt_4o_mini(session):
     session.commit()
 
 
+def get_access_token(user: User) -> str:
+    if isinstance(user, KeycloakUser):
+        keycloak_openid = KeycloakOpenID(
+            server_url=env.auth.server_url,
+            client_id=env.auth.client_id,
+            realm_name=env.auth.realm_name,
+            client_secret_key=env.auth.client_secret_key,
+        )
+        return keycloak_openid.token(user.username, user.password)["access_token"]
+    return get_token(user)
+
+
 def get_headers(user: User) -> dict[str, str]:
-    token = get_token(user)
+    token = get_access_token(user)
     return {"Authorization": f"Bearer {token}"}
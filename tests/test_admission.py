@@ -0,0 +1,184 @@
+import asyncio
+
+import httpx
+import pytest
+
+from llm_freeway.admission import AdmissionControl, AdmissionError, admission_control
+from llm_freeway.metrics import metrics
+from tests.conftest import get_headers
+
+
+@pytest.mark.anyio
+async def test_admission_model_limit():
+    control = AdmissionControl(model_max_concurrency=1, queue_timeout=1)
+    await control.acquire("gpt-4o")
+    await control.acquire("gpt-4o-mini")
+
+    waiter = asyncio.create_task(control.acquire("gpt-4o"))
+    await asyncio.sleep(0)
+    assert not waiter.done()
+    assert metrics.get("admission_queue_depth", model="gpt-4o") == 1
+
+    control.release("gpt-4o")
+    await waiter
+    assert control.in_flight == {"gpt-4o": 1, "gpt-4o-mini": 1}
+    assert metrics.get("admission_queue_depth", model="gpt-4o") == 0
+    assert metrics.get("admission_admitted_total", model="gpt-4o") == 2
+    assert metrics.get("admission_wait_seconds_total", model="gpt-4o") > 0
+
+
+@pytest.mark.anyio
+async def test_admission_global_limit():
+    control = AdmissionControl(max_concurrency=2, queue_timeout=1)
+    await control.acquire("gpt-4o")
+    await control.acquire("gpt-4o-mini", limit=5)
+
+    waiters = [
+        asyncio.create_task(control.acquire(model))
+        for model in ["gpt-4o", "gpt-4o-mini"]
+    ]
+    await asyncio.sleep(0)
+    control.release("gpt-4o")
+    # the oldest waiter goes first
+    assert control.in_flight == {"gpt-4o": 1, "gpt-4o-mini": 1}
+    assert [waiter.model for waiter in control.waiters] == ["gpt-4o-mini"]
+
+    control.release("gpt-4o-mini")
+    await asyncio.gather(*waiters)
+    assert control.total == 2
+
+
+@pytest.mark.anyio
+async def test_admission_queue_full():
+    control = AdmissionControl(model_max_concurrency=1, queue_size=1)
+    await control.acquire("gpt-4o")
+    waiter = asyncio.create_task(control.acquire("gpt-4o"))
+    await asyncio.sleep(0)
+
+    with pytest.raises(AdmissionError):
+        await control.acquire("gpt-4o")
+    assert (
+        metrics.get("admission_rejected_total", model="gpt-4o", reason="queue full")
+        == 1
+    )
+    waiter.cancel()
+
+
+@pytest.mark.anyio
+async def test_admission_queue_timeout():
+    control = AdmissionControl(model_max_concurrency=1, queue_timeout=0.01)
+    await control.acquire("gpt-4o")
+
+    with pytest.raises(AdmissionError) as e:
+        await control.acquire("gpt-4o")
+    assert e.value.retry_after == 1
+    assert not control.waiters
+    assert (
+        metrics.get("admission_rejected_total", model="gpt-4o", reason="queue timeout")
+        == 1
+    )
+
+
+@pytest.mark.anyio
+async def test_admission_cancelled_waiter():
+    control = AdmissionControl(model_max_concurrency=1, queue_timeout=1)
+    await control.acquire("gpt-4o")
+    waiter = asyncio.create_task(control.acquire("gpt-4o"))
+    await asyncio.sleep(0)
+    waiter.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await waiter
+
+    control.release("gpt-4o")
+    assert control.in_flight == {"gpt-4o": 0}
+    assert not control.waiters
+
+
+async def queue(control: AdmissionControl, *requests: tuple[str, float]):
+    tasks = [
+        asyncio.create_task(control.acquire("gpt-4o", user=user, weight=weight))
+        for user, weight in requests
+    ]
+    await asyncio.sleep(0)
+    return tasks
+
+
+def admission_order(control: AdmissionControl) -> list[str]:
+    """release slots one at a time, recording whose request takes each"""
+    order = []
+    while control.waiters:
+        waiting = list(control.waiters)
+        control.release("gpt-4o")
+        order += [waiter.user for waiter in waiting if waiter not in control.waiters]
+    return order
+
+
+@pytest.mark.anyio
+async def test_admission_fair_between_users():
+    control = AdmissionControl(model_max_concurrency=1, queue_timeout=1)
+    await control.acquire("gpt-4o")
+    tasks = await queue(control, *[("batch", 1)] * 4)
+    tasks += await queue(control, ("interactive", 1), ("interactive", 1))
+
+    assert admission_order(control) == [
+        "batch",
+        "interactive",
+        "batch",
+        "interactive",
+        "batch",
+        "batch",
+    ]
+    await asyncio.gather(*tasks)
+
+
+@pytest.mark.anyio
+async def test_admission_weighted():
+    control = AdmissionControl(model_max_concurrency=1, queue_timeout=1)
+    await control.acquire("gpt-4o")
+    tasks = await queue(control, *[("heavy", 2)] * 6, *[("light", 1)] * 3)
+
+    # twice the weight, twice the share
+    assert admission_order(control) == ["heavy", "heavy", "light"] * 3
+    await asyncio.gather(*tasks)
+
+
+@pytest.mark.anyio
+async def test_admission_queue_full_drops_heaviest_user():
+    control = AdmissionControl(model_max_concurrency=1, queue_size=2, queue_timeout=1)
+    await control.acquire("gpt-4o")
+    batch = await queue(control, ("batch", 1), ("batch", 1))
+    interactive = await queue(control, ("interactive", 1))
+
+    with pytest.raises(AdmissionError):
+        await batch[1]
+    assert [waiter.user for waiter in control.waiters] == ["batch", "interactive"]
+
+    # an equal share doesn't push anyone out
+    with pytest.raises(AdmissionError):
+        await control.acquire("gpt-4o", user="interactive")
+
+    admission_order(control)
+    await asyncio.gather(batch[0], *interactive)
+
+
+@pytest.mark.parametrize("stream", [True, False])
+def test_chat_completions_at_capacity(
+    client, payload, normal_user, gpt_4o, monkeypatch, stream
+):
+    monkeypatch.setattr(admission_control, "model_max_concurrency", 1)
+    monkeypatch.setattr(admission_control, "queue_size", 0)
+    headers = get_headers(normal_user)
+
+    admission_control.in_flight["gpt-4o"] = admission_control.total = 1
+    response = client.post(
+        "/chat/completions", json=dict(payload, stream=stream), headers=headers
+    )
+    assert response.status_code == httpx.codes.SERVICE_UNAVAILABLE
+    assert response.headers["Retry-After"] == "10"
+
+    admission_control.in_flight["gpt-4o"] = admission_control.total = 0
+    response = client.post(
+        "/chat/completions", json=dict(payload, stream=stream), headers=headers
+    )
+    assert response.status_code == httpx.codes.OK
+    assert admission_control.in_flight["gpt-4o"] == 0
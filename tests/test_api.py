@@ -1,3 +1,4 @@
+import base64
 import json
 from uuid import UUID
 
@@ -214,6 +215,110 @@ def test_get_users_not_admin(client, admin_user, normal_user):
     assert len(users) == 2
 
 
+def test_spend_logs_cursor(client, user_with_spend):
+    ids, cursor = [], None
+    while True:
+        response = client.get(
+            "/spend/logs",
+            params=dict(size=50, **({"cursor": cursor} if cursor else {})),
+            headers=get_headers(user_with_spend),
+        )
+        assert response.status_code == httpx.codes.OK
+        ids += [item["id"] for item in response.json()["items"]]
+        if not (cursor := response.json()["next_cursor"]):
+            break
+
+    assert len(ids) == len(set(ids)) == 120
+
+    paged = client.get(
+        "/spend/logs",
+        params=dict(page=2, size=50),
+        headers=get_headers(user_with_spend),
+    ).json()
+    assert [item["id"] for item in paged["items"]] == ids[50:100]
+
+
+@pytest.mark.parametrize(
+    "path, cursor",
+    [
+        ("/spend/logs", "not-a-cursor"),
+        ("/spend/logs", base64.urlsafe_b64encode(b'["2024-01-01", 5]').decode()),
+        ("/users", base64.urlsafe_b64encode(b"[5]").decode()),
+        ("/users", base64.urlsafe_b64encode(b"{}").decode()),
+    ],
+)
+def test_spend_logs_invalid_cursor(client, admin_user, path, cursor):
+    response = client.get(
+        path,
+        params=dict(cursor=cursor),
+        headers=get_headers(admin_user),
+    )
+
+    assert response.status_code == httpx.codes.BAD_REQUEST
+    assert response.json() == {"detail": "invalid cursor"}
+
+
+def test_export_spend_logs_ndjson(client, user_with_spend, admin_user):
+    response = client.get("/spend/logs/export", headers=get_headers(user_with_spend))
+
+    assert response.status_code == httpx.codes.OK
+    assert response.headers["content-type"] == "application/x-ndjson"
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    assert len(rows) == 120
+    assert {row["user_id"] for row in rows} == {str(user_with_spend.id)}
+    assert [row["timestamp"] for row in rows] == sorted(
+        row["timestamp"] for row in rows
+    )
+    assert rows[0]["prompt_tokens"] == 200
+
+
+def test_export_spend_logs_csv(client, user_with_spend):
+    response = client.get(
+        "/spend/logs/export",
+        params=dict(format="csv", response_id="1"),
+        headers=get_headers(user_with_spend),
+    )
+
+    assert response.status_code == httpx.codes.OK
+    assert response.headers["content-type"].startswith("text/csv")
+    lines = response.text.splitlines()
+    assert lines[0].split(",")[:3] == ["id", "timestamp", "response_id"]
+    assert len(lines) == 121
+
+
+def test_export_spend_logs_admin(client, user_with_spend, admin_user):
+    response = client.get(
+        "/spend/logs/export",
+        params=dict(format="csv"),
+        headers=get_headers(admin_user),
+    )
+    assert len(response.text.splitlines()) == 121
+
+    response = client.get(
+        "/spend/logs/export",
+        params=dict(format="csv", user_id=str(admin_user.id)),
+        headers=get_headers(admin_user),
+    )
+    assert response.text.splitlines() == [response.text.splitlines()[0]]
+
+
+@skip_keycloak
+def test_get_users_cursor(client, admin_user, normal_user):
+    first = client.get(
+        "/users", params=dict(size=1), headers=get_headers(admin_user)
+    ).json()
+    assert first["next_cursor"]
+
+    second = client.get(
+        "/users",
+        params=dict(size=1, cursor=first["next_cursor"]),
+        headers=get_headers(admin_user),
+    ).json()
+
+    ids = {first["items"][0]["id"], second["items"][0]["id"]}
+    assert ids == {str(admin_user.id), str(normal_user.id)}
+
+
 @skip_keycloak
 def test_create_user(client, admin_user):
     payload = {"username": "some-one", "password": "password", "is_admin": False}
@@ -291,6 +396,21 @@ def test_delete_user(client, admin_user, normal_user):
     assert response.status_code == httpx.codes.OK
 
 
+@skip_keycloak
+def test_delete_user_revokes_cached_token(client, admin_user, normal_user):
+    normal_user_headers = get_headers(normal_user)
+    response = client.get("/users", headers=normal_user_headers)
+    assert response.status_code == httpx.codes.OK
+
+    response = client.delete(
+        f"/users/{normal_user.id}", headers=get_headers(admin_user)
+    )
+    assert response.status_code == httpx.codes.OK
+
+    response = client.get("/users", headers=normal_user_headers)
+    assert response.status_code == httpx.codes.UNAUTHORIZED
+
+
 @skip_keycloak
 def test_delete_user_not_admin(client, normal_user):
     response = client.delete(
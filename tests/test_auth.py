@@ -1,33 +1,303 @@
+import asyncio
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from uuid import uuid4
 
 import httpx
+import jwt
 import pytest
+from cryptography.hazmat.primitives.asymmetric import rsa
 from fastapi import HTTPException
+from jwt import InvalidTokenError
+from jwt.algorithms import RSAAlgorithm
 
-from llm_freeway.auth import get_current_user, get_token
+from llm_freeway import auth
+from llm_freeway.auth import (
+    JWKSCache,
+    KeycloakTokenClient,
+    TokenCache,
+    get_current_user,
+    get_token,
+)
+from llm_freeway.auth import _get_current_user as get_current_user_uncached
 from llm_freeway.database import User
+from tests.conftest import get_access_token
 from tests.test_api import skip_keycloak
 
 
 @pytest.mark.anyio
-async def test_get_current_user(normal_user: User, session):
-    actual_user = await get_current_user(get_token(normal_user), session)
+async def test_get_current_user(normal_user: User, async_session):
+    actual_user = await get_current_user(get_access_token(normal_user), async_session)
     assert User(**actual_user.model_dump()) == User(**normal_user.model_dump())
 
 
 @pytest.mark.anyio
-async def test_get_current_user_corrupt_token(normal_user: User, session):
+async def test_get_current_user_corrupt_token(normal_user: User, async_session):
     with pytest.raises(HTTPException) as e:
-        await get_current_user(get_token(normal_user) + "!", session)
+        await get_current_user(get_access_token(normal_user) + "!", async_session)
     assert e.value.status_code == httpx.codes.UNAUTHORIZED
     assert e.value.detail == "Could not validate credentials"
 
 
 @skip_keycloak
 @pytest.mark.anyio
-async def test_get_current_user_does_not_exist(session):
+async def test_get_current_user_does_not_exist(async_session):
     new_user = User(username="new.person@example.com", id=uuid4())
     with pytest.raises(HTTPException) as e:
-        await get_current_user(get_token(new_user), session)
+        await get_current_user(get_token(new_user), async_session)
     assert e.value.status_code == httpx.codes.UNAUTHORIZED
     assert e.value.detail == "Could not validate credentials"
+
+
+class JWKSHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.server.requests += 1
+        if self.server.fail:
+            self.send_response(503)
+            self.end_headers()
+            return
+        body = json.dumps({"keys": self.server.keys}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def jwks_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), JWKSHandler)
+    server.keys = []
+    server.requests = 0
+    server.fail = False
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+
+
+@pytest.fixture
+def jwks_url(jwks_server):
+    yield f"http://127.0.0.1:{jwks_server.server_port}/certs"
+
+
+def add_signing_key(jwks_server, kid: str):
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    jwk = json.loads(RSAAlgorithm.to_jwk(private_key.public_key()))
+    jwks_server.keys.append(dict(jwk, kid=kid, use="sig", alg="RS256"))
+    return private_key
+
+
+def sign(private_key, kid: str) -> str:
+    return jwt.encode(
+        {"sub": "me"}, private_key, algorithm="RS256", headers={"kid": kid}
+    )
+
+
+@pytest.mark.anyio
+async def test_jwks_cache(jwks_server, jwks_url):
+    private_key = add_signing_key(jwks_server, "1")
+    cache = JWKSCache(jwks_url)
+
+    for _ in range(3):
+        token = sign(private_key, "1")
+        signing_key = await cache.get_signing_key_from_jwt(token)
+        assert jwt.decode(token, signing_key.key, algorithms=["RS256"])["sub"] == "me"
+
+    assert jwks_server.requests == 1
+
+
+@pytest.mark.anyio
+async def test_jwks_cache_first_fetch_shared(jwks_server, jwks_url):
+    add_signing_key(jwks_server, "1")
+    cache = JWKSCache(jwks_url)
+
+    keys = await asyncio.gather(*(cache.get_signing_key("1") for _ in range(5)))
+    assert {key.key_id for key in keys} == {"1"}
+    assert jwks_server.requests == 1
+
+
+@pytest.mark.anyio
+async def test_jwks_cache_rotation(jwks_server, jwks_url):
+    add_signing_key(jwks_server, "1")
+    cache = JWKSCache(jwks_url, min_refresh_interval=0)
+    await cache.get_signing_key("1")
+
+    private_key = add_signing_key(jwks_server, "2")
+    key = await cache.get_signing_key_from_jwt(sign(private_key, "2"))
+    assert key.key_id == "2"
+    assert jwks_server.requests == 2
+
+
+@pytest.mark.anyio
+async def test_jwks_cache_unknown_kid_rate_limited(jwks_server, jwks_url):
+    add_signing_key(jwks_server, "1")
+    cache = JWKSCache(jwks_url, min_refresh_interval=60)
+
+    for _ in range(3):
+        with pytest.raises(InvalidTokenError):
+            await cache.get_signing_key("unknown")
+
+    assert jwks_server.requests == 1
+
+
+@pytest.mark.anyio
+async def test_jwks_cache_stale_while_revalidate(jwks_server, jwks_url):
+    add_signing_key(jwks_server, "1")
+    cache = JWKSCache(jwks_url, ttl=0)
+    await cache.get_signing_key("1")
+
+    jwks_server.fail = True
+    assert (await cache.get_signing_key("1")).key_id == "1"
+    await cache.refreshing
+    assert jwks_server.requests == 2
+
+    jwks_server.fail = False
+    jwks_server.keys = []
+    add_signing_key(jwks_server, "2")
+    assert (await cache.get_signing_key("1")).key_id == "1"
+    await cache.refreshing
+    assert set(cache.keys) == {"2"}
+
+
+def test_token_cache():
+    cache = TokenCache(max_size=2)
+    users = [User(username=f"user-{i}") for i in range(3)]
+    expires_at = time.time() + 60
+
+    cache.set("a", users[0], expires_at)
+    cache.set("b", users[1], expires_at)
+    assert cache.get("a") == users[0]
+
+    # b is now the least recently used
+    cache.set("c", users[2], expires_at)
+    assert cache.get("b") is None
+    assert cache.get("a") == users[0]
+    assert cache.get("c") == users[2]
+
+
+def test_token_cache_expires():
+    cache = TokenCache()
+    user = User(username="some-one")
+    cache.set("a", user, time.time() - 1)
+    assert cache.get("a") is None
+    assert not cache.tokens
+    assert not cache.users
+
+
+def test_token_cache_invalidate():
+    cache = TokenCache()
+    user, other_user = User(username="some-one"), User(username="some-one-else")
+    expires_at = time.time() + 60
+    cache.set("a", user, expires_at)
+    cache.set("b", user, expires_at)
+    cache.set("c", other_user, expires_at)
+
+    cache.invalidate(user.id)
+    assert cache.get("a") is None
+    assert cache.get("b") is None
+    assert cache.get("c") == other_user
+
+
+@pytest.mark.anyio
+async def test_get_current_user_cached(normal_user: User, async_session, monkeypatch):
+    token = get_access_token(normal_user)
+    calls = []
+
+    async def _get_current_user(token, session):
+        calls.append(token)
+        return await get_current_user_uncached(token, session)
+
+    monkeypatch.setattr(auth, "_get_current_user", _get_current_user)
+    first = await get_current_user(token, async_session)
+    second = await get_current_user(token, async_session)
+
+    assert first == second
+    assert calls == [token]
+
+
+def keycloak_transport(*responses):
+    requests = []
+    responses = list(responses)
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        response = responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    transport = httpx.MockTransport(handler)
+    transport.requests = requests
+    return transport
+
+
+def make_token_client(transport) -> KeycloakTokenClient:
+    return KeycloakTokenClient(
+        "http://keycloak/token", "client", "secret", transport=transport
+    )
+
+
+@pytest.mark.anyio
+async def test_keycloak_token_client():
+    transport = keycloak_transport(
+        httpx.Response(200, json={"access_token": "a"}),
+        httpx.Response(200, json={"access_token": "b"}),
+    )
+    client = make_token_client(transport)
+    await client.start()
+
+    assert await client.get_token("me", "password") == "a"
+    assert await client.get_token("me", "password") == "b"
+    await client.stop()
+
+    form = dict(httpx.QueryParams(transport.requests[0].content.decode()))
+    assert form == {
+        "client_id": "client",
+        "client_secret": "secret",
+        "username": "me",
+        "password": "password",
+        "grant_type": "password",
+    }
+
+
+@pytest.mark.anyio
+async def test_keycloak_token_client_retries():
+    transport = keycloak_transport(
+        httpx.ConnectError("refused"),
+        httpx.Response(503),
+        httpx.Response(200, json={"access_token": "a"}),
+    )
+    client = make_token_client(transport)
+
+    assert await client.get_token("me", "password") == "a"
+    assert len(transport.requests) == 3
+    await client.stop()
+
+
+@pytest.mark.anyio
+async def test_keycloak_token_client_gives_up():
+    transport = keycloak_transport(*[httpx.ConnectError("refused")] * 3)
+    client = make_token_client(transport)
+
+    with pytest.raises(HTTPException) as e:
+        await client.get_token("me", "password")
+    assert e.value.status_code == httpx.codes.SERVICE_UNAVAILABLE
+    assert len(transport.requests) == 3
+    await client.stop()
+
+
+@pytest.mark.anyio
+async def test_keycloak_token_client_wrong_password():
+    transport = keycloak_transport(httpx.Response(401, json={"error": "invalid"}))
+    client = make_token_client(transport)
+
+    with pytest.raises(HTTPException) as e:
+        await client.get_token("me", "wrong")
+    assert e.value.status_code == httpx.codes.UNAUTHORIZED
+    assert len(transport.requests) == 1
+    await client.stop()
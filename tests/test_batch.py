@@ -0,0 +1,273 @@
+import asyncio
+import hashlib
+import json
+from uuid import UUID
+
+import pytest
+from fastapi import HTTPException
+from litellm import RateLimitError
+
+from llm_freeway import api
+from llm_freeway.batch import LineRanges, retry_after, run_batch, spool
+from llm_freeway.database import BatchJob
+from tests.conftest import get_headers
+
+
+def test_line_ranges():
+    lines = LineRanges()
+    for line in [5, 1, 3, 2, 7, 6, 2]:
+        lines.add(line)
+    assert lines.to_list() == [[1, 3], [5, 7]]
+    assert len(lines) == 6
+    assert [line for line in range(9) if line in lines] == [1, 2, 3, 5, 6, 7]
+
+    lines.add(4)
+    assert lines.to_list() == [[1, 7]]
+    assert LineRanges(lines.to_list()).to_list() == [[1, 7]]
+
+
+def test_retry_after():
+    assert retry_after(HTTPException(429, headers={"Retry-After": "2"})) == 2
+    assert retry_after(HTTPException(429)) is None
+    assert retry_after(ValueError("bad request")) is None
+    assert (
+        retry_after(RateLimitError("slow down", llm_provider="openai", model="gpt"))
+        == 1
+    )
+
+
+async def delayed(item: tuple[int, float]) -> int:
+    number, delay = item
+    await asyncio.sleep(delay)
+    return number
+
+
+@pytest.mark.anyio
+async def test_run_batch_order():
+    items = [(0, 0.06), (1, 0), (2, 0.03), (3, 0.01)]
+    assert [n async for n in run_batch(items, delayed, 4)] == [0, 1, 2, 3]
+    assert [n async for n in run_batch(items, delayed, 4, ordered=False)] == [
+        1,
+        3,
+        2,
+        0,
+    ]
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("ordered", [True, False])
+async def test_run_batch_concurrency(ordered):
+    in_flight = peak = 0
+
+    async def call(item: int) -> int:
+        nonlocal in_flight, peak
+        in_flight += 1
+        peak = max(peak, in_flight)
+        await asyncio.sleep(0.001 * (item % 3))
+        in_flight -= 1
+        return item
+
+    results = [n async for n in run_batch(range(50), call, 4, ordered=ordered)]
+    assert sorted(results) == list(range(50))
+    assert peak == 4
+
+
+@pytest.mark.anyio
+async def test_run_batch_closed_early():
+    started = []
+
+    async def call(item: int) -> int:
+        started.append(item)
+        await asyncio.sleep(0.01 if item else 0)
+        return item
+
+    stream = run_batch(range(100), call, 2)
+    assert await anext(stream) == 0
+    await stream.aclose()
+    assert len(started) <= 4
+
+
+@pytest.fixture
+def batch_user(user_manager, admin_user_password):
+    user = user_manager.create(
+        username="batch@department.gov.uk",
+        password=admin_user_password,
+        is_admin=False,
+        tokens_per_minute=1_000,
+        cost_usd_per_month=1_000,
+    )
+    yield user
+    user_manager.delete(user=user)
+
+
+def read_results(response) -> list[dict]:
+    return [json.loads(line) for line in response.text.splitlines()]
+
+
+def make_file(*lines: dict | str) -> str:
+    return "\n".join(
+        line if isinstance(line, str) else json.dumps(line) for line in lines
+    )
+
+
+def test_batch(client, payload, batch_user):
+    payload = dict(payload, max_tokens=20)
+    response = client.post(
+        "/batch",
+        params={"concurrency": 2},
+        content=make_file(
+            payload,
+            "not json",
+            "",
+            dict(payload, model="not-a-model"),
+            dict(payload, stream=True),
+        ),
+        headers=get_headers(batch_user),
+    )
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    results = read_results(response)
+
+    assert [(r["line"], r["status_code"]) for r in results] == [
+        (1, 200),
+        (2, 422),
+        (4, 404),
+        (5, 200),
+    ]
+    assert (
+        results[0]["response"]["choices"][0]["message"]["content"]
+        == payload["mock_response"]
+    )
+    assert results[2]["error"] == "model=not-a-model not registered"
+    # lines are always completed, not streamed
+    assert results[3]["response"]["object"] == "chat.completion"
+
+
+@pytest.mark.parametrize("order", ["input", "completion"])
+def test_batch_order(client, payload, batch_user, order):
+    lines = [dict(payload, max_tokens=20, mock_response=str(i)) for i in range(6)]
+    response = client.post(
+        "/batch",
+        params={"concurrency": 3, "order": order},
+        content=make_file(*lines),
+        headers=get_headers(batch_user),
+    )
+    results = read_results(response)
+    numbers = [result["line"] for result in results]
+    if order == "input":
+        assert numbers == [1, 2, 3, 4, 5, 6]
+    else:
+        assert sorted(numbers) == [1, 2, 3, 4, 5, 6]
+    for result in results:
+        content = result["response"]["choices"][0]["message"]["content"]
+        assert content == str(result["line"] - 1)
+
+
+def test_batch_resume(client, payload, batch_user, session):
+    headers = get_headers(batch_user)
+    file = make_file(
+        dict(payload, max_tokens=20),
+        dict(payload, model="not-a-model"),
+        dict(payload, max_tokens=20),
+    )
+    response = client.post("/batch", content=file, headers=headers)
+    job_id = response.headers["X-Batch-Job-Id"]
+    assert [r["line"] for r in read_results(response)] == [1, 2, 3]
+
+    job = session.get(BatchJob, UUID(job_id))
+    assert job.user_id == batch_user.id
+    assert job.completed_lines == [[1, 1], [3, 3]]
+
+    # only the line that failed is run again
+    response = client.post(
+        "/batch", params={"job_id": job_id}, content=file, headers=headers
+    )
+    assert response.headers["X-Batch-Job-Id"] == job_id
+    assert [r["line"] for r in read_results(response)] == [2]
+
+
+def test_batch_resume_different_file(client, payload, batch_user):
+    headers = get_headers(batch_user)
+    response = client.post("/batch", content=make_file(payload), headers=headers)
+    job_id = response.headers["X-Batch-Job-Id"]
+
+    response = client.post(
+        "/batch",
+        params={"job_id": job_id},
+        content=make_file(payload, payload),
+        headers=headers,
+    )
+    assert response.status_code == 409
+    assert response.json() == {
+        "detail": f"batch job={job_id} was started with a different file"
+    }
+
+
+def test_batch_spools_large_files_to_disk(client, payload, batch_user, monkeypatch):
+    monkeypatch.setattr(
+        api, "env", api.env.model_copy(update={"batch_spool_bytes": 10})
+    )
+    lines = [dict(payload, max_tokens=20, mock_response=str(i)) for i in range(3)]
+    response = client.post(
+        "/batch", content=make_file(*lines), headers=get_headers(batch_user)
+    )
+    results = read_results(response)
+    assert [r["line"] for r in results] == [1, 2, 3]
+    assert [r["response"]["choices"][0]["message"]["content"] for r in results] == [
+        "0",
+        "1",
+        "2",
+    ]
+
+
+def test_batch_job_not_found(client, payload, normal_user, admin_user):
+    response = client.post(
+        "/batch", content=make_file(payload), headers=get_headers(admin_user)
+    )
+    job_id = response.headers["X-Batch-Job-Id"]
+
+    response = client.post(
+        "/batch",
+        params={"job_id": job_id},
+        content=make_file(payload),
+        headers=get_headers(normal_user),
+    )
+    assert response.status_code == 404
+    assert response.json() == {"detail": f"batch job={job_id} not found"}
+
+
+def test_batch_retries_rate_limits(client, payload, batch_user, monkeypatch):
+    monkeypatch.setattr(api, "QUOTA_RETRY_AFTER", 0.01)
+    # each line reserves ~260 of the user's 1000 tokens per minute, so the
+    # 4th has to wait for one of the first 3 to finish
+    response = client.post(
+        "/batch",
+        params={"concurrency": 4},
+        content=make_file(*[payload] * 4),
+        headers=get_headers(batch_user),
+    )
+    assert [r["status_code"] for r in read_results(response)] == [200] * 4
+
+
+def test_batch_too_large_for_limit(client, payload, batch_user):
+    response = client.post(
+        "/batch",
+        content=make_file(dict(payload, max_tokens=5_000)),
+        headers=get_headers(batch_user),
+    )
+    (result,) = read_results(response)
+    assert result["status_code"] == 429
+    assert "exceeds limit=1000" in result["error"]
+
+
+@pytest.mark.anyio
+async def test_spool():
+    async def chunks():
+        for chunk in [b'{"a": 1}\n', b'{"b"', b": 2}\n"]:
+            yield chunk
+
+    for max_size in [1024, 4]:
+        file, content_hash = await spool(chunks(), max_size)
+        assert list(file) == [b'{"a": 1}\n', b'{"b": 2}\n']
+        assert content_hash == hashlib.sha256(b'{"a": 1}\n{"b": 2}\n').hexdigest()
+        file.close()
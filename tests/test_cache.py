@@ -0,0 +1,101 @@
+import time
+
+import httpx
+import pytest
+from litellm import ModelResponse
+
+from llm_freeway import api
+from llm_freeway.cache import ResponseCache
+from tests.conftest import get_headers
+
+
+def make_response(content: str) -> ModelResponse:
+    response = ModelResponse()
+    response.choices[0].message.content = content
+    return response
+
+
+def test_response_cache():
+    cache = ResponseCache(max_bytes=10_000, ttl=60)
+    response = make_response("hello")
+    cache.set("a", response)
+    assert cache.get("a") is response
+    assert cache.get("b") is None
+
+
+def test_response_cache_expires():
+    cache = ResponseCache(max_bytes=10_000, ttl=0)
+    cache.set("a", make_response("hello"))
+    time.sleep(0.001)
+    assert cache.get("a") is None
+    assert cache.size == 0
+
+
+def test_response_cache_evicts_by_size():
+    size = len(make_response("a" * 100).model_dump_json())
+    cache = ResponseCache(max_bytes=size * 2, ttl=60)
+    cache.set("a", make_response("a" * 100))
+    cache.set("b", make_response("b" * 100))
+    cache.get("a")
+    cache.set("c", make_response("c" * 100))
+
+    assert cache.get("b") is None
+    assert cache.get("a") is not None
+    assert cache.get("c") is not None
+    assert cache.size <= cache.max_bytes
+
+
+def test_response_cache_disabled():
+    cache = ResponseCache(max_bytes=0, ttl=60)
+    cache.set("a", make_response("hello"))
+    assert cache.get("a") is None
+
+
+def test_response_cache_key():
+    payload = {"model": "gpt-4o", "messages": [{"content": "hello"}]}
+    assert ResponseCache.key(api.ChatRequest(**payload)) == ResponseCache.key(
+        api.ChatRequest(**payload, stream=True)
+    )
+    assert ResponseCache.key(api.ChatRequest(**payload)) != ResponseCache.key(
+        api.ChatRequest(**dict(payload, model="gpt-4o-mini"))
+    )
+
+
+@pytest.fixture
+def upstream_calls(monkeypatch):
+    calls = []
+    acompletion = api.acompletion
+
+    async def _acompletion(**kwargs):
+        calls.append(kwargs)
+        return await acompletion(**kwargs)
+
+    monkeypatch.setattr(api, "acompletion", _acompletion)
+    yield calls
+
+
+@pytest.mark.parametrize("cache_responses", [True, False])
+def test_chat_completions_cached(
+    client, payload, normal_user, gpt_4o, session, upstream_calls, cache_responses
+):
+    gpt_4o.cache_responses = cache_responses
+    session.add(gpt_4o)
+    session.commit()
+
+    responses = [
+        client.post(
+            "/chat/completions",
+            json=dict(payload, stream=False),
+            headers=get_headers(normal_user),
+        )
+        for _ in range(3)
+    ]
+    assert all(response.status_code == httpx.codes.OK for response in responses)
+    assert len(upstream_calls) == (1 if cache_responses else 3)
+
+    logs = client.get("/spend/logs", headers=get_headers(normal_user)).json()["items"]
+    assert len(logs) == 3
+    if cache_responses:
+        assert [log["cache_hit"] for log in logs] == [False, True, True]
+        assert [log["cost_usd"] for log in logs] == [pytest.approx(5), 0, 0]
+        assert len({response.json()["id"] for response in responses}) == 1
@@ -0,0 +1,215 @@
+import asyncio
+import json
+
+import pytest
+from httpx import ASGITransport, AsyncClient
+
+from llm_freeway import api
+from llm_freeway.api import app, get_session
+from llm_freeway.coalesce import Coalescer
+from tests.conftest import get_headers
+
+
+class FakeStream:
+    def __init__(self, parts, gate: asyncio.Event | None = None, error=None):
+        self.parts = parts
+        self.gate = gate
+        self.error = error
+        self.response_id = "1"
+        self.read = 0
+        self.closed = False
+
+    async def __aiter__(self):
+        try:
+            for i, part in enumerate(self.parts):
+                if self.gate and i == len(self.parts) // 2:
+                    await self.gate.wait()
+                self.read += 1
+                yield part
+            if self.error:
+                raise self.error
+        finally:
+            self.closed = True
+
+
+@pytest.mark.anyio
+async def test_coalescer_complete():
+    coalescer = Coalescer()
+    calls = []
+
+    async def call():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "response"
+
+    results = await asyncio.gather(*(coalescer.complete("a", call) for _ in range(5)))
+    assert results == ["response"] * 5
+    assert len(calls) == 1
+    assert not coalescer.completions
+
+    await coalescer.complete("a", call)
+    assert len(calls) == 2
+
+
+@pytest.mark.anyio
+async def test_coalescer_disabled():
+    coalescer = Coalescer(enabled=False)
+    calls = []
+
+    async def call():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "response"
+
+    await asyncio.gather(*(coalescer.complete("a", call) for _ in range(5)))
+    assert len(calls) == 5
+
+
+@pytest.mark.anyio
+async def test_coalescer_stream_late_joiner():
+    coalescer = Coalescer()
+    gate = asyncio.Event()
+    calls = []
+
+    async def open_stream():
+        calls.append(1)
+        return FakeStream(list(range(6)), gate)
+
+    async def consume(broadcast):
+        return [part async for part in broadcast.subscribe()]
+
+    first = asyncio.create_task(consume(coalescer.stream("a", open_stream)))
+    while len(coalescer.streams["a"].parts) < 3:
+        await asyncio.sleep(0)
+
+    late = asyncio.create_task(consume(coalescer.stream("a", open_stream)))
+    gate.set()
+
+    assert await first == list(range(6))
+    assert await late == list(range(6))
+    assert len(calls) == 1
+    await asyncio.gather(*coalescer.tasks)
+    assert not coalescer.streams
+
+
+@pytest.mark.anyio
+async def test_coalescer_stream_error():
+    coalescer = Coalescer()
+
+    async def open_stream():
+        return FakeStream([1, 2], error=ValueError("upstream failed"))
+
+    broadcasts = [coalescer.stream("a", open_stream) for _ in range(2)]
+    for broadcast in broadcasts:
+        with pytest.raises(ValueError):
+            [part async for part in broadcast.subscribe()]
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("enabled", [True, False])
+async def test_coalescer_stream_closed_early(enabled):
+    coalescer = Coalescer(enabled)
+    upstream = FakeStream(list(range(6)), asyncio.Event())
+
+    async def open_stream():
+        return upstream
+
+    parts = coalescer.stream("a", open_stream).subscribe()
+    assert await anext(parts) == 0
+    await parts.aclose()
+    await asyncio.gather(*coalescer.tasks, return_exceptions=True)
+
+    assert upstream.read < 6
+    assert upstream.closed
+    assert not coalescer.streams
+    assert not coalescer.tasks
+
+
+@pytest.mark.anyio
+async def test_coalescer_stream_kept_open_for_other_subscribers():
+    coalescer = Coalescer()
+    gate = asyncio.Event()
+    upstream = FakeStream(list(range(6)), gate)
+
+    async def open_stream():
+        return upstream
+
+    first = coalescer.stream("a", open_stream).subscribe()
+    second = coalescer.stream("a", open_stream).subscribe()
+    assert await anext(first) == 0
+    assert await anext(second) == 0
+    await first.aclose()
+
+    gate.set()
+    assert [part async for part in second] == [1, 2, 3, 4, 5]
+    assert upstream.read == 6
+
+
+@pytest.mark.anyio
+async def test_coalescer_disabled_stream_not_pumped():
+    coalescer = Coalescer(enabled=False)
+
+    async def open_stream():
+        return FakeStream([1, 2])
+
+    stream = coalescer.stream("a", open_stream)
+    assert [part async for part in stream.subscribe()] == [1, 2]
+    assert stream.response_id == "1"
+    assert not coalescer.tasks
+
+
+@pytest.fixture
+def slow_upstream(monkeypatch):
+    calls = []
+    acompletion = api.acompletion
+
+    async def _acompletion(**kwargs):
+        calls.append(kwargs)
+        await asyncio.sleep(0.05)
+        return await acompletion(**kwargs)
+
+    monkeypatch.setattr(api, "acompletion", _acompletion)
+    yield calls
+
+
+@pytest.mark.parametrize("stream", [True, False])
+@pytest.mark.anyio
+async def test_chat_completions_coalesced(
+    get_session_override, payload, normal_user, gpt_4o, slow_upstream, stream
+):
+    app.dependency_overrides[get_session] = get_session_override
+    # five concurrent default-sized reservations would exceed tokens_per_minute
+    payload = dict(payload, max_tokens=50)
+
+    async def request(client):
+        if not stream:
+            response = await client.post(
+                "/chat/completions",
+                json=dict(payload, stream=False),
+                headers=get_headers(normal_user),
+            )
+            return response.json()["choices"][0]["message"]["content"]
+
+        content = ""
+        async with client.stream(
+            "POST",
+            "/chat/completions",
+            json=dict(payload, stream=True),
+            headers=get_headers(normal_user),
+        ) as response:
+            async for line in response.aiter_lines():
+                if line.startswith("data: ") and line != "data: [DONE]":
+                    for choice in json.loads(line.removeprefix("data: "))["choices"]:
+                        content += choice["delta"]["content"] or ""
+        return content
+
+    async with AsyncClient(
+        transport=ASGITransport(app=app), base_url="http://test"
+    ) as client:
+        contents = await asyncio.gather(*(request(client) for _ in range(5)))
+        logs = await client.get("/spend/logs", headers=get_headers(normal_user))
+
+    app.dependency_overrides.clear()
+    assert contents == [payload["mock_response"]] * 5
+    assert len(slow_upstream) == 1
+    assert len(logs.json()["items"]) == 5
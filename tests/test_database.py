@@ -1,11 +1,65 @@
 import pytest
+from sqlmodel import delete, select
 
-from llm_freeway.database import Spend
+from llm_freeway.database import (
+    DailySpend,
+    EventLog,
+    Spend,
+    backfill_daily_spend,
+)
 
 
 @pytest.mark.freeze_time("2017-05-21")
-def test_user_get_spend(user_with_spend, session):
+@pytest.mark.anyio
+async def test_user_get_spend(user_with_spend, async_session):
     expected_spend = Spend(
         requests=60, completion_tokens=6000, prompt_tokens=12000, cost_usd=12.0
     )
-    assert user_with_spend.get_spend(session) == expected_spend
+    assert await user_with_spend.get_spend(async_session) == expected_spend
+
+
+def test_daily_spend_updated_on_write(user_with_spend, session):
+    rows = session.exec(
+        select(DailySpend).where(DailySpend.user_id == user_with_spend.id)
+    ).all()
+    assert sum(row.requests for row in rows) == 120
+    assert sum(row.prompt_tokens for row in rows) == 24_000
+    assert sum(row.completion_tokens for row in rows) == 12_000
+    assert sum(row.cost_usd for row in rows) == pytest.approx(12.0)
+
+
+def test_daily_spend_updated_on_delete(normal_user, session, gpt_4o):
+    log = EventLog(
+        response_id="1",
+        user_id=normal_user.id,
+        model=gpt_4o.name,
+        prompt_tokens=200,
+        completion_tokens=100,
+        cost_usd=1,
+    )
+    session.add(log)
+    session.commit()
+    session.delete(log)
+    session.commit()
+
+    row = session.exec(
+        select(DailySpend).where(DailySpend.user_id == normal_user.id)
+    ).one()
+    assert (row.requests, row.prompt_tokens, row.cost_usd) == (0, 0, 0)
+
+
+def test_backfill_daily_spend(user_with_spend, session):
+    expected = session.exec(select(DailySpend).order_by(DailySpend.day)).all()
+    expected = [row.model_dump() for row in expected]
+    session.exec(delete(DailySpend))
+    session.commit()
+
+    backfill_daily_spend(session)
+
+    actual = session.exec(select(DailySpend).order_by(DailySpend.day)).all()
+    assert [row.model_dump(exclude={"cost_usd"}) for row in actual] == [
+        {k: v for k, v in row.items() if k != "cost_usd"} for row in expected
+    ]
+    assert [row.cost_usd for row in actual] == pytest.approx(
+        [row["cost_usd"] for row in expected]
+    )
@@ -0,0 +1,171 @@
+import asyncio
+
+import pytest
+from sqlmodel import func, select
+
+from llm_freeway.database import DailySpend, EventLog
+from llm_freeway.log_writer import LogWriter
+
+
+@pytest.fixture
+def make_logs(normal_user, gpt_4o):
+    def f(n):
+        return [
+            EventLog(
+                response_id=str(i),
+                user_id=normal_user.id,
+                model=gpt_4o.name,
+                prompt_tokens=10,
+                completion_tokens=20,
+                cost_usd=0.1,
+            )
+            for i in range(n)
+        ]
+
+    yield f
+
+
+@pytest.fixture
+def writes(monkeypatch):
+    batches = []
+    write = LogWriter._write
+
+    async def _write(self, batch):
+        batches.append(len(batch))
+        await write(self, batch)
+
+    monkeypatch.setattr(LogWriter, "_write", _write)
+    yield batches
+
+
+def count(session) -> int:
+    return session.exec(select(func.count(EventLog.id))).one()
+
+
+@pytest.mark.anyio
+async def test_log_writer_batches(session, async_engine, make_logs, writes):
+    writer = LogWriter(async_engine, batch_size=3, flush_interval=60)
+    await writer.start()
+    for log in make_logs(7):
+        await writer.put(log)
+    await writer.stop()
+
+    assert writes == [3, 3, 1]
+    assert count(session) == 7
+    daily_spend = session.exec(select(DailySpend)).one()
+    assert daily_spend.requests == 7
+    assert daily_spend.prompt_tokens == 70
+
+
+@pytest.mark.anyio
+async def test_log_writer_flush_interval(session, async_engine, make_logs, writes):
+    writer = LogWriter(async_engine, batch_size=100, flush_interval=0.01)
+    await writer.start()
+    for log in make_logs(2):
+        await writer.put(log)
+
+    for _ in range(100):
+        if writes:
+            break
+        await asyncio.sleep(0.01)
+
+    assert writes == [2]
+    assert count(session) == 2
+    await writer.stop()
+
+
+@pytest.mark.anyio
+async def test_log_writer_drop_when_full(session, async_engine, make_logs):
+    writer = LogWriter(
+        async_engine, max_queue_size=2, flush_interval=60, queue_full="drop"
+    )
+    await writer.start()
+    for log in make_logs(5):
+        await writer.put(log)
+    await writer.stop()
+
+    assert count(session) == 2
+
+
+@pytest.mark.anyio
+async def test_log_writer_block_when_full(session, async_engine, make_logs):
+    writer = LogWriter(async_engine, batch_size=2, max_queue_size=2, flush_interval=60)
+    await writer.start()
+    for log in make_logs(5):
+        await writer.put(log)
+    await writer.stop()
+
+    assert count(session) == 5
+    assert not writer.running
+
+
+@pytest.fixture
+def failing_writes(monkeypatch):
+    failures = {"remaining": 0}
+    write = LogWriter._write
+
+    async def _write(self, batch):
+        if failures["remaining"]:
+            failures["remaining"] -= 1
+            raise OSError("database unavailable")
+        await write(self, batch)
+
+    monkeypatch.setattr(LogWriter, "_write", _write)
+    yield failures
+
+
+@pytest.mark.anyio
+async def test_log_writer_retries_failed_batches(
+    session, async_engine, make_logs, failing_writes
+):
+    failing_writes["remaining"] = 2
+    writer = LogWriter(async_engine, flush_interval=0, retry_delay=0.01)
+    await writer.start()
+    for log in make_logs(3):
+        await writer.put(log)
+    await writer.stop()
+
+    assert failing_writes["remaining"] == 0
+    assert count(session) == 3
+
+
+@pytest.mark.anyio
+async def test_log_writer_gives_up_when_stopping(
+    session, async_engine, make_logs, failing_writes, caplog
+):
+    failing_writes["remaining"] = 100
+    writer = LogWriter(
+        async_engine, flush_interval=60, retry_delay=0.01, stop_attempts=2
+    )
+    await writer.start()
+    for log in make_logs(2):
+        await writer.put(log)
+    await writer.stop()
+
+    assert failing_writes["remaining"] == 98
+    assert count(session) == 0
+    assert "gave up writing 2 event logs" in caplog.text
+    assert '"response_id": "1"' in caplog.text
+
+
+@pytest.mark.anyio
+async def test_log_writer_gives_up_conflicting_rows(
+    session, async_engine, make_logs, writes, caplog
+):
+    logs = make_logs(6)
+    writer = LogWriter(async_engine, flush_interval=60)
+    await writer.start()
+    await writer.put(logs[2])
+    await writer.stop()
+
+    # a row that is already there, amongst rows that aren't
+    logs[2] = logs[2].model_copy(update={"response_id": "conflict"})
+    await writer.start()
+    for log in logs:
+        await writer.put(log)
+    await writer.stop()
+
+    assert count(session) == 6
+    assert writes == [1, 6, 3, 1, 2, 1, 1, 3]
+    assert "gave up writing 1 event logs" in caplog.text
+    assert '"response_id": "conflict"' in caplog.text
@@ -0,0 +1,43 @@
+import httpx
+
+from llm_freeway.metrics import Metrics, metrics
+
+
+def test_metrics_render():
+    registry = Metrics()
+    registry.register("requests_total", "counter", "requests served")
+    registry.register("queue_depth", "gauge", "requests waiting")
+
+    registry.inc("requests_total", model="gpt-4o")
+    registry.inc("requests_total", 2, model="gpt-4o")
+    registry.inc("requests_total", model='say "hi"')
+    registry.set("queue_depth", 5)
+
+    assert registry.get("requests_total", model="gpt-4o") == 3
+    assert registry.render() == (
+        "# HELP requests_total requests served\n"
+        "# TYPE requests_total counter\n"
+        'requests_total{model="gpt-4o"} 3\n'
+        'requests_total{model="say \\"hi\\""} 1\n'
+        "# HELP queue_depth requests waiting\n"
+        "# TYPE queue_depth gauge\n"
+        "queue_depth 5\n"
+    )
+
+
+def test_metrics_clear():
+    registry = Metrics()
+    registry.register("requests_total", "counter", "requests served")
+    registry.inc("requests_total")
+    registry.clear()
+    assert registry.get("requests_total") == 0
+
+
+def test_get_metrics(client):
+    metrics.inc("upstream_requests_total", provider="bedrock")
+
+    response = client.get("/metrics")
+
+    assert response.status_code == httpx.codes.OK
+    assert response.headers["content-type"].startswith("text/plain")
+    assert 'upstream_requests_total{provider="bedrock"} 1' in response.text
@@ -0,0 +1,119 @@
+import logging
+from datetime import date
+
+import pytest
+from sqlalchemy import inspect
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.schema import CreateTable
+
+from llm_freeway.partitions import (
+    NOT_PARTITIONED,
+    add_months,
+    expired_partitions,
+    maintain_partitions,
+    months_to_create,
+    partition_name,
+    partitioned_event_log,
+)
+
+
+def test_add_months():
+    assert add_months(date(2024, 11, 1), 1) == date(2024, 12, 1)
+    assert add_months(date(2024, 12, 1), 1) == date(2025, 1, 1)
+    assert add_months(date(2024, 1, 1), -13) == date(2022, 12, 1)
+
+
+def test_partition_name():
+    assert partition_name(date(2025, 3, 1)) == "eventlog_y2025m03"
+
+
+def test_months_to_create():
+    assert months_to_create(date(2024, 12, 15), 2, None) == [
+        date(2024, 12, 1),
+        date(2025, 1, 1),
+        date(2025, 2, 1),
+    ]
+    assert months_to_create(date(2024, 12, 15), 1, 2) == [
+        date(2024, 10, 1),
+        date(2024, 11, 1),
+        date(2024, 12, 1),
+        date(2025, 1, 1),
+    ]
+
+
+def test_expired_partitions():
+    names = [
+        "eventlog_y2024m08",
+        "eventlog_y2024m09",
+        "eventlog_y2024m10",
+        "eventlog_y2024m12",
+        "eventlog_archive",
+    ]
+    assert expired_partitions(names, date(2024, 12, 15), 2) == [
+        "eventlog_y2024m08",
+        "eventlog_y2024m09",
+    ]
+    assert expired_partitions(names, date(2024, 12, 15), None) == []
+
+
+def test_partitioned_event_log_ddl():
+    table = partitioned_event_log()
+    ddl = str(CreateTable(table).compile(dialect=postgresql.dialect()))
+
+    assert "PRIMARY KEY (id, timestamp)" in ddl
+    assert "PARTITION BY RANGE (timestamp)" in ddl
+    assert {index.name for index in table.indexes} == {
+        "ix_eventlog_response_id",
+        "ix_eventlog_timestamp_id",
+        "ix_eventlog_user_id_timestamp",
+    }
+
+
+def test_event_log_user_timestamp_index(session):
+    indexes = inspect(session.get_bind()).get_indexes("eventlog")
+    assert {
+        "name": "ix_eventlog_user_id_timestamp",
+        "column_names": ["user_id", "timestamp"],
+        "unique": 0,
+        "dialect_options": {},
+    } in indexes
+
+
+class FakeConnection:
+    """records the statements run, with the eventlog's pg_class.relkind"""
+
+    def __init__(self, relkind: str | None):
+        self.relkind = relkind
+        self.statements = []
+
+    def execute(self, statement, parameters=None):
+        self.statements.append(str(statement))
+        return self
+
+    def scalar(self):
+        return self.relkind
+
+    def scalars(self):
+        return []
+
+
+@pytest.mark.parametrize("relkind", ["r", None])
+def test_maintain_partitions_not_partitioned(relkind, caplog):
+    connection = FakeConnection(relkind)
+    with caplog.at_level(logging.WARNING):
+        maintain_partitions(connection, date(2024, 12, 15))
+
+    assert len(connection.statements) == 1
+    assert "PARTITION" not in connection.statements[0]
+    assert NOT_PARTITIONED in caplog.text
+
+
+def test_maintain_partitions():
+    connection = FakeConnection("p")
+    maintain_partitions(connection, date(2024, 12, 15))
+
+    created = [s for s in connection.statements if "PARTITION OF" in s]
+    assert created[0] == (
+        "CREATE TABLE IF NOT EXISTS eventlog_y2024m12 PARTITION OF eventlog "
+        "FOR VALUES FROM ('2024-12-01') TO ('2025-01-01')"
+    )
@@ -0,0 +1,94 @@
+import httpx
+import pytest
+from sqlmodel import select
+
+from llm_freeway import database
+from llm_freeway.database import SQLUser
+from llm_freeway.passwords import PasswordHasher
+from tests.conftest import get_headers
+from tests.test_api import skip_keycloak
+
+
+@pytest.mark.anyio
+async def test_password_hasher():
+    hasher = PasswordHasher(rounds=4, max_workers=2)
+    hashed_password = await hasher.hash("secret")
+
+    assert hashed_password.startswith("$2b$04$")
+    assert await hasher.verify_and_update("secret", hashed_password) == (True, None)
+    assert await hasher.verify_and_update("wrong", hashed_password) == (False, None)
+
+
+@pytest.mark.anyio
+async def test_password_hasher_rehashes_other_rounds():
+    old_hash = await PasswordHasher(rounds=5).hash("secret")
+
+    verified, new_hash = await PasswordHasher(rounds=4).verify_and_update(
+        "secret", old_hash
+    )
+    assert verified
+    assert new_hash.startswith("$2b$04$")
+
+
+@pytest.mark.anyio
+async def test_password_hasher_hash_many():
+    hasher = PasswordHasher(rounds=4)
+    passwords = [f"password-{i}" for i in range(10)]
+
+    hashed_passwords = await hasher.hash_many(passwords)
+
+    assert len(set(hashed_passwords)) == 10
+    for password, hashed_password in zip(passwords, hashed_passwords):
+        assert hasher.context.verify(password, hashed_password)
+
+
+@skip_keycloak
+def test_token_rehashes_password(
+    client, session, admin_user, admin_user_password, monkeypatch
+):
+    monkeypatch.setattr(database, "password_hasher", PasswordHasher(rounds=4))
+    payload = {"username": admin_user.username, "password": admin_user_password}
+
+    response = client.post("/token", data=payload)
+
+    assert response.status_code == httpx.codes.OK
+    session.refresh(admin_user)
+    assert admin_user.hashed_password.startswith("$2b$04$")
+
+
+@skip_keycloak
+def test_token_unknown_user(client, admin_user):
+    payload = {"username": "no.one@example.com", "password": "password"}
+
+    response = client.post("/token", data=payload)
+
+    assert response.status_code == httpx.codes.UNAUTHORIZED
+
+
+@skip_keycloak
+def test_create_users_bulk(client, session, admin_user):
+    payload = [{"username": f"user-{i}", "password": f"password-{i}"} for i in range(5)]
+
+    response = client.post("/users/bulk", json=payload, headers=get_headers(admin_user))
+
+    assert response.status_code == httpx.codes.OK
+    assert [user["username"] for user in response.json()] == [
+        f"user-{i}" for i in range(5)
+    ]
+    users = session.exec(select(SQLUser).where(SQLUser.username != admin_user.username))
+    for user in users:
+        i = user.username.removeprefix("user-")
+        assert database.password_hasher.context.verify(
+            f"password-{i}", user.hashed_password
+        )
+
+
+@skip_keycloak
+def test_create_users_bulk_not_admin(client, normal_user):
+    payload = [{"username": "some-one", "password": "password"}]
+
+    response = client.post(
+        "/users/bulk", json=payload, headers=get_headers(normal_user)
+    )
+
+    assert response.status_code == httpx.codes.UNAUTHORIZED
@@ -0,0 +1,199 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+from fakeredis import FakeAsyncRedis, FakeServer
+
+from llm_freeway.database import EventLog, Spend
+from llm_freeway.quota import MemoryQuota, RedisQuota, SlidingWindow
+
+
+def test_sliding_window_expire():
+    window = SlidingWindow(60)
+    window.add(100, 10, 20)
+    window.add(130, 1, 2)
+    window.add(120, 100, 200)
+
+    window.expire(170)
+    assert len(window) == 2
+    assert (window.prompt_tokens, window.completion_tokens) == (101, 202)
+
+    window.expire(190)
+    assert len(window) == 0
+    assert (window.prompt_tokens, window.completion_tokens) == (0, 0)
+
+
+@pytest.fixture
+def redis_server():
+    yield FakeServer()
+
+
+@pytest.fixture(params=["memory", "redis"])
+def make_quota(request, redis_server):
+    def f(**kwargs):
+        if request.param == "redis":
+            return RedisQuota(FakeAsyncRedis(server=redis_server), **kwargs)
+        return MemoryQuota(**kwargs)
+
+    yield f
+
+
+def make_log(user, model, prompt_tokens=200, completion_tokens=100, **kwargs):
+    return EventLog(
+        response_id="1",
+        user_id=user.id,
+        model=model.name,
+        prompt_tokens=prompt_tokens,
+        completion_tokens=completion_tokens,
+        **kwargs,
+    )
+
+
+@pytest.mark.freeze_time("2017-05-21")
+@pytest.mark.anyio
+async def test_memory_quota_get_spend(user_with_spend, async_session):
+    expected_spend = Spend(
+        requests=60, completion_tokens=6000, prompt_tokens=12000, cost_usd=12.0
+    )
+    spend = await MemoryQuota().get_spend(user_with_spend, async_session)
+    assert spend.model_dump(exclude={"cost_usd"}) == expected_spend.model_dump(
+        exclude={"cost_usd"}
+    )
+    assert spend.cost_usd == pytest.approx(expected_spend.cost_usd)
+
+
+@pytest.mark.freeze_time("2017-05-21")
+@pytest.mark.anyio
+async def test_memory_quota_seed(user_with_spend, async_session):
+    quota = MemoryQuota()
+    await quota.seed(async_session)
+    assert len(quota.windows[user_with_spend.id]) == 60
+
+
+@pytest.mark.anyio
+async def test_quota_record(make_quota, normal_user, async_session, gpt_4o):
+    quota = make_quota()
+    await quota.seed(async_session)
+    assert (await quota.get_spend(normal_user, async_session)).requests == 0
+
+    await quota.record(make_log(normal_user, gpt_4o, timestamp=datetime.now()))
+    await quota.record(
+        make_log(normal_user, gpt_4o, timestamp=datetime.now() - timedelta(minutes=2))
+    )
+
+    spend = await quota.get_spend(normal_user, async_session)
+    assert spend.requests == 1
+    assert spend.prompt_tokens == 200
+    assert spend.completion_tokens == 100
+
+
+@pytest.mark.freeze_time("2017-05-21 12:00:30")
+@pytest.mark.anyio
+async def test_redis_quota_sliding_window(
+    redis_server, normal_user, async_session, gpt_4o
+):
+    quota = RedisQuota(FakeAsyncRedis(server=redis_server))
+    # half of the previous minute is still in the window
+    for _ in range(10):
+        await quota.record(
+            make_log(normal_user, gpt_4o, timestamp=datetime(2017, 5, 21, 11, 59, 50))
+        )
+    await quota.record(
+        make_log(normal_user, gpt_4o, timestamp=datetime(2017, 5, 21, 12, 0, 10))
+    )
+
+    spend = await quota.get_spend(normal_user, async_session)
+    assert spend.requests == 6
+    assert spend.prompt_tokens == 1200
+    assert spend.completion_tokens == 600
+
+
+@pytest.mark.anyio
+async def test_redis_quota_shared_between_processes(
+    redis_server, normal_user, async_session, gpt_4o
+):
+    workers = [RedisQuota(FakeAsyncRedis(server=redis_server)) for _ in range(3)]
+
+    for worker in workers:
+        assert (await worker.get_spend(normal_user, async_session)).requests == 0
+
+    for worker in workers:
+        await worker.record(
+            make_log(normal_user, gpt_4o, timestamp=datetime.now(), cost_usd=0.5)
+        )
+
+    for worker in workers:
+        spend = await worker.get_spend(normal_user, async_session)
+        assert spend.requests == 3
+        assert spend.cost_usd == pytest.approx(1.5)
+
+
+@pytest.mark.freeze_time("2017-05-21 12:00:30")
+@pytest.mark.anyio
+async def test_redis_quota_seeds_once(redis_server, user_with_spend, async_session):
+    first = RedisQuota(FakeAsyncRedis(server=redis_server))
+    second = RedisQuota(FakeAsyncRedis(server=redis_server))
+
+    first_spend = await first.get_spend(user_with_spend, async_session)
+    second_spend = await second.get_spend(user_with_spend, async_session)
+    assert first_spend == second_spend
+    assert first_spend.cost_usd == pytest.approx(12.0)
+
+
+@pytest.mark.anyio
+async def test_quota_reserve(make_quota, normal_user, async_session, gpt_4o):
+    normal_user.tokens_per_minute = 1000
+    quota = make_quota()
+    await quota.record(make_log(normal_user, gpt_4o, timestamp=datetime.now()))
+
+    reservations = [
+        await quota.reserve(normal_user, 300, async_session) for _ in range(3)
+    ]
+    assert [reservation.granted for reservation in reservations] == [
+        True,
+        True,
+        False,
+    ]
+    assert reservations[-1].in_use == 900
+
+    # the usage is recorded, then the estimate is dropped
+    await quota.record(make_log(normal_user, gpt_4o, 50, 50, timestamp=datetime.now()))
+    await quota.reconcile(reservations[0])
+    reservation = await quota.reserve(normal_user, 300, async_session)
+    assert reservation.granted
+    assert reservation.in_use == 700
+
+
+@pytest.mark.anyio
+async def test_quota_reservation_expires(make_quota, normal_user, async_session):
+    normal_user.tokens_per_minute = 1000
+    quota = make_quota(reservation_ttl=0.05)
+    assert (await quota.reserve(normal_user, 600, async_session)).granted
+    assert not (await quota.reserve(normal_user, 600, async_session)).granted
+
+    # never reconciled, but no longer held once it has expired
+    await asyncio.sleep(0.1)
+    assert (await quota.reserve(normal_user, 600, async_session)).granted
+
+
+@pytest.mark.anyio
+async def test_quota_reserve_concurrently(
+    make_quota, normal_user, async_session, gpt_4o
+):
+    normal_user.tokens_per_minute = 1000
+    quota = make_quota()
+    # redis quotas are shared by every worker, memory ones within a worker
+    workers = [
+        quota if isinstance(quota, MemoryQuota) else make_quota() for _ in range(5)
+    ]
+    for worker in workers:
+        await worker.get_spend(normal_user, async_session)
+
+    reservations = await asyncio.gather(
+        *(
+            worker.reserve(normal_user, 300, async_session)
+            for worker in workers
+            for _ in range(2)
+        )
+    )
+    assert sum(reservation.granted for reservation in reservations) == 3
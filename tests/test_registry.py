@@ -0,0 +1,142 @@
+import json
+import os
+
+import httpx
+import pytest
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from llm_freeway.database import LLM
+from llm_freeway.registry import ModelRegistry
+from tests.conftest import get_headers
+
+
+@pytest.fixture
+def models_path(tmp_path):
+    path = tmp_path / "models.json"
+    path.write_text(
+        json.dumps(
+            [
+                {
+                    "name": "azure/gpt-4o",
+                    "input_cost_per_token": 0.1,
+                    "output_cost_per_token": 0.2,
+                }
+            ]
+        )
+    )
+    yield path
+
+
+@pytest.mark.anyio
+async def test_model_registry_from_file(models_path, async_session, monkeypatch):
+    registry = ModelRegistry(models_path)
+    await registry.reload(async_session)
+    model = await async_session.get(LLM, "azure/gpt-4o")
+    assert model.output_cost_per_token == 0.2
+
+    async def get(*args, **kwargs):
+        raise AssertionError("the registry should not query the database")
+
+    monkeypatch.setattr(AsyncSession, "get", get)
+    monkeypatch.setattr(AsyncSession, "exec", get)
+    model = await registry.get("azure/gpt-4o", async_session)
+    assert model.get_cost_usd(10, 20) == pytest.approx(5)
+
+
+@pytest.mark.anyio
+async def test_model_registry_reloads_changed_file(models_path, async_session):
+    registry = ModelRegistry(models_path, check_interval=0)
+    await registry.reload(async_session)
+
+    models_path.write_text(
+        json.dumps(
+            [
+                {
+                    "name": "azure/gpt-4o",
+                    "input_cost_per_token": 1,
+                    "output_cost_per_token": 2,
+                },
+                {
+                    "name": "azure/gpt-4o-mini",
+                    "input_cost_per_token": 0.01,
+                    "output_cost_per_token": 0.02,
+                },
+            ]
+        )
+    )
+    os.utime(models_path, (0, 0))
+
+    model = await registry.get("azure/gpt-4o", async_session)
+    assert model.input_cost_per_token == 1
+    model = await registry.get("azure/gpt-4o-mini", async_session)
+    assert model.input_cost_per_token == 0.01
+
+
+@pytest.mark.anyio
+async def test_model_registry_keeps_models_on_bad_file(models_path, async_session):
+    registry = ModelRegistry(models_path, check_interval=0)
+    await registry.reload(async_session)
+
+    models_path.write_text("not json")
+    os.utime(models_path, (0, 0))
+
+    model = await registry.get("azure/gpt-4o", async_session)
+    assert model.input_cost_per_token == 0.1
+
+
+@pytest.mark.anyio
+async def test_model_registry_falls_back_to_database(session, async_session, gpt_4o):
+    registry = ModelRegistry()
+    await registry.reload(async_session)
+
+    session.add(LLM(name="new", input_cost_per_token=1, output_cost_per_token=1))
+    session.commit()
+
+    assert (await registry.get("new", async_session)).name == "new"
+    assert await registry.get("unknown", async_session) is None
+
+
+@pytest.mark.anyio
+async def test_model_registry_remembers_missing_models(
+    session, async_session, monkeypatch
+):
+    registry = ModelRegistry(missing_ttl=60)
+    await registry.reload(async_session)
+    lookups = []
+    get = async_session.get
+
+    async def _get(*args, **kwargs):
+        lookups.append(args)
+        return await get(*args, **kwargs)
+
+    monkeypatch.setattr(async_session, "get", _get)
+    for _ in range(3):
+        assert await registry.get("unknown", async_session) is None
+    assert len(lookups) == 1
+
+    # a reload forgets it, in case it has since been added
+    session.add(LLM(name="unknown", input_cost_per_token=1, output_cost_per_token=1))
+    session.commit()
+    await registry.reload(async_session)
+    assert (await registry.get("unknown", async_session)).name == "unknown"
+
+
+def test_reload_models(client, admin_user, gpt_4o):
+    response = client.post("/models/reload", headers=get_headers(admin_user))
+
+    assert response.status_code == httpx.codes.OK
+    assert response.json() == [
+        {
+            "name": "gpt-4o",
+            "input_cost_per_token": 0.1,
+            "output_cost_per_token": 0.2,
+            "cache_responses": False,
+            "max_concurrency": None,
+        }
+    ]
+
+
+def test_reload_models_not_admin(client, normal_user):
+    response = client.post("/models/reload", headers=get_headers(normal_user))
+
+    assert response.status_code == httpx.codes.UNAUTHORIZED
@@ -0,0 +1,97 @@
+import json
+from datetime import datetime
+from uuid import uuid4
+
+import pytest
+from fastapi.encoders import jsonable_encoder
+from starlette.requests import ClientDisconnect
+
+from llm_freeway.api import EventLogResponse, app
+from llm_freeway.database import LLM, EventLog
+from llm_freeway.responses import FastJSONResponse, ReleasingStreamingResponse
+
+
+def make_log() -> EventLog:
+    return EventLog(
+        user_id=uuid4(),
+        model="gpt-4o",
+        response_id="1",
+        prompt_tokens=10,
+        completion_tokens=20,
+        cost_usd=5,
+    )
+
+
+def test_fast_json_response_model():
+    page = EventLogResponse(items=[make_log(), make_log()], page=1, size=2)
+    response = FastJSONResponse(page)
+    assert response.media_type == "application/json"
+    assert json.loads(response.body) == jsonable_encoder(page)
+
+
+def test_fast_json_response_other_values():
+    user_id = uuid4()
+    content = {
+        "models": [LLM(name="gpt-4o", input_cost_per_token=1, output_cost_per_token=2)],
+        "user_id": user_id,
+        "timestamp": datetime(2025, 1, 2, 3, 4, 5),
+        1: "one",
+    }
+    assert json.loads(FastJSONResponse(content).body) == {
+        "models": [
+            {
+                "name": "gpt-4o",
+                "input_cost_per_token": 1,
+                "output_cost_per_token": 2,
+                "cache_responses": False,
+                "max_concurrency": None,
+            }
+        ],
+        "user_id": str(user_id),
+        "timestamp": "2025-01-02T03:04:05",
+        "1": "one",
+    }
+
+
+def test_spend_logs_schema():
+    schema = app.openapi()["paths"]["/spend/logs"]["get"]["responses"]["200"]
+    assert schema["content"]["application/json"]["schema"] == {
+        "$ref": "#/components/schemas/EventLogResponse"
+    }
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("disconnect_at", ["http.response.start", None])
+async def test_releasing_streaming_response(disconnect_at):
+    started, released, sent = [], [], []
+
+    async def body():
+        started.append(True)
+        yield b"data"
+
+    async def release():
+        released.append(True)
+
+    async def receive():
+        return {"type": "http.request"}
+
+    async def send(message):
+        if message["type"] == disconnect_at:
+            raise OSError("client went away")
+        sent.append(message)
+
+    response = ReleasingStreamingResponse(body(), release)
+    scope = {"type": "http", "asgi": {"spec_version": "2.4"}}
+    if disconnect_at:
+        with pytest.raises(ClientDisconnect):
+            await response(scope, receive, send)
+        # the body never started, so only the response can release
+        assert not started
+    else:
+        await response(scope, receive, send)
+        assert sent[-1] == {
+            "type": "http.response.body",
+            "body": b"",
+            "more_body": False,
+        }
+    assert released == [True]
@@ -0,0 +1,216 @@
+import asyncio
+
+import httpx
+import litellm
+import pytest
+from litellm import acompletion
+
+from llm_freeway import api
+from llm_freeway.database import LLM, Deployment
+from llm_freeway.router import NoCapacityError, Router, litellm_kwargs
+from tests.conftest import get_headers
+
+llm = LLM(name="gpt-4o", input_cost_per_token=0.1, output_cost_per_token=0.2)
+
+
+def make_deployments(*names: str, **kwargs) -> list[Deployment]:
+    return [
+        Deployment(name=name, llm=llm.name, model=f"azure/{name}", **kwargs)
+        for name in names
+    ]
+
+
+def rate_limit_error() -> litellm.RateLimitError:
+    return litellm.RateLimitError("slow down", llm_provider="azure", model="gpt-4o")
+
+
+def test_litellm_kwargs(monkeypatch):
+    monkeypatch.setenv("EU_API_KEY", "secret")
+    deployment = Deployment(
+        name="eu",
+        llm=llm.name,
+        model="azure/gpt-4o-eu",
+        litellm_params={"api_key": "os.environ/EU_API_KEY", "api_version": "1"},
+    )
+    assert litellm_kwargs(deployment) == {
+        "model": "azure/gpt-4o-eu",
+        "api_key": "secret",
+        "api_version": "1",
+    }
+
+
+def test_rank_by_latency():
+    router = Router(alpha=0.5)
+    eu, us = deployments = make_deployments("eu", "us")
+    router._record_latency("eu", 2)
+    router._record_latency("us", 1)
+    assert router.rank(deployments) == [us, eu]
+
+    router._record_latency("us", 5)
+    assert router.stats["us"].latency == 3
+    assert router.rank(deployments) == [eu, us]
+
+
+def test_rank_skips_full_deployments():
+    router = Router()
+    eu, us = deployments = make_deployments("eu", "us", max_concurrency=1)
+    router._stats("eu").in_flight = 1
+    assert router.rank(deployments) == [us]
+
+
+@pytest.mark.anyio
+async def test_complete_without_deployments():
+    calls = []
+
+    async def call(kwargs):
+        calls.append(kwargs)
+        return litellm.ModelResponse()
+
+    response = await Router().complete(llm, [], call)
+    assert calls == [{"model": "gpt-4o"}]
+    assert response._hidden_params["deployment"] is None
+
+
+@pytest.mark.anyio
+async def test_complete_fails_over():
+    router = Router(cooldown=30)
+    deployments = make_deployments("eu", "us")
+    calls = []
+
+    async def call(kwargs):
+        calls.append(kwargs["model"])
+        if kwargs["model"] == "azure/eu":
+            raise rate_limit_error()
+        return litellm.ModelResponse()
+
+    response = await router.complete(llm, deployments, call)
+    assert calls == ["azure/eu", "azure/us"]
+    assert response._hidden_params["deployment"] == "us"
+    assert router.stats["eu"].in_flight == router.stats["us"].in_flight == 0
+
+    # eu is cooling down
+    await router.complete(llm, deployments, call)
+    assert calls == ["azure/eu", "azure/us", "azure/us"]
+
+
+@pytest.mark.anyio
+async def test_complete_raises_when_every_deployment_fails():
+    async def call(kwargs):
+        raise rate_limit_error()
+
+    router = Router()
+    deployments = make_deployments("eu", "us")
+    with pytest.raises(litellm.RateLimitError):
+        await router.complete(llm, deployments, call)
+    with pytest.raises(NoCapacityError):
+        await router.complete(llm, deployments, call)
+
+
+@pytest.mark.anyio
+async def test_complete_does_not_fail_over_bad_requests():
+    calls = []
+
+    async def call(kwargs):
+        calls.append(kwargs["model"])
+        raise litellm.BadRequestError("bad", model="gpt-4o", llm_provider="azure")
+
+    with pytest.raises(litellm.BadRequestError):
+        await Router().complete(llm, make_deployments("eu", "us"), call)
+    assert calls == ["azure/eu"]
+
+
+@pytest.mark.anyio
+async def test_complete_releases_capacity_when_cancelled():
+    started = asyncio.Event()
+
+    async def call(kwargs):
+        started.set()
+        await asyncio.sleep(10)
+
+    router = Router()
+    deployments = make_deployments("eu", max_concurrency=1)
+    task = asyncio.create_task(router.complete(llm, deployments, call))
+    await started.wait()
+    assert router.rank(deployments) == []
+
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+    assert router.stats["eu"].in_flight == 0
+    assert router.rank(deployments) == deployments
+
+
+@pytest.mark.anyio
+async def test_stream_holds_capacity_until_read():
+    router = Router()
+    deployments = make_deployments("eu", max_concurrency=1)
+    finish = asyncio.Event()
+
+    async def parts():
+        yield "hello"
+        await finish.wait()
+        yield "world"
+
+    async def open_stream(kwargs):
+        return parts()
+
+    stream = await router.stream(llm, deployments, open_stream)
+    assert stream.deployment == "eu"
+    assert router.rank(deployments) == []
+
+    finish.set()
+    assert [part async for part in stream] == ["hello", "world"]
+    assert router.rank(deployments) == deployments
+
+
+@pytest.fixture
+def gpt_4o_deployments(session, gpt_4o):
+    deployments = make_deployments("eu", "us")
+    session.add_all(deployments)
+    session.commit()
+    yield deployments
+    for deployment in deployments:
+        session.delete(deployment)
+    session.commit()
+
+
+def test_chat_completions_logs_deployment(
+    client, payload, normal_user, gpt_4o_deployments, monkeypatch
+):
+    calls = []
+
+    async def _acompletion(**kwargs):
+        calls.append(kwargs["model"])
+        if kwargs["model"] == "azure/eu":
+            raise rate_limit_error()
+        return await acompletion(**kwargs)
+
+    monkeypatch.setattr(api, "acompletion", _acompletion)
+
+    response = client.post(
+        "/chat/completions",
+        json=dict(payload, stream=False),
+        headers=get_headers(normal_user),
+    )
+    assert response.status_code == httpx.codes.OK
+    assert calls == ["azure/eu", "azure/us"]
+
+    logs = client.get("/spend/logs", headers=get_headers(normal_user)).json()["items"]
+    assert [log["deployment"] for log in logs] == ["us"]
+
+
+def test_chat_completions_no_capacity(
+    client, payload, normal_user, gpt_4o_deployments, monkeypatch
+):
+    async def _acompletion(**kwargs):
+        raise rate_limit_error()
+
+    monkeypatch.setattr(api, "acompletion", _acompletion)
+
+    headers = get_headers(normal_user)
+    with pytest.raises(litellm.RateLimitError):
+        client.post("/chat/completions", json=payload, headers=headers)
+
+    response = client.post("/chat/completions", json=payload, headers=headers)
+    assert response.status_code == httpx.codes.SERVICE_UNAVAILABLE
+    assert response.json() == {"detail": "model=gpt-4o has no deployment available"}
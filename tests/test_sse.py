@@ -0,0 +1,106 @@
+import asyncio
+import json
+
+import pytest
+from litellm import acompletion
+
+from llm_freeway import api
+from llm_freeway.settings import env
+from llm_freeway.sse import coalesce, encode_event
+from tests.conftest import get_headers
+
+
+@pytest.mark.anyio
+async def test_encode_event():
+    stream = await acompletion(
+        model="gpt-4o",
+        messages=[{"role": "user", "content": "hello :)"}],
+        mock_response="hello, how can i help you?",
+        stream=True,
+    )
+    async for part in stream:
+        assert encode_event(part) == f"data: {part.model_dump_json()}\n\n".encode()
+
+
+async def make_events(*delays: float, closed: list | None = None):
+    try:
+        for i, delay in enumerate(delays):
+            await asyncio.sleep(delay)
+            yield f"{i};".encode()
+    finally:
+        if closed is not None:
+            closed.append(True)
+
+
+@pytest.mark.anyio
+async def test_coalesce():
+    events = make_events(0, 0, 0, 0.1, 0)
+    assert [data async for data in coalesce(events, 0.05, 1024)] == [
+        b"0;1;2;",
+        b"3;4;",
+    ]
+
+
+@pytest.mark.anyio
+async def test_coalesce_max_bytes():
+    events = make_events(*[0] * 5)
+    assert [data async for data in coalesce(events, 1, 4)] == [
+        b"0;1;",
+        b"2;3;",
+        b"4;",
+    ]
+
+
+@pytest.mark.anyio
+async def test_coalesce_error():
+    async def events():
+        yield b"0;"
+        raise ValueError("upstream failed")
+
+    with pytest.raises(ValueError):
+        async for _ in coalesce(events(), 0.01, 1024):
+            pass
+
+
+@pytest.mark.anyio
+async def test_coalesce_closes_events():
+    closed = []
+    stream = coalesce(make_events(0, 10, closed=closed), 0.01, 1024)
+    assert await anext(stream) == b"0;"
+    await stream.aclose()
+    assert closed == [True]
+
+
+@pytest.mark.anyio
+async def test_coalesce_closes_events_between_writes():
+    closed = []
+    # the pump waits for the first write to drain, between events
+    stream = coalesce(make_events(0, 0, closed=closed), 1, 1)
+    assert await anext(stream) == b"0;"
+    await stream.aclose()
+    assert closed == [True]
+
+
+@pytest.mark.parametrize("interval", [0, 0.01])
+def test_chat_completions_event_stream(
+    client, payload, normal_user, gpt_4o, monkeypatch, interval
+):
+    monkeypatch.setattr(
+        api, "env", env.model_copy(update={"sse_coalesce_interval": interval})
+    )
+    response = client.post(
+        "/chat/completions",
+        json=dict(payload, stream=True),
+        headers=get_headers(normal_user),
+    )
+    assert response.headers["content-type"].startswith("text/event-stream")
+    assert response.headers["cache-control"] == "no-cache"
+
+    events = response.text.removesuffix("\n\n").split("\n\n")
+    assert events[-1] == "data: [DONE]"
+    content = "".join(
+        choice["delta"]["content"] or ""
+        for event in events[:-1]
+        for choice in json.loads(event.removeprefix("data: "))["choices"]
+    )
+    assert content == payload["mock_response"]
@@ -0,0 +1,129 @@
+from datetime import datetime
+
+import httpx
+import pytest
+
+from llm_freeway.database import EventLog
+from llm_freeway.summary import SummaryCache, truncate
+from tests.conftest import get_headers
+
+
+def make_log(user, model, timestamp, prompt_tokens=10, completion_tokens=5):
+    return EventLog(
+        timestamp=timestamp,
+        response_id="1",
+        user_id=user.id,
+        model=model.name,
+        prompt_tokens=prompt_tokens,
+        completion_tokens=completion_tokens,
+        cost_usd=1,
+    )
+
+
+@pytest.fixture
+def logs(session, normal_user, admin_user, gpt_4o, gpt_4o_mini):
+    logs = [
+        make_log(normal_user, gpt_4o, datetime(2024, 1, 1, 10, 15)),
+        make_log(normal_user, gpt_4o, datetime(2024, 1, 1, 10, 45)),
+        make_log(normal_user, gpt_4o, datetime(2024, 1, 1, 11, 30)),
+        make_log(normal_user, gpt_4o_mini, datetime(2024, 1, 2, 9, 0)),
+        make_log(normal_user, gpt_4o, datetime(2024, 2, 1, 0, 0)),
+        make_log(admin_user, gpt_4o, datetime(2024, 1, 1, 10, 30)),
+    ]
+    session.add_all(logs)
+    session.commit()
+    yield logs
+    for log in session.query(EventLog).all():
+        session.delete(log)
+    session.commit()
+
+
+@pytest.mark.parametrize(
+    "bucket, expected",
+    [
+        ("hour", datetime(2024, 3, 15, 13)),
+        ("day", datetime(2024, 3, 15)),
+        ("month", datetime(2024, 3, 1)),
+    ],
+)
+def test_truncate(bucket, expected):
+    assert truncate(datetime(2024, 3, 15, 13, 45, 12, 500), bucket) == expected
+
+
+def test_summary_cache_closed_until():
+    cache = SummaryCache(max_size=10, grace=60)
+    now = datetime(2024, 3, 15, 13, 0, 30)
+    assert cache.closed_until("hour", now) == datetime(2024, 3, 15, 12)
+    assert cache.closed_until("day", now) == datetime(2024, 3, 15)
+
+
+def test_summary_cache_evicts_least_recently_used():
+    cache = SummaryCache(max_size=2, grace=60)
+    cache.set("a", datetime(2024, 1, 1), [])
+    cache.set("b", datetime(2024, 1, 1), [])
+    cache.get("a")
+    cache.set("c", datetime(2024, 1, 1), [])
+    assert list(cache.entries) == ["a", "c"]
+
+
+def summarise(client, user, **params):
+    response = client.get("/spend/summary", params=params, headers=get_headers(user))
+    assert response.status_code == httpx.codes.OK
+    return [
+        (item["bucket"], item["model"], item["requests"], item["prompt_tokens"])
+        for item in response.json()["items"]
+    ]
+
+
+def test_spend_summary_by_hour(client, logs, normal_user):
+    assert summarise(client, normal_user, bucket="hour") == [
+        ("2024-01-01T10:00:00", "gpt-4o", 2, 20),
+        ("2024-01-01T11:00:00", "gpt-4o", 1, 10),
+        ("2024-01-02T09:00:00", "gpt-4o-mini", 1, 10),
+        ("2024-02-01T00:00:00", "gpt-4o", 1, 10),
+    ]
+
+
+def test_spend_summary_by_month(client, logs, normal_user):
+    assert summarise(client, normal_user, bucket="month") == [
+        ("2024-01-01T00:00:00", "gpt-4o", 3, 30),
+        ("2024-01-01T00:00:00", "gpt-4o-mini", 1, 10),
+        ("2024-02-01T00:00:00", "gpt-4o", 1, 10),
+    ]
+
+
+def test_spend_summary_admin_sees_every_user(client, logs, admin_user):
+    response = client.get(
+        "/spend/summary",
+        params=dict(bucket="day", end_date="2024-01-02T00:00:00"),
+        headers=get_headers(admin_user),
+    )
+
+    items = response.json()["items"]
+    assert {item["user_id"] for item in items} == {str(log.user_id) for log in logs}
+    assert sum(item["requests"] for item in items) == 4
+    assert sum(item["cost_usd"] for item in items) == 4
+
+
+def test_spend_summary_caches_closed_buckets(
+    client, session, logs, normal_user, gpt_4o
+):
+    assert len(summarise(client, normal_user, bucket="day")) == 3
+
+    # a late log for a closed bucket isn't seen, one for today is
+    session.add(make_log(normal_user, gpt_4o, datetime(2024, 1, 1, 12)))
+    session.add(make_log(normal_user, gpt_4o, datetime.now()))
+    session.commit()
+
+    items = summarise(client, normal_user, bucket="day")
+    assert items[0] == ("2024-01-01T00:00:00", "gpt-4o", 3, 30)
+    assert len(items) == 4
+
+
+def test_spend_summary_aware_dates(client, logs, normal_user):
+    end_date = datetime(2024, 1, 2).astimezone().isoformat()
+    # the second request is served from the cache
+    first, second = (
+        summarise(client, normal_user, end_date=end_date) for _ in range(2)
+    )
+    assert first == second == [("2024-01-01T00:00:00", "gpt-4o", 3, 30)]
@@ -0,0 +1,60 @@
+import threading
+
+import httpx
+import pytest
+
+from llm_freeway import tokens
+from llm_freeway.tokens import TokenEstimator
+from tests.conftest import get_headers
+
+messages = [{"role": "user", "content": "hello :)"}]
+
+
+@pytest.fixture
+def counts(monkeypatch):
+    calls = []
+    token_counter = tokens.token_counter
+
+    def _token_counter(**kwargs):
+        calls.append(threading.current_thread() is threading.main_thread())
+        return token_counter(**kwargs)
+
+    monkeypatch.setattr(tokens, "token_counter", _token_counter)
+    yield calls
+
+
+@pytest.mark.anyio
+async def test_token_estimator(counts):
+    estimator = TokenEstimator(completion_tokens=100)
+
+    prompt_tokens = await estimator.estimate("gpt-4o", messages, max_tokens=1) - 1
+    assert 0 < prompt_tokens < 20
+    assert await estimator.estimate("gpt-4o", messages) == prompt_tokens + 100
+    # the tokenizer is loaded off the event loop, then counts are inline
+    assert counts == [False, True]
+
+
+@pytest.mark.anyio
+async def test_token_estimator_offloads_long_prompts(counts):
+    estimator = TokenEstimator(offload_chars=100)
+    await estimator.estimate("gpt-4o", messages)
+    long_messages = [{"role": "user", "content": "hello " * 100}]
+    assert await estimator.estimate("gpt-4o", long_messages, max_tokens=1) > 100
+    assert counts == [False, False]
+
+
+def test_chat_completions_reserves_tokens(client, payload, normal_user, gpt_4o):
+    response = client.post(
+        "/chat/completions",
+        json=dict(payload, max_tokens=2_000),
+        headers=get_headers(normal_user),
+    )
+    assert response.status_code == httpx.codes.TOO_MANY_REQUESTS
+    assert response.json()["detail"].startswith("tokens_per_minute=0 plus an estimated")
+
+    response = client.post(
+        "/chat/completions",
+        json=dict(payload, max_tokens=500),
+        headers=get_headers(normal_user),
+    )
+    assert response.status_code == httpx.codes.OK
@@ -0,0 +1,69 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import litellm
+import pytest
+from litellm.llms.custom_httpx.http_handler import AsyncHTTPHandler
+
+from llm_freeway.metrics import metrics
+from llm_freeway.upstream import UpstreamClients
+
+
+class KeepAliveHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Content-Length", "2")
+        self.end_headers()
+        self.wfile.write(b"ok")
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def server_url():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), KeepAliveHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+
+
+def test_completion_kwargs():
+    clients = UpstreamClients()
+
+    kwargs = clients.completion_kwargs("bedrock/anthropic.claude-3-sonnet")
+    assert isinstance(kwargs["client"], AsyncHTTPHandler)
+    assert kwargs["client"].client is clients.get("bedrock")
+    assert (
+        clients.completion_kwargs("bedrock/amazon.titan")["client"]
+        is (kwargs["client"])
+    )
+
+    assert clients.completion_kwargs("azure/gpt-4o") == {}
+    assert clients.completion_kwargs("not-a-model") == {}
+
+
+@pytest.mark.anyio
+async def test_openai_client_shared_with_litellm():
+    clients = UpstreamClients()
+    await clients.start()
+    assert litellm.aclient_session is clients.get("openai")
+    await clients.stop()
+    assert litellm.aclient_session is None
+
+
+@pytest.mark.anyio
+async def test_connections_reused(server_url):
+    clients = UpstreamClients()
+    client = clients.get("test")
+
+    for _ in range(3):
+        response = await client.get(server_url)
+        assert response.text == "ok"
+    await clients.stop()
+
+    assert metrics.get("upstream_requests_total", provider="test") == 3
+    assert metrics.get("upstream_connections_total", provider="test") == 1